@@ -0,0 +1 @@
+# shared helpers for the streamlit pages (data loading, analysis engines, chart building)
@@ -0,0 +1,212 @@
+import argparse
+import ast
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import streamlit as st
+
+from atus.charts import compile_chart
+from atus.data import DATA_DIR
+
+
+# per-page benchmarks outside the streamlit runtime. a page's imports, constants and functions are
+# pulled out of its source and run on their own (none of its st.* calls), then every case times
+# the page's three stages: load (its load_data with the resource cache cleared), transform (the
+# shard or slice a selection hands to the plotter) and spec (plotter + vega-lite compile, without
+# the atus.charts LRU). each stage also gets its peak python memory, and each chart its spec and
+# arrow payload size. results are json; with a baseline, any stage that got slower, hungrier or
+# bigger by more than the threshold fails the run
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pages')
+BENCH_DIR = os.path.join(DATA_DIR, 'bench')
+RESULTS = os.path.join(BENCH_DIR, 'results.json')
+BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+STAGES = ['load', 'transform', 'spec']
+REPEAT = 5
+# relative slowdown / growth that fails the run
+THRESHOLD = 0.25
+# differences under these are noise, whatever the ratio
+MIN_SECONDS = 0.005
+MIN_BYTES = 1 << 20
+
+
+def _first(shards):
+    return shards[next(iter(shards))]
+
+
+# case -> (page file, load(ns) -> data, transform(ns, data) -> (plotter frames, plotter params), plotter)
+CASES = {
+    'tsne': ('2_Similarities_Among_Time_Periods.py', lambda ns: ns['load_bands']('month', None),
+             lambda ns, data: ((data,), {'method': 'tSNE', 'grain': 'month'}), 'tsne_plotter'),
+    'monthly': ('3_Trends_in_Average_Time_Spent.py', lambda ns: ns['load_data'](),
+                lambda ns, data: ((_first(ns['load_shards']()),), {}), 'monthly_plotter'),
+    'waterfall': ('4_COVID_Impact_on_Activity_Participation.py', lambda ns: ns['load_data'](*ns['DEFAULT_MONTHS']),
+                  lambda ns, data: ((_first(ns['load_shards'](*ns['DEFAULT_MONTHS'])),), {}), 'fall_plotter'),
+    'models': ('5_The_Numbers_Behind_These_Trends.py', lambda ns: ns['load_data'](),
+               lambda ns, data: ((data, _first(ns['load_shards']())), {}), 'plotter'),
+    'shifting': ('6_Are_We_Shifting_Back_to_Normal?.py', lambda ns: ns['load_data'](),
+                 lambda ns, data: ((data,), {}), 'plotter'),
+    'age_sex': ('7_Trends_by_Age_&_Sex.py', lambda ns: ns['load_data']('none'),
+                lambda ns, data: ((_first(ns['load_shards']('none')),),
+                                  {'domain': (data.DIFF.min(), data.DIFF.max())}), 'bar_plotter'),
+    'healthcare': ('8_Healthcare_Workers.py', lambda ns: ns['load_data'](),
+                   lambda ns, data: ((_first(ns['load_shards']()),), {'starts': ns['load_starts']()}),
+                   'healthcare_plotter'),
+    'stringency': ('9_Stringency_and_Time_Use.py', lambda ns: ns['load_data'](),
+                   lambda ns, data: ((_first(ns['load_shards']()[0]),), {}), 'heatmap_plotter'),
+}
+
+
+def page_definitions(filename, module='atus_bench_page'):
+    # the page's imports, functions and UPPER_CASE constants, without the rest of its script.
+    # st.cache_resource keys functions by module and source, so with module='__main__' (what
+    # streamlit runs pages as) the loaders share their caches with the running app
+    path = os.path.join(PAGES_DIR, filename)
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    keep = [node for node in tree.body
+            if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef))
+            or isinstance(node, ast.Assign) and all(isinstance(t, ast.Name) and t.id.isupper() for t in node.targets)]
+    namespace = {'__name__': module, '__file__': path}
+    exec(compile(ast.Module(keep, type_ignores=[]), path, 'exec'), namespace)
+    return namespace
+
+
+def _stages(ns, case):
+    # one run of load -> transform -> spec, as (stage, seconds) plus the compiled chart
+    _, load, transform, plotter = case
+    st.cache_resource.clear()
+    times = {}
+    start = time.perf_counter()
+    data = load(ns)
+    times['load'] = time.perf_counter() - start
+    start = time.perf_counter()
+    frames, params = transform(ns, data)
+    times['transform'] = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled = compile_chart(ns[plotter](*frames, **params))
+    times['spec'] = time.perf_counter() - start
+    return times, compiled
+
+
+def _peaks(ns, case):
+    # peak traced memory of every stage, from one more run under tracemalloc (slower, so untimed)
+    _, load, transform, plotter = case
+    st.cache_resource.clear()
+    peaks = {}
+    tracemalloc.start()
+    try:
+        data = load(ns)
+        peaks['load'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        frames, params = transform(ns, data)
+        peaks['transform'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        compile_chart(ns[plotter](*frames, **params))
+        peaks['spec'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run_case(name, repeat=REPEAT):
+    case = CASES[name]
+    ns = page_definitions(case[0])
+    runs = []
+    for _ in range(repeat):
+        times, (text, datasets) = _stages(ns, case)
+        runs.append(times)
+    peaks = _peaks(ns, case)
+    result = {stage: {'cold': runs[0][stage],
+                      'median': statistics.median(r[stage] for r in runs[1:] or runs),
+                      'peak_bytes': peaks[stage]} for stage in STAGES}
+    result['spec_bytes'] = len(text)
+    result['data_bytes'] = sum(len(d) for d in datasets.values())
+    return result
+
+
+def run(cases=None, repeat=REPEAT):
+    return {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'repeat': repeat,
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'cases': {name: run_case(name, repeat) for name in cases or CASES},
+    }
+
+
+def _worse(new, old, threshold, floor):
+    return new > old * (1 + threshold) and new - old > floor
+
+
+def regressions(results, baseline, threshold=THRESHOLD, min_seconds=MIN_SECONDS, min_bytes=MIN_BYTES):
+    # (case, metric, baseline, now) for everything beyond the threshold. cases or metrics missing
+    # from the baseline are new, not regressions
+    found = []
+    for name, now in results['cases'].items():
+        before = baseline['cases'].get(name)
+        if before is None:
+            continue
+        for stage in STAGES:
+            if _worse(now[stage]['median'], before[stage]['median'], threshold, min_seconds):
+                found.append((name, stage + ' seconds', before[stage]['median'], now[stage]['median']))
+            if _worse(now[stage]['peak_bytes'], before[stage]['peak_bytes'], threshold, min_bytes):
+                found.append((name, stage + ' peak bytes', before[stage]['peak_bytes'], now[stage]['peak_bytes']))
+        for metric in ('spec_bytes', 'data_bytes'):
+            if _worse(now[metric], before[metric], threshold, 0):
+                found.append((name, metric, before[metric], now[metric]))
+    return found
+
+
+def _write(results, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp, path)
+
+
+def report(results):
+    lines = ['%-12s %9s %9s %9s %9s %9s %9s %10s %10s' % ('case', 'load', 'cold', 'transform', 'spec', 'cold',
+                                                         'peak MB', 'spec KB', 'data KB')]
+    for name, r in results['cases'].items():
+        peak = max(r[stage]['peak_bytes'] for stage in STAGES) / 2 ** 20
+        lines.append('%-12s %8.1fms %8.1fms %8.1fms %8.1fms %8.1fms %9.1f %10.1f %10.1f' % (
+            name, 1e3 * r['load']['median'], 1e3 * r['load']['cold'], 1e3 * r['transform']['median'],
+            1e3 * r['spec']['median'], 1e3 * r['spec']['cold'], peak, r['spec_bytes'] / 1024, r['data_bytes'] / 1024))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time every page stage and compare against a stored baseline.')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), help='default: all of them')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--out', default=RESULTS)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--min-seconds', type=float, default=MIN_SECONDS)
+    parser.add_argument('--min-bytes', type=int, default=MIN_BYTES)
+    args = parser.parse_args()
+
+    results = run(args.cases, args.repeat)
+    _write(results, args.out)
+    print(report(results))
+    print('wrote', args.out)
+
+    if args.save_baseline:
+        _write(results, args.baseline)
+        print('baseline saved to', args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, args.threshold, args.min_seconds, args.min_bytes)
+        for name, metric, before, now in found:
+            print('REGRESSION %s %s: %.6g -> %.6g' % (name, metric, before, now))
+        if found:
+            sys.exit(1)
+        print('no regressions against', args.baseline)
@@ -0,0 +1,285 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtri
+
+from atus.data import DATA_DIR
+from atus.dimensions import key_frame
+from atus.ingest import ACTIVITY_NAMES, read_extract, respondents, rollup
+from atus.shared import frame
+
+
+# confidence bands for the monthly averages the pages plot. without microdata, each month is
+# resampled as circular blocks of a week of days, from the daily table (or from the ingest state
+# for occupation groups), so the weekday mix and day-to-day dependence inside a week carry over.
+# with an extract, respondents are resampled instead (poisson bootstrap). every month is one task
+# with its own seed, vectorized over resamples and series. the pages resample in their own thread
+# (a monthly table takes a fraction of a second); the command line can spread the tasks over a
+# process pool. results are cached on disk by a hash of the input data and parameters, so pages
+# read them back straight away
+
+BOOTSTRAP_DIR = os.path.join(DATA_DIR, 'bootstrap')
+
+RESAMPLES = 1000
+# days per block
+BLOCK = 7
+LEVEL = 0.95
+BAND_COLUMNS = ['estimate', 'lower', 'upper']
+
+# cache path -> lock, so threads asking for the same cold bands compute them once
+_lock = threading.Lock()
+_filling = {}
+
+
+def block_means(sums, counts, block=BLOCK, resamples=RESAMPLES, seed=0):
+    # (resamples, series) weighted means of one month resampled as circular blocks of days. sums
+    # and counts are (days, series): n * mean and n of every day
+    days = len(sums)
+    wrapped = np.arange(days + block - 1) % days
+    total = np.zeros((days + block, sums.shape[1]))
+    count = np.zeros_like(total)
+    total[1:] = np.cumsum(sums[wrapped], axis=0)
+    count[1:] = np.cumsum(counts[wrapped], axis=0)
+    block_sums = total[block:block + days] - total[:days]
+    block_counts = count[block:block + days] - count[:days]
+
+    starts = np.random.default_rng(seed).integers(0, days, (resamples, -(-days // block)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return block_sums[starts].sum(axis=1) / block_counts[starts].sum(axis=1)
+
+
+def poisson_means(minutes, weights, resamples=RESAMPLES, seed=0):
+    # (resamples, activities) weighted means of one month's respondents, every respondent counted a
+    # poisson(1) number of times per resample
+    counts = np.random.default_rng(seed).poisson(1.0, (resamples, len(weights))) * weights
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (counts @ minutes) / counts.sum(axis=1, keepdims=True)
+
+
+def _task(args):
+    method, arrays, params = args
+    return (block_means if method == 'block' else poisson_means)(*arrays, **params)
+
+
+def run(tasks, workers=1):
+    # every (method, arrays, params) task, in a process pool when there's more than one worker and
+    # task. only the command line asks for workers: forking the threaded streamlit server could
+    # leave a child holding another thread's lock
+    workers = min(workers, len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            return list(pool.map(_task, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+    return [_task(task) for task in tasks]
+
+
+def _interval(draws, level=LEVEL):
+    tail = (1 - level) / 2
+    return np.nanquantile(draws, [tail, 1 - tail], axis=0)
+
+
+def _months(dates):
+    return dates.dt.year.to_numpy() * 12 + dates.dt.month.to_numpy() - 1
+
+
+def _long(months, series, keys, estimate, lower, upper):
+    # (YEAR, MONTH, series..., estimate, lower, upper) from (months, series) arrays
+    n_series = len(keys)
+    out = pd.DataFrame({'YEAR': np.repeat(months // 12, n_series), 'MONTH': np.repeat(months % 12 + 1, n_series)})
+    for i, col in enumerate(series):
+        out[col] = np.tile(np.asarray([key[i] for key in keys], dtype=object), len(months))
+    out['estimate'] = np.ravel(estimate)
+    out['lower'] = np.ravel(lower)
+    out['upper'] = np.ravel(upper)
+    return out
+
+
+def block_bootstrap(daily, series=('ACTIVITY',), block=BLOCK, resamples=RESAMPLES, level=LEVEL, seed=0, workers=1):
+    # monthly bands from a daily (DATE, series..., mean, n) table
+    series = list(series)
+    daily = daily.assign(S=daily['mean'] * daily['n'])
+    grid = daily.pivot_table(index='DATE', columns=series, values=['S', 'n'], aggfunc='sum', observed=True).fillna(0.0)
+    keys = [key if isinstance(key, tuple) else (key,) for key in grid['S'].columns]
+    sums, counts = grid['S'].to_numpy(), grid['n'].to_numpy()
+    months = _months(pd.Series(grid.index))
+    unique = np.unique(months)
+
+    tasks = [('block', (sums[months == m], counts[months == m]),
+              dict(block=block, resamples=resamples, seed=seed + i)) for i, m in enumerate(unique)]
+    draws = run(tasks, workers)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        estimate = np.array([sums[months == m].sum(axis=0) / counts[months == m].sum(axis=0) for m in unique])
+    lower, upper = np.array([_interval(d, level) for d in draws]).transpose(1, 0, 2)
+    return _long(unique, series, keys, estimate, lower, upper)
+
+
+def respondent_bootstrap(people, minutes, series=(), resamples=RESAMPLES, level=LEVEL, seed=0, workers=1):
+    # monthly bands from the respondents themselves, per value of the people columns in series
+    series = list(series)
+    groups = people.groupby(series, observed=True, sort=True) if series else [((), people)]
+    months = _months(people['DATE'])
+    weights = people['weight'].to_numpy()
+    tasks, cells = [], []
+    for key, part in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        rows = part.index.to_numpy()
+        for m in np.unique(months[rows]):
+            month = rows[months[rows] == m]
+            x, w = minutes[month], weights[month]
+            tasks.append(('poisson', (x, w), dict(resamples=resamples, seed=seed + len(tasks))))
+            cells.append((key, m, w @ x / w.sum()))
+    draws = run(tasks, workers)
+
+    frames = []
+    for (key, m, estimate), d in zip(cells, draws):
+        lower, upper = _interval(d, level)
+        frames.append(pd.DataFrame({'YEAR': m // 12, 'MONTH': m % 12 + 1, **dict(zip(series, key)),
+                                    'ACTIVITY': ACTIVITY_NAMES, 'estimate': estimate, 'lower': lower, 'upper': upper}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def normal_bands(table, level=LEVEL):
+    # mean +- z sd / sqrt(n), for tables that only come with their moments. minutes can't go below 0
+    z = ndtri(1 - (1 - level) / 2)
+    half = z * table['sd'] / np.sqrt(table['n'])
+    return table.assign(estimate=table['mean'], lower=(table['mean'] - half).clip(lower=0), upper=table['mean'] + half)
+
+
+def cache_path(name, data, params):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([name, sorted(params.items())]).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return os.path.join(BOOTSTRAP_DIR, '%s-%s.parquet' % (name, digest.hexdigest()))
+
+
+def _key(params):
+    # the parameters a result depends on, defaults filled in so the pages and the command line agree
+    return {'resamples': RESAMPLES, 'level': LEVEL, **params}
+
+
+def respondent_path(name, data, params):
+    # bands worked out from an extract (see the command line), keyed like the block bootstrap on
+    # the data the page would otherwise resample, so refreshing that data retires them
+    key = _key({k: v for k, v in params.items() if k in ('resamples', 'level')})
+    return cache_path(name + '-respondents', data, key)
+
+
+def _save(out, path):
+    os.makedirs(BOOTSTRAP_DIR, exist_ok=True)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    out.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def cached(name, data, compute, workers=1, **params):
+    # compute(data, **params), read back from disk when this data was bootstrapped before, from
+    # respondents or from days. the number of workers doesn't change the result (every month has
+    # its own seed), so it's not in the key
+    respondents = respondent_path(name, data, params)
+    if os.path.exists(respondents):
+        return pd.read_parquet(respondents)
+    path = cache_path(name, data, _key(params))
+    with _lock:
+        filling = _filling.setdefault(path, threading.Lock())
+    with filling:
+        if os.path.exists(path):
+            return pd.read_parquet(path)
+        out = compute(data, workers=workers, **params)
+        _save(out, path)
+    return out
+
+
+def occupation_daily():
+    # (DATE, OCC_GROUP, ACTIVITY, mean, n) from the ingest state, holiday diary days left out like
+    # avg_time_all_years_bymonth_occ. FileNotFoundError without the state
+    from atus.incremental import load_state, partition_months
+
+    if not partition_months():
+        raise FileNotFoundError('no ingest state, run python -m atus.incremental init <extract>')
+    state = load_state()
+    return rollup(state[~state['HOLIDAY']], ['DATE', 'OCC_GROUP', 'ACTIVITY'])
+
+
+def monthly_daily():
+    # what monthly_combined's bands come from: the daily table's 17 activities, without the byday
+    # subcategories, activities the dimensions don't know and the empty April 2020 rows
+    daily = frame('avg_time_all_years_byday')
+    keep = daily['ACTIVITY_ID'].between(1, len(ACTIVITY_NAMES)) & daily['mean'].notna()
+    return daily[keep][['DATE', 'ACTIVITY', 'mean', 'n']]
+
+
+def occupation_input():
+    # what avg_time_all_years_bymonth_occ's bands come from: the ingest state rolled up by day when
+    # there is one (True), otherwise the table itself (False)
+    try:
+        return occupation_daily()[['DATE', 'OCC_GROUP', 'ACTIVITY', 'mean', 'n']], True
+    except FileNotFoundError:
+        return frame('avg_time_all_years_bymonth_occ'), False
+
+
+def monthly_bands(workers=1, **params):
+    # bands for monthly_combined, from the daily table
+    return cached('monthly_combined', monthly_daily(), block_bootstrap, workers=workers, **params)
+
+
+def occupation_bands(workers=1, **params):
+    # bands for avg_time_all_years_bymonth_occ: block bootstrap of the ingest state when there is
+    # one, otherwise the normal interval from the table's own sd and n
+    data, daily = occupation_input()
+    if daily:
+        return cached('avg_time_all_years_bymonth_occ', data, block_bootstrap, workers=workers,
+                      series=('OCC_GROUP', 'ACTIVITY'), **params)
+    respondents = respondent_path('avg_time_all_years_bymonth_occ', data, params)
+    if os.path.exists(respondents):
+        return pd.read_parquet(respondents)
+    bands = normal_bands(data, params.get('level', LEVEL))
+    return bands[['YEAR', 'MONTH', 'OCC_GROUP', 'ACTIVITY'] + BAND_COLUMNS]
+
+
+def attach(table, bands, keys=('YEAR', 'MONTH', 'ACTIVITY')):
+    # lower / upper around the table's own mean: the bootstrap's distance from its estimate is
+    # moved onto the plotted value, so a band always contains its bar or point. the two sides are
+    # joined on their integer dimension keys (atus.dimensions)
+    left, right = key_frame(table, keys), key_frame(bands, keys)
+    right = right.assign(**{c: bands[c].to_numpy() for c in BAND_COLUMNS})
+    merged = left.merge(right, on=list(left.columns), how='left')
+    mean = table['mean'].to_numpy()
+    out = table.copy()
+    out['lower'] = mean - (merged['estimate'] - merged['lower']).to_numpy()
+    out['upper'] = mean + (merged['upper'] - merged['estimate']).to_numpy()
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bootstrap confidence bands for the monthly tables and cache them.')
+    parser.add_argument('extract', nargs='?', help='resample respondents from this IPUMS ATUS extract instead of days')
+    parser.add_argument('--resamples', type=int, default=RESAMPLES)
+    parser.add_argument('--level', type=float, default=LEVEL)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    params = dict(resamples=args.resamples, level=args.level, workers=args.workers)
+    if args.extract:
+        people, minutes = [], []
+        for chunk in read_extract(args.extract):
+            chunk_people, chunk_minutes = respondents(chunk)
+            # like the monthly tables, holiday diary days are left out
+            keep = ~chunk_people['HOLIDAY'].to_numpy()
+            people.append(chunk_people[keep])
+            minutes.append(chunk_minutes[keep])
+        people = pd.concat(people, ignore_index=True)
+        minutes = np.concatenate(minutes)
+        # keyed on the data each page resamples without them, see respondent_path
+        for name, series, data in (('monthly_combined', (), monthly_daily()),
+                                   ('avg_time_all_years_bymonth_occ', ('OCC_GROUP',), occupation_input()[0])):
+            path = respondent_path(name, data, params)
+            _save(respondent_bootstrap(people, minutes, series, **params), path)
+            print('wrote', path)
+    else:
+        for name, bands in (('monthly_combined', monthly_bands), ('avg_time_all_years_bymonth_occ', occupation_bands)):
+            print(name, len(bands(**params)), 'bands')
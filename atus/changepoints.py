@@ -0,0 +1,211 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from atus.data import DATA_DIR, csv_path
+from atus.embedding import activity_matrix
+
+
+# where the COVID periods begin, found in the data instead of hard-coded: PELT over the day x
+# activity matrix of avg_time_all_years_byday, with one gaussian mean-shift cost summed over all
+# 17 activities, so a regime change is a shift in the whole day at once. the cost of any segment for
+# every activity comes from two cumulative sums, and PELT's pruning keeps the search close to linear
+# in the number of days. results are cached on disk by input hash, and in-process by file mtime
+
+CHANGEPOINT_DIR = os.path.join(DATA_DIR, 'changepoints')
+DAILY_TABLE = 'avg_time_all_years_byday'
+
+# shortest regime, in observed days
+MIN_SIZE = 30
+# pre-COVID peak, COVID peak, post-COVID peak
+REGIMES = 3
+
+_lock = threading.Lock()
+# csv mtime -> boundaries
+_boundaries = {}
+
+
+def prepare(matrix):
+    # day-of-week means taken out (weekends look nothing like weekdays), then every activity scaled
+    # to unit variance so each one counts the same in the joint cost
+    X = np.array(matrix, dtype='float64')
+    weekday = pd.to_datetime(matrix.index).dayofweek.to_numpy()
+    for day in range(7):
+        X[weekday == day] -= X[weekday == day].mean(axis=0)
+    sd = X.std(axis=0)
+    return (X - X.mean(axis=0)) / np.where(sd > 0, sd, 1.0)
+
+
+class SegmentCost:
+    # sum over activities of squared deviations from the segment mean, for rows [start, end)
+    __slots__ = ('sums', 'squares')
+
+    def __init__(self, X):
+        self.sums = np.vstack([np.zeros(X.shape[1]), np.cumsum(X, axis=0)])
+        self.squares = np.concatenate([[0.0], np.cumsum((X * X).sum(axis=1))])
+
+    def __len__(self):
+        return len(self.squares) - 1
+
+    def __call__(self, starts, end):
+        diff = self.sums[end] - self.sums[starts]
+        return self.squares[end] - self.squares[starts] - (diff * diff).sum(axis=1) / (end - starts)
+
+
+def pelt(cost, penalty, min_size=MIN_SIZE):
+    # optimal change points (row indices where a new segment starts) for cost + penalty per
+    # change point. candidates that can't start the last segment of an optimal split any more are
+    # pruned as we go
+    n = len(cost)
+    best = np.full(n + 1, np.inf)
+    best[0] = -penalty
+    previous = np.zeros(n + 1, dtype='int64')
+    candidates = np.array([0])
+    for end in range(min_size, n + 1):
+        eligible = end - candidates >= min_size
+        starts = candidates[eligible]
+        totals = best[starts] + cost(starts, end)
+        i = np.argmin(totals)
+        best[end] = totals[i] + penalty
+        previous[end] = starts[i]
+        pruned = np.zeros(len(candidates), dtype=bool)
+        pruned[eligible] = totals > best[end]
+        candidates = np.append(candidates[~pruned], end - min_size + 1)
+
+    points = []
+    end = previous[n]
+    while end > 0:
+        points.append(int(end))
+        end = previous[end]
+    return points[::-1]
+
+
+def optimal(cost, count, min_size=MIN_SIZE):
+    # the best split into exactly count + 1 segments by dynamic programming, O(count * n^2). slower
+    # than PELT, but it always has an answer
+    n = len(cost)
+    if n < (count + 1) * min_size:
+        raise ValueError('%d rows are too few for %d segments of %d' % (n, count + 1, min_size))
+    best = np.full(n + 1, np.inf)
+    for end in range(min_size, n + 1):
+        best[end] = cost(np.array([0]), end)[0]
+
+    previous = []
+    for k in range(1, count + 1):
+        following = np.full(n + 1, np.inf)
+        start_of = np.zeros(n + 1, dtype='int64')
+        for end in range((k + 1) * min_size, n + 1):
+            starts = np.arange(k * min_size, end - min_size + 1)
+            totals = best[starts] + cost(starts, end)
+            i = np.argmin(totals)
+            following[end] = totals[i]
+            start_of[end] = starts[i]
+        previous.append(start_of)
+        best = following
+
+    points = []
+    end = n
+    for start_of in reversed(previous):
+        end = int(start_of[end])
+        points.append(end)
+    return points[::-1]
+
+
+def fixed_count(cost, count, min_size=MIN_SIZE, steps=40):
+    # the change points of the penalty that gives exactly count of them, by bisection on the log
+    # penalty (fewer change points as the penalty grows). when no penalty does (the count jumps
+    # past it, as in data with no clear regimes), the exact dynamic program decides
+    lo, hi = 1e-3, cost(np.array([0]), len(cost))[0]
+    for _ in range(steps):
+        penalty = np.sqrt(lo * hi)
+        points = pelt(cost, penalty, min_size)
+        if len(points) == count:
+            return points
+        if len(points) > count:
+            lo = penalty
+        else:
+            hi = penalty
+    return optimal(cost, count, min_size)
+
+
+def detect(matrix, regimes=REGIMES, min_size=MIN_SIZE):
+    # dates where each regime after the first begins
+    points = fixed_count(SegmentCost(prepare(matrix)), regimes - 1, min_size)
+    return [pd.Timestamp(matrix.index[i]) for i in points]
+
+
+def activity_changepoints(matrix, penalty=None, min_size=MIN_SIZE):
+    # {activity: change dates} with each activity segmented on its own. the default penalty is
+    # BIC-like for one unit-variance series
+    X = prepare(matrix)
+    penalty = 2 * np.log(len(X)) if penalty is None else penalty
+    dates = pd.to_datetime(matrix.index)
+    return {activity: [dates[i] for i in pelt(SegmentCost(X[:, [j]]), penalty, min_size)]
+            for j, activity in enumerate(matrix.columns)}
+
+
+def month_start(date):
+    # nearest first of the month, so monthly tables and daily dates fall in the same regime
+    date = pd.Timestamp(date)
+    start = date.to_period('M').to_timestamp()
+    following = start + pd.offsets.MonthBegin(1)
+    return following if date - start > following - date else start
+
+
+def _cache_path(matrix, regimes, min_size):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([regimes, min_size, list(matrix.columns)]).encode())
+    digest.update(np.asarray(matrix.index, dtype=str).astype('U').tobytes())
+    digest.update(np.ascontiguousarray(matrix.to_numpy(dtype='float64')).tobytes())
+    return os.path.join(CHANGEPOINT_DIR, digest.hexdigest() + '.json')
+
+
+def regimes(regimes=REGIMES, min_size=MIN_SIZE):
+    # detected boundaries as (day, month start) 'YYYY-MM-DD' pairs, read from the disk cache when this
+    # exact daily table was segmented before
+    matrix = activity_matrix('day')
+    path = _cache_path(matrix, regimes, min_size)
+    if os.path.exists(path):
+        with open(path) as f:
+            return [tuple(pair) for pair in json.load(f)]
+
+    found = [(str(d.date()), str(month_start(d).date())) for d in detect(matrix, regimes, min_size)]
+    os.makedirs(CHANGEPOINT_DIR, exist_ok=True)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(found, f)
+    os.replace(tmp, path)
+    return found
+
+
+def period_boundaries():
+    # month starts of the detected COVID peak and post-COVID peak, to pass to atus.data.time_periods
+    # in place of the published ones. redone (or re-read from disk) only when the daily table changes
+    mtime = os.path.getmtime(csv_path(DAILY_TABLE))
+    with _lock:
+        cached = _boundaries.get(mtime)
+    if cached is None:
+        cached = tuple(month for _, month in regimes())
+        with _lock:
+            _boundaries.clear()
+            _boundaries[mtime] = cached
+    return cached
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detect regime changes in the daily time-use series.')
+    parser.add_argument('--regimes', type=int, default=REGIMES)
+    parser.add_argument('--min-size', type=int, default=MIN_SIZE)
+    parser.add_argument('--activities', action='store_true', help='also segment every activity on its own')
+    args = parser.parse_args()
+
+    for day, month in regimes(args.regimes, args.min_size):
+        print('regime starts %s (month %s)' % (day, month))
+    if args.activities:
+        for activity, dates in activity_changepoints(activity_matrix('day'), min_size=args.min_size).items():
+            print('%-32s %s' % (activity, ', '.join(str(d.date()) for d in dates)))
@@ -0,0 +1,121 @@
+import contextlib
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+import altair as alt
+import pyarrow as pa
+
+from atus import perf
+from atus.shards import fingerprint
+
+
+# layered / concatenated charts are built from data-less alt.Chart() layers and get their frame
+# attached once at the top with with_data(). the frame is serialized (to arrow ipc) as a
+# single named dataset that every layer reads, and only the columns the spec refers to are kept
+
+_DATUM = re.compile(r"datum\.(\w+)|datum\[['\"]([^'\"]+)['\"]\]")
+
+# compiled specs, shared by every session in the process:
+# (plotter code, data fingerprints, params) -> (spec json, {dataset name: arrow ipc bytes})
+SPEC_CACHE_SIZE = 256
+# _lock guards _specs only; _compile_lock the altair theme and data transformer, which are global
+_lock = threading.Lock()
+_compile_lock = threading.Lock()
+_specs = OrderedDict()
+
+
+def _referenced(spec, names):
+    # every string in the spec that could name a column: field names, selection fields and init
+    # keys, window / sort fields, plus datum.X references inside expressions
+    if isinstance(spec, dict):
+        for key, value in spec.items():
+            names.add(key)
+            _referenced(value, names)
+    elif isinstance(spec, list):
+        for value in spec:
+            _referenced(value, names)
+    elif isinstance(spec, str):
+        names.add(spec)
+        for dotted, quoted in _DATUM.findall(spec):
+            names.add(dotted or quoted)
+    return names
+
+
+def used_columns(chart, data):
+    names = _referenced(chart.to_dict(validate=False), set())
+    return [c for c in data.columns if c in names]
+
+
+def with_data(chart, data):
+    # chart with data as its one top-level dataset, trimmed to the columns the layers use
+    chart = chart.copy()
+    chart.data = data[used_columns(chart, data)]
+    return chart
+
+
+def layer(data, *layers, **kwargs):
+    return with_data(alt.layer(*layers, **kwargs), data)
+
+
+def _to_arrow(data, datasets):
+    # altair data transformer: the frame goes to arrow ipc bytes (what streamlit sends anyway),
+    # named by content hash so identical frames in one chart collapse into one dataset
+    table = pa.Table.from_pandas(data)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    data_bytes = sink.getvalue().to_pybytes()
+    name = hashlib.md5(data_bytes).hexdigest()
+    datasets[name] = data_bytes
+    return {'name': name}
+
+
+alt.data_transformers.register('atus_arrow', _to_arrow)
+
+
+def compile_chart(chart):
+    # vega-lite json plus the arrow datasets it names, the same output st.altair_chart builds
+    datasets = {}
+    with _compile_lock:
+        # like streamlit, drop the default altair theme: it only adds width/height defaults
+        theme = alt.themes.enable('none') if alt.themes.active == 'default' else contextlib.nullcontext()
+        with theme, alt.data_transformers.enable('atus_arrow', datasets=datasets):
+            spec = chart.to_dict()
+    return json.dumps(spec), datasets
+
+
+def spec(plotter, *frames, **params):
+    # plotter(*frames, **params) compiled once per process and handed to every session from then
+    # on. the key holds the frames' content fingerprints and the plotter's code, so changed data
+    # (or an edited plotter) compiles a fresh spec and the stale one ages out of the LRU. frames
+    # from a cached loader are hashed once (atus.shards.fingerprint), so they must never be
+    # modified after they're charted; a page that edits one charts a copy
+    with perf.span('spec', hit=True):
+        key = (plotter.__code__, tuple(fingerprint(df) for df in frames), tuple(sorted(params.items())))
+        with _lock:
+            cached = _specs.get(key)
+            if cached is not None:
+                _specs.move_to_end(key)
+        if cached is None:
+            perf.miss()
+            with perf.span('chart'):
+                chart = plotter(*frames, **params)
+            with perf.span('serialize'):
+                cached = compile_chart(chart)
+            with _lock:
+                _specs[key] = cached
+                while len(_specs) > SPEC_CACHE_SIZE:
+                    _specs.popitem(last=False)
+        text, datasets = cached
+        # st.vega_lite_chart edits the spec it gets, so every caller gets its own
+        out = json.loads(text)
+        out['datasets'] = dict(datasets)
+        return out
+
+
+def clear_specs():
+    with _lock:
+        _specs.clear()
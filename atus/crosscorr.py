@@ -0,0 +1,174 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import fft
+
+from atus.data import DATA_DIR
+from atus.ingest import ACTIVITY_NAMES, read_extract, respondents, write_table
+from atus.moments import rolling
+from atus.shared import frame
+from atus.stringency import NATIONAL, load as load_stringency
+
+
+# lagged correlation between policy stringency and daily time per activity, for every lag in
+# -MAX_LAG..MAX_LAG at once. missing days (no interviews Mar 18 - May 9 2020, and most days for a
+# single state) are masked, and the sums pearson's r needs at each lag (pairs, sum x, sum y, sum x^2,
+# sum y^2, sum xy over the overlapping days) are six FFT cross-correlations, batched over every
+# (state, activity) series. positive lags mean time use follows stringency
+
+MAX_LAG = 90
+# lags with fewer overlapping days than this come back as nan
+MIN_PAIRS = 30
+START, END = '2020-01-01', '2021-12-31'
+# per-state daily means, built from the extract by the command line below
+STATE_TABLE = 'avg_time_state_byday'
+
+
+def _window(c, max_lag):
+    # circular cross-correlation -> lags -max_lag..max_lag
+    return np.concatenate([c[..., c.shape[-1] - max_lag:], c[..., :max_lag + 1]], axis=-1)
+
+
+def lagged_correlations(x, y, max_lag=MAX_LAG, min_pairs=MIN_PAIRS):
+    # pearson r of x[t] and y[t + lag] over the days where both are present, for every lag, along
+    # the last axis. x and y broadcast against each other (one stringency series per state against
+    # that state's activities, say). returns (r, pairs), each with 2 * max_lag + 1 lags
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    # padded so lags up to max_lag don't wrap around
+    size = fft.next_fast_len(max(x.shape[-1], y.shape[-1]) + max_lag, real=True)
+
+    def spectra(a):
+        present = ~np.isnan(a)
+        filled = np.where(present, a, 0.0)
+        return [fft.rfft(v, size, axis=-1) for v in (present.astype('float64'), filled, filled ** 2)]
+
+    def cross(a, b):
+        return _window(fft.irfft(np.conj(a) * b, size, axis=-1), max_lag)
+
+    mask_x, sum_x, square_x = spectra(x)
+    mask_y, sum_y, square_y = spectra(y)
+    pairs = np.rint(cross(mask_x, mask_y))
+    sx = cross(sum_x, mask_y)
+    sy = cross(mask_x, sum_y)
+    sxx = cross(square_x, mask_y)
+    syy = cross(mask_x, square_y)
+    sxy = cross(sum_x, sum_y)
+
+    var_x = pairs * sxx - sx ** 2
+    var_y = pairs * syy - sy ** 2
+    # a series that's flat over the overlap (stringency before March 2020) has no correlation;
+    # the tolerance absorbs FFT rounding in what should be an exact zero
+    valid = (pairs >= min_pairs) & (var_x > 1e-9 * pairs * sxx) & (var_y > 1e-9 * pairs * syy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = (pairs * sxy - sx * sy) / np.sqrt(var_x * var_y)
+    return np.where(valid, np.clip(r, -1, 1), np.nan), pairs.astype('int64')
+
+
+def _grid(daily, dates, by):
+    # (by values..., activities, days) array of daily means, nan where nobody was interviewed
+    daily = daily[(daily['DATE'] >= dates[0]) & (daily['DATE'] <= dates[-1])]
+    keys = [pd.Index(sorted(daily[col].unique())) for col in by]
+    shape = [len(k) for k in keys] + [len(ACTIVITY_NAMES), len(dates)]
+    grid = np.full(shape, np.nan)
+    index = tuple(k.get_indexer(daily[col]) for k, col in zip(keys, by))
+    index += (pd.Index(ACTIVITY_NAMES).get_indexer(daily['ACTIVITY'].astype(str)), dates.get_indexer(daily['DATE']))
+    keep = np.all([i >= 0 for i in index], axis=0)
+    grid[tuple(i[keep] for i in index)] = daily['mean'].to_numpy()[keep]
+    return keys, grid
+
+
+def _frame(regions, r, pairs, max_lag):
+    # long (REGION, ACTIVITY, lag, r, pairs) table from (regions, activities, lags) arrays. region
+    # and activity are categoricals, like the frames atus.data loads, so charts ship them dictionary encoded
+    n_regions, n_activities, n_lags = r.shape
+    return pd.DataFrame({
+        'REGION': pd.Categorical(np.repeat(regions, n_activities * n_lags), categories=regions),
+        'ACTIVITY': pd.Categorical.from_codes(np.tile(np.repeat(np.arange(n_activities), n_lags), n_regions),
+                                              categories=ACTIVITY_NAMES),
+        'lag': np.tile(np.arange(-max_lag, max_lag + 1, dtype='int16'), n_regions * n_activities),
+        # float32 is plenty for a correlation and halves what the heatmap sends
+        'r': r.ravel().astype('float32'),
+        'pairs': pairs.ravel().astype('int32'),
+    })
+
+
+def strongest(correlations):
+    # True on the lag with the largest |r| for each region and activity
+    valid = correlations.dropna(subset=['r'])
+    peaks = valid['r'].abs().groupby([valid['REGION'], valid['ACTIVITY']]).idxmax()
+    return correlations.index.isin(peaks)
+
+
+def smoothed(daily, window=1, by=()):
+    # the daily means, or their trailing window-day averages (atus.moments.rolling)
+    if window <= 1:
+        return daily
+    return rolling(daily[daily['mean'].notna()], window, by)
+
+
+def national_correlations(max_lag=MAX_LAG, start=START, end=END, window=1):
+    dates = pd.date_range(start, end, freq='D')
+    _, grid = _grid(smoothed(frame('avg_time_all_years_byday'), window), dates, [])
+    stringency = load_stringency().lookup(NATIONAL, dates, tolerance=0)
+    r, pairs = lagged_correlations(stringency, grid, max_lag)
+    return _frame(['United States'], r[None], pairs[None], max_lag)
+
+
+def state_correlations(max_lag=MAX_LAG, start=START, end=END, window=1):
+    # every state x activity x lag in one batch. needs the STATE_TABLE built from the extract
+    dates = pd.date_range(start, end, freq='D')
+    daily = smoothed(frame(STATE_TABLE), window, ['STATEFIP'])
+    (states,), grid = _grid(daily, dates, ['STATEFIP'])
+    stringency = load_stringency().lookup(np.repeat(states.to_numpy(), len(dates)), np.tile(dates, len(states)),
+                                          tolerance=0).reshape(len(states), 1, len(dates))
+    r, pairs = lagged_correlations(stringency, grid, max_lag)
+    return _frame(state_names(states), r, pairs, max_lag)
+
+
+def state_names(codes):
+    # STATEFIP code -> the RegionName covid_data uses
+    covid = frame('covid_data').drop_duplicates('STATEFIP')
+    names = dict(zip(covid['STATEFIP'].astype(str), covid['RegionName'].astype(str)))
+    return [names.get(str(code), str(code)) for code in codes]
+
+
+def state_daily(path, chunksize=100000):
+    # weighted mean minutes per state, diary day and activity straight from the respondents.
+    # holiday diary days stay in, like the other daily tables
+    sums = []
+    for chunk in read_extract(path, chunksize=chunksize):
+        people, minutes = respondents(chunk)
+        w = people['weight'].to_numpy()[:, None]
+        part = pd.DataFrame(w * minutes, columns=ACTIVITY_NAMES)
+        part['W'] = w[:, 0]
+        part['n'] = 1
+        part[['STATEFIP', 'DATE']] = people[['STATEFIP', 'DATE']].to_numpy()
+        sums.append(part.groupby(['STATEFIP', 'DATE']).sum())
+    total = pd.concat(sums).groupby(level=['STATEFIP', 'DATE']).sum()
+
+    means = total[ACTIVITY_NAMES].div(total['W'], axis=0)
+    out = means.stack().rename('mean').reset_index().rename(columns={'level_2': 'ACTIVITY'})
+    out['n'] = total['n'].reindex(pd.MultiIndex.from_frame(out[['STATEFIP', 'DATE']])).to_numpy()
+    out['DATE'] = pd.to_datetime(out['DATE']).dt.strftime('%Y-%m-%d')
+    return out[['STATEFIP', 'DATE', 'ACTIVITY', 'mean', 'n']]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Lagged correlations between stringency and daily time use.')
+    parser.add_argument('extract', nargs='?',
+                        help='build %s.csv from this IPUMS ATUS extract first, for the per-state grid' % STATE_TABLE)
+    parser.add_argument('--max-lag', type=int, default=MAX_LAG)
+    parser.add_argument('--window', type=int, default=1, help='average time use over this many trailing days first')
+    args = parser.parse_args()
+
+    if args.extract:
+        path = os.path.join(DATA_DIR, STATE_TABLE + '.csv')
+        write_table(state_daily(args.extract), path)
+        print('wrote', path)
+        out = state_correlations(args.max_lag, window=args.window)
+    else:
+        out = national_correlations(args.max_lag, window=args.window)
+    print(out[strongest(out)].to_string(index=False))
@@ -0,0 +1,194 @@
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from atus.data import period_categories
+from atus.incremental import STATE_DIR, load_state, partition_months, partition_path
+from atus.ingest import rollup
+from atus.moments import Moments
+
+
+# month x sex x age group x occupation group x activity cube of weighted moments, built from the
+# ingest state (atus.incremental partitions). every combination with 'All' on any of the first four
+# dimensions is precomputed, so a slice with one value (or all values) per dimension is an array
+# lookup. multi-value selections (ages 25-34 and 35-44, say) AND together per-value boolean indexes
+# over the base cells and merge what's left.
+
+DIMENSIONS = ['MONTH_YEAR', 'SEX', 'AGE_GROUP', 'OCC_GROUP', 'ACTIVITY']
+# the dimensions that get an 'All' member; activities are never pooled together
+ROLLUP_DIMENSIONS = DIMENSIONS[:-1]
+ALL = 'All'
+# slices kept per cube, least recently used dropped first
+SLICE_CACHE_SIZE = 4096
+
+
+class Cube:
+    def __init__(self, cells):
+        # cells: one row per base cell with the DIMENSIONS columns plus W, mean, M2, n, nonzero
+        self.members = {}
+        codes = {}
+        for dim in DIMENSIONS:
+            column = cells[dim]
+            if dim == 'MONTH_YEAR':
+                members = period_categories(column)
+            elif isinstance(column.dtype, pd.CategoricalDtype):
+                members = [m for m in column.cat.categories if m in set(column)]
+            else:
+                members = sorted(column.unique())
+            self.members[dim] = list(members)
+            codes[dim] = pd.Index(members).get_indexer(column.astype(str) if dim == 'MONTH_YEAR' else column)
+
+        self.codes = codes
+        self.cells = Moments(cells['W'], cells['mean'], cells['M2'], cells['n'])
+        self.nonzero = cells['nonzero'].to_numpy(dtype='float64')
+        # one boolean index per dimension value, over the base cells
+        self.index = {dim: {member: codes[dim] == i for i, member in enumerate(self.members[dim])}
+                      for dim in DIMENSIONS}
+        self._build_marginals()
+        # (by, selected) -> slice. per cube, so an old cube and its slices go together once load_cube
+        # stops handing it out
+        self._slices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _build_marginals(self):
+        shape = tuple(len(self.members[d]) for d in DIMENSIONS)
+        flat = np.ravel_multi_index([self.codes[d] for d in DIMENSIONS], shape)
+        size = int(np.prod(shape))
+        dense = self.cells.reduce(flat, size)
+        grid = Moments(*(a.reshape(shape) for a in (dense.w, dense.mean, dense.m2, dense.n)))
+        nonzero = np.bincount(flat, self.nonzero, size).reshape(shape)
+
+        # append an 'All' slot along each rollup axis in turn; since later axes see the earlier
+        # 'All' slots, this ends up with every combination (the CUBE operator)
+        for axis in range(len(ROLLUP_DIMENSIONS)):
+            total = grid.collapse(axis)
+            grid = Moments(*(np.concatenate([a, b], axis=axis) for a, b in
+                             zip((grid.w, grid.mean, grid.m2, grid.n), (total.w, total.mean, total.m2, total.n))))
+            nonzero = np.concatenate([nonzero, nonzero.sum(axis=axis, keepdims=True)], axis=axis)
+        self.marginals = grid
+        self.marginal_nonzero = nonzero
+
+    def _frame(self, by, keys, moments, nonzero):
+        out = pd.DataFrame({dim: values for dim, values in zip(by, keys)})
+        out['mean'] = moments.mean
+        out['sd'] = moments.sd()
+        out['n'] = moments.n.astype('int64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # empty groups (0 / 0) are dropped below
+            out['percent_nonzero'] = nonzero / moments.n
+        if 'MONTH_YEAR' in out:
+            out['MONTH_YEAR'] = pd.Categorical(out['MONTH_YEAR'], categories=self.members['MONTH_YEAR'], ordered=True)
+        return out[out['n'] > 0].reset_index(drop=True)
+
+    def _normalize(self, filters):
+        selected = {}
+        for dim, value in filters.items():
+            if dim not in DIMENSIONS:
+                raise KeyError('unknown cube dimension %r' % dim)
+            if value is None or value == ALL:
+                continue
+            values = (value,) if isinstance(value, str) else tuple(value)
+            for v in values:
+                if v not in self.members[dim]:
+                    raise KeyError('%r is not a %s in the cube' % (v, dim))
+            if set(values) >= set(self.members[dim]):
+                continue
+            selected[dim] = values
+        return selected
+
+    def slice(self, by=('MONTH_YEAR', 'ACTIVITY'), **filters):
+        # e.g. cube.slice(by=['MONTH_YEAR', 'ACTIVITY'], SEX='Female', OCC_GROUP='Healthcare Worker',
+        #                 AGE_GROUP=['25-34', '35-44']). a dimension can be both grouped by and filtered
+        # (by=['SEX', ...], SEX='Female' gives the female rows only). KeyError for values the
+        # cube doesn't have
+        by = list(by)
+        selected = self._normalize(filters)
+        key = (tuple(by), tuple(sorted(selected.items())))
+        with self._lock:
+            out = self._slices.get(key)
+            if out is not None:
+                self._slices.move_to_end(key)
+        if out is None:
+            out = self._slice(*key)
+            with self._lock:
+                self._slices[key] = out
+                while len(self._slices) > SLICE_CACHE_SIZE:
+                    self._slices.popitem(last=False)
+        # results are cached and shared between sessions, hand out copies
+        return out.copy()
+
+    def _slice(self, by, selected):
+        selected = dict(selected)
+        # the marginals hold one value or all of a dimension; a filtered dimension that's also
+        # grouped by keeps only the selected groups, which takes a scan
+        if all(len(values) == 1 for values in selected.values()) and not set(selected) & set(by):
+            return self._lookup(by, selected)
+        return self._scan(by, selected)
+
+    def _lookup(self, by, selected):
+        # straight out of the precomputed marginals
+        index = []
+        for dim in DIMENSIONS:
+            members = self.members[dim]
+            if dim in by:
+                index.append(slice(0, len(members)))
+            elif dim in selected:
+                index.append(members.index(selected[dim][0]))
+            elif dim == 'ACTIVITY':
+                raise ValueError('pick an ACTIVITY or group by it, activities are not pooled')
+            else:
+                index.append(len(members))
+        m = self.marginals
+        picked = Moments(m.w[tuple(index)], m.mean[tuple(index)], m.m2[tuple(index)], m.n[tuple(index)])
+        nonzero = self.marginal_nonzero[tuple(index)]
+
+        kept = [d for d in DIMENSIONS if d in by]
+        grid = np.indices(picked.w.shape).reshape(len(kept), -1)
+        keys = [np.asarray(self.members[d], dtype=object)[grid[i]] for i, d in enumerate(kept)]
+        flat = Moments(picked.w.ravel(), picked.mean.ravel(), picked.m2.ravel(), picked.n.ravel())
+        out = self._frame(kept, keys, flat, nonzero.ravel())
+        return out[list(by) + ['mean', 'sd', 'n', 'percent_nonzero']]
+
+    def _scan(self, by, selected):
+        mask = np.ones(len(self.nonzero), dtype=bool)
+        for dim, values in selected.items():
+            hit = np.zeros_like(mask)
+            for value in values:
+                hit |= self.index[dim].get(value, False)
+            mask &= hit
+        if 'ACTIVITY' not in by and 'ACTIVITY' not in selected:
+            raise ValueError('pick an ACTIVITY or group by it, activities are not pooled')
+
+        shape = tuple(len(self.members[d]) for d in by)
+        flat = np.ravel_multi_index([self.codes[d][mask] for d in by], shape) if by else np.zeros(mask.sum(), int)
+        size = int(np.prod(shape))
+        merged = self.cells[mask].reduce(flat, size)
+        nonzero = np.bincount(flat, self.nonzero[mask], size)
+        grid = np.indices(shape).reshape(len(by), -1)
+        keys = [np.asarray(self.members[d], dtype=object)[grid[i]] for i, d in enumerate(by)]
+        return self._frame(list(by), keys, merged, nonzero)
+
+
+def cells_from_state(state):
+    # month-level base cells from the daily ingest state, holidays left out like the monthly tables
+    state = state[~state['HOLIDAY']]
+    labels = state['DATE'].dt.strftime('%b %Y')
+    return rollup(state.assign(MONTH_YEAR=labels), DIMENSIONS)
+
+
+@functools.lru_cache(maxsize=1)
+def _cube(stamp):
+    return Cube(cells_from_state(load_state()))
+
+
+def load_cube():
+    # built once per process from data/state (python -m atus.incremental init <extract> writes it),
+    # and again whenever a partition is added or refreshed
+    months = partition_months()
+    if not months:
+        raise FileNotFoundError('no ingest state in %s, run python -m atus.incremental init <extract>' % STATE_DIR)
+    return _cube(tuple((m, os.path.getmtime(partition_path(m))) for m in months))
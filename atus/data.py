@@ -0,0 +1,146 @@
+import os
+import sys
+
+import pandas as pd
+
+from atus.dimensions import normalize
+
+
+# every page reads from data/ relative to the repo root (that's where streamlit is launched from)
+DATA_DIR = 'data'
+# bumped whenever tidy changes what it writes, so caches built by older code are never read
+CACHE_VERSION = 2
+# typed, dictionary-encoded copies of each data/*.csv live here, rebuilt whenever the csv changes
+CACHE_DIR = os.path.join(DATA_DIR, 'parquet', 'v%d' % CACHE_VERSION)
+
+TIME_PERIODS = ['Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak']
+# first days of the COVID peak and post-COVID peak in the published analysis (and the models in
+# models.csv). every page cuts here; the boundaries atus.changepoints detects in the daily series
+# are an opt-in comparison on page 3
+PUBLISHED_BOUNDARIES = ('2020-03-01', '2021-02-01')
+MONTH_ABBREVIATIONS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                       'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+# 'Jan 2019' style labels, stored as ordered categoricals in calendar order
+PERIOD_LABEL_COLUMNS = ['label', 'MONTH_YEAR', 'date_label']
+# full dates ('2020-01-01' or 20200101) that the R exports wrote out as text/ints
+DATE_COLUMNS = ['DATE', 'Date']
+# string columns with fewer distinct values than this share of rows get dictionary encoded
+CATEGORICAL_MAX_RATIO = 0.5
+
+
+def csv_path(name):
+    return os.path.join(DATA_DIR, name + '.csv')
+
+
+def parquet_path(name):
+    return os.path.join(CACHE_DIR, name + '.parquet')
+
+
+def dataset_names():
+    return sorted(f[:-4] for f in os.listdir(DATA_DIR) if f.endswith('.csv'))
+
+
+def period_categories(labels):
+    # sort 'Mon YYYY' labels by the month they stand for (Apr 2020 was never collected, so it just won't show up)
+    labels = pd.Series(pd.unique(pd.Series(labels).dropna().astype(str)))
+    order = pd.to_datetime(labels, format='%b %Y').argsort()
+    return list(labels.iloc[order])
+
+
+def month_labels(dates):
+    # ordered 'Jan 2019' categorical for a datetime series
+    labels = dates.dt.strftime('%b %Y')
+    return pd.Categorical(labels, categories=period_categories(labels), ordered=True)
+
+
+def time_periods(dates, boundaries=PUBLISHED_BOUNDARIES):
+    # pre-COVID peak before the first boundary, COVID peak before the second, post-COVID peak after.
+    # boundaries are month starts, so daily and monthly dates fall in the same period
+    covid_peak, post_covid_peak = boundaries
+    period = pd.Series('Post-COVID Peak', index=dates.index)
+    period[dates < post_covid_peak] = 'COVID Peak'
+    period[dates < covid_peak] = 'Pre-COVID Peak'
+    return pd.Categorical(period, categories=TIME_PERIODS, ordered=True)
+
+
+def period_starts(labels, boundaries=PUBLISHED_BOUNDARIES):
+    # the 'Mon YYYY' labels, in the order given, where a new time period begins
+    labels = pd.Index(labels)
+    periods = time_periods(pd.Series(pd.to_datetime(labels, format='%b %Y')), boundaries)
+    codes = pd.Series(periods.codes)
+    starts = codes.ne(codes.shift())
+    starts.iloc[0] = False
+    return list(labels[starts.to_numpy()])
+
+
+def _to_date(column):
+    if pd.api.types.is_integer_dtype(column):
+        return pd.to_datetime(column.astype(str), format='%Y%m%d')
+    text = column.astype(str)
+    if text.str.len().max() == 7:
+        return pd.to_datetime(text, format='%Y-%m')
+    return pd.to_datetime(text, format='%Y-%m-%d')
+
+
+def _is_text(column):
+    return pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column)
+
+
+def tidy(df):
+    # the R exports all carry a throwaway row-number column
+    df = df.drop(columns=[c for c in df.columns if c.startswith('Unnamed: ')])
+
+    for col in df.columns:
+        column = df[col]
+        if col in DATE_COLUMNS and not pd.api.types.is_float_dtype(column):
+            df[col] = _to_date(column)
+        elif col in PERIOD_LABEL_COLUMNS:
+            df[col] = pd.Categorical(column, categories=period_categories(column), ordered=True)
+        elif col == 'time_period':
+            df[col] = pd.Categorical(column, categories=TIME_PERIODS, ordered=True)
+        elif col == 'MONTH' and _is_text(column) and column.isin(MONTH_ABBREVIATIONS).all():
+            df[col] = pd.Categorical(column, categories=MONTH_ABBREVIATIONS, ordered=True)
+        elif _is_text(column) and column.nunique() <= CATEGORICAL_MAX_RATIO * len(column):
+            df[col] = column.astype('category')
+
+    # one spelling and an integer key per month, activity and demographic group (atus.dimensions)
+    return normalize(df)
+
+
+def build(name):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    df = tidy(pd.read_csv(csv_path(name)))
+
+    # write to a temp file and swap it in, so a second server process never reads half a file
+    target = parquet_path(name)
+    tmp = '%s.%d.tmp' % (target, os.getpid())
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, target)
+    return target
+
+
+def is_stale(name):
+    target = parquet_path(name)
+    return not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(csv_path(name))
+
+
+def load(name, columns=None):
+    # drop-in replacement for pd.read_csv('data/<name>.csv') with typed columns
+    if is_stale(name):
+        build(name)
+    return pd.read_parquet(parquet_path(name), columns=columns)
+
+
+def build_all(force=False):
+    built = []
+    for name in dataset_names():
+        if force or is_stale(name):
+            built.append(build(name))
+    return built
+
+
+if __name__ == '__main__':
+    # python -m atus.data [--force] prebuilds the parquet cache, e.g. as a deploy step
+    for path in build_all(force='--force' in sys.argv[1:]):
+        print('built', path)
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+from atus.ingest import ACTIVITIES, ACTIVITY_NAMES, AGE_GROUPS, MONTH_ABBREVIATIONS, OCC_GROUPS, SEXES
+
+
+# shared dimension tables with integer surrogate keys. the exports spell the same thing several
+# ways: months as 1, '1', 'Jan', 'Jan 2019' or '2019-01', activities by name, by their IPUMS ACT_
+# variable (med_time_bymonth) or by that variable without the prefix (the byday tables), sex as
+# '1' / '2' in avg_time_2020. atus.data.tidy runs every table through normalize, so the parquet
+# cache has canonical names in these columns plus an integer key next to each: PERIOD_ID (YYYYMM),
+# ACTIVITY_ID, SEX_ID, AGE_GROUP_ID and OCC_GROUP_ID. pages filter, sort and join on the keys.
+# -1 is a value the dimension doesn't know (or a missing one)
+
+# the years the published tables cover
+YEARS = [2019, 2020, 2021]
+
+# ATUS activity subcategories the byday tables break out on top of the 17 activities
+SUB_ACTIVITIES = {
+    'LEISATTEND': 'Attending or Hosting Social Events',
+    'LEISSOCCOM': 'Socializing and Communicating',
+}
+
+
+def _table(column, names, first=1):
+    return pd.DataFrame({column + '_ID': np.arange(first, first + len(names), dtype='int16'), column: names})
+
+
+def period_table(years=YEARS):
+    # one row per month: PERIOD_ID (201901), YEAR, MONTH and the 'Jan 2019' label
+    year, month = np.repeat(years, 12), np.tile(np.arange(1, 13), len(years))
+    return pd.DataFrame({'PERIOD_ID': (100 * year + month).astype('int32'), 'YEAR': year, 'MONTH': month,
+                         'label': ['%s %d' % (MONTH_ABBREVIATIONS[m - 1], y) for y, m in zip(year, month)]})
+
+
+PERIODS = period_table()
+ACTIVITY = _table('ACTIVITY', ACTIVITY_NAMES + list(SUB_ACTIVITIES.values())).assign(
+    CODE=list(ACTIVITIES) + list(SUB_ACTIVITIES))
+# the 'Overall' rows of the demographic breakdowns are 0
+SEX = _table('SEX', ['Overall'] + SEXES, first=0)
+AGE_GROUP = _table('AGE_GROUP', ['Overall'] + AGE_GROUPS, first=0)
+OCC_GROUP = _table('OCC_GROUP', ['Overall'] + OCC_GROUPS, first=0)
+
+# column -> its dimension table
+DIMENSIONS = {'ACTIVITY': ACTIVITY, 'SEX': SEX, 'AGE_GROUP': AGE_GROUP, 'OCC_GROUP': OCC_GROUP}
+
+# column -> {other spelling: canonical name}
+ALIASES = {
+    'ACTIVITY': {**ACTIVITIES, **{code[len('ACT_'):]: name for code, name in ACTIVITIES.items()},
+                 **SUB_ACTIVITIES, 'Household Activites': 'Household Activities'},
+    # ATUS codes sex 1 = male, 2 = female
+    'SEX': {'1': 'Male', '2': 'Female'},
+}
+
+# columns a period can be read from, after YEAR + MONTH
+PERIOD_COLUMNS = ['label', 'MONTH_YEAR', 'date_label', 'DATE', 'Date', 'date']
+
+
+def canonical(column, values):
+    # values with every alias of the column's dimension replaced by its name, dictionary encoded
+    return pd.Series(values, dtype=object).replace(ALIASES.get(column, {})).astype('category')
+
+
+def ids(column, values):
+    # the dimension's integer keys for the values (names or aliases), int16 with -1 for unknowns
+    table = DIMENSIONS[column]
+    lookup = dict(zip(table[column], table[column + '_ID']))
+    lookup.update({alias: lookup[name] for alias, name in ALIASES.get(column, {}).items()})
+    values = pd.Categorical(values)
+    # one lookup per distinct value; code -1 (missing) picks the trailing -1
+    keys = np.array([lookup.get(str(c), -1) for c in values.categories] + [-1], dtype='int16')
+    return keys[values.codes]
+
+
+def id_of(column, name):
+    return int(ids(column, [name])[0])
+
+
+def _month_numbers(month):
+    # 1..12 from ints, '1' style strings or 'Jan' style abbreviations, -1 for anything else ('Overall')
+    if pd.api.types.is_numeric_dtype(month):
+        return month.fillna(-1).astype('int64').to_numpy()
+    text = month.astype(str)
+    numbers = text.map({m: i + 1 for i, m in enumerate(MONTH_ABBREVIATIONS)})
+    numbers = numbers.fillna(pd.to_numeric(text, errors='coerce'))
+    return numbers.fillna(-1).astype('int64').to_numpy()
+
+
+def period_ids(df):
+    # YYYYMM for every row, from YEAR + MONTH, a 'Jan 2019' label or a date (days fall in their
+    # month). None when the table has no period in it
+    if 'YEAR' in df and 'MONTH' in df:
+        year = pd.to_numeric(df['YEAR'], errors='coerce').fillna(-1).astype('int64').to_numpy()
+        month = _month_numbers(df['MONTH'])
+        return np.where((year > 0) & (month > 0), 100 * year + month, -1).astype('int32')
+    for col in PERIOD_COLUMNS:
+        if col not in df:
+            continue
+        column = df[col]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            dates = column
+        elif col in ('label', 'MONTH_YEAR', 'date_label'):
+            dates = pd.to_datetime(column.astype(str), format='%b %Y', errors='coerce')
+        else:
+            dates = pd.to_datetime(column.astype(str), format='%Y-%m', errors='coerce')
+        return (100 * dates.dt.year + dates.dt.month).fillna(-1).astype('int32').to_numpy()
+    return None
+
+
+def period_labels(period_ids):
+    # 'Jan 2019' labels of the distinct periods, in calendar order
+    periods = np.unique(np.asarray(period_ids))
+    periods = periods[periods > 0]
+    return ['%s %d' % (MONTH_ABBREVIATIONS[p % 100 - 1], p // 100) for p in periods]
+
+
+def key_frame(df, columns):
+    # integer join keys for the columns of df: YEAR and MONTH together become PERIOD_ID, dimension
+    # columns their _ID. keys already in df (from normalize) are used as they are
+    out = {}
+    if 'YEAR' in columns or 'MONTH' in columns:
+        out['PERIOD_ID'] = df['PERIOD_ID'].to_numpy() if 'PERIOD_ID' in df else period_ids(df[['YEAR', 'MONTH']])
+    for col in columns:
+        if col in DIMENSIONS:
+            out[col + '_ID'] = df[col + '_ID'].to_numpy() if col + '_ID' in df else ids(col, df[col])
+        elif col not in ('YEAR', 'MONTH'):
+            out[col] = df[col].to_numpy()
+    return pd.DataFrame(out)
+
+
+def normalize(df):
+    # canonical names in the dimension columns (dictionary encoded) and their integer keys, plus
+    # PERIOD_ID when the table has a period
+    for col in DIMENSIONS:
+        if col not in df:
+            continue
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = canonical(col, df[col])
+        df[col + '_ID'] = ids(col, df[col])
+    periods = period_ids(df)
+    if periods is not None and (periods > 0).any():
+        df['PERIOD_ID'] = periods
+    return df
@@ -0,0 +1,201 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from atus.data import DATA_DIR, month_labels, time_periods
+from atus.ingest import ACTIVITY_NAMES
+from atus.shared import frame
+
+
+# 2-d embeddings of the month x activity (or day x activity) matrix of average minutes, for the
+# similarity page. t-SNE is the exact algorithm on nearest-neighbour affinities: at ~1,000 days the
+# full n x n gradient is a handful of vectorized numpy ops per iteration, so there's no need for a
+# Barnes-Hut tree. results are cached on disk by input hash and parameters
+EMBEDDING_DIR = os.path.join(DATA_DIR, 'embeddings')
+
+GRAINS = ['month', 'day']
+METHODS = ['tsne', 'mds']
+
+
+def activity_matrix(grain='month'):
+    # rows are months ('2019-01') or days ('2019-01-01'), columns the 17 activities in the usual order
+    if grain == 'month':
+        monthly = frame('monthly_combined')
+        dates = pd.to_datetime(monthly[['YEAR', 'MONTH']].assign(DAY=1))
+        table = monthly.assign(date=dates.dt.strftime('%Y-%m'))
+    elif grain == 'day':
+        daily = frame('avg_time_all_years_byday')
+        table = daily.assign(date=daily['DATE'].dt.strftime('%Y-%m-%d'))
+    else:
+        raise ValueError('grain must be one of %s' % ', '.join(GRAINS))
+    table = table[table['ACTIVITY'].isin(ACTIVITY_NAMES)]
+    matrix = table.pivot(index='date', columns='ACTIVITY', values='mean')
+    matrix.columns = matrix.columns.astype(str)
+    return matrix[ACTIVITY_NAMES].sort_index().dropna()
+
+
+def standardize(matrix):
+    X = np.asarray(matrix, dtype='float64')
+    sd = X.std(axis=0)
+    return (X - X.mean(axis=0)) / np.where(sd > 0, sd, 1.0)
+
+
+def _squared_distances(X):
+    sq = (X * X).sum(axis=1)
+    D = sq[:, None] + sq[None, :] - 2 * X @ X.T
+    np.maximum(D, 0, out=D)
+    np.fill_diagonal(D, 0)
+    return D
+
+
+def _affinities(X, perplexity, steps=100, tol=1e-5):
+    # symmetric t-SNE input affinities from each point's 3 * perplexity nearest neighbours; the
+    # gaussian precision of every row is binary-searched at once
+    n = len(X)
+    k = min(n - 1, int(3 * perplexity))
+    D = _squared_distances(X)
+    np.fill_diagonal(D, np.inf)
+    neighbours = np.argpartition(D, k - 1, axis=1)[:, :k]
+    d = np.take_along_axis(D, neighbours, axis=1)
+    d = d - d.min(axis=1, keepdims=True)
+
+    target = np.log(perplexity)
+    beta = np.ones(n)
+    lo = np.zeros(n)
+    hi = np.full(n, np.inf)
+    for _ in range(steps):
+        P = np.exp(-d * beta[:, None])
+        total = P.sum(axis=1)
+        entropy = np.log(total) + beta * (d * P).sum(axis=1) / total
+        diff = entropy - target
+        if np.abs(diff).max() < tol:
+            break
+        # entropy too high -> narrower gaussian
+        up = diff > 0
+        lo = np.where(up, beta, lo)
+        hi = np.where(up, hi, beta)
+        beta = np.where(np.isinf(hi), beta * 2, (lo + hi) / 2)
+    P = P / P.sum(axis=1, keepdims=True)
+
+    dense = np.zeros((n, n))
+    np.put_along_axis(dense, neighbours, P, axis=1)
+    dense = dense + dense.T
+    return dense / dense.sum()
+
+
+def _pca(X, dims=2):
+    U, S, Vt = np.linalg.svd(X - X.mean(axis=0), full_matrices=False)
+    Y = U[:, :dims] * S[:dims]
+    # fix the sign of each axis so reruns and small data changes don't flip the picture
+    return Y * np.sign(Y[np.abs(Y).argmax(axis=0), range(dims)])
+
+
+def mds(X, dims=2):
+    # classical (Torgerson) MDS on euclidean distances is the same as PCA scores
+    return _pca(X, dims)
+
+
+def tsne(X, perplexity=30.0, iterations=1000, exaggeration=12.0, exaggeration_iterations=250,
+         learning_rate=None, seed=0):
+    n = len(X)
+    # the perplexity has to leave room for that many neighbours (35 months -> 11)
+    perplexity = min(perplexity, (n - 1) / 3)
+    P = _affinities(X, perplexity)
+    learning_rate = max(n / exaggeration, 50.0) if learning_rate is None else learning_rate
+
+    # pca start, scaled down, plus a little seeded jitter to break exact ties
+    Y = _pca(X)
+    Y = Y / Y[:, 0].std() * 1e-4
+    Y = Y + np.random.default_rng(seed).normal(scale=1e-6, size=Y.shape)
+
+    # the gradient is sum_j (exaggeration * p_ij - q_ij) * num_ij * (y_i - y_j), with
+    # num = 1 / (1 + |y_i - y_j|^2) and q = num / sum(num): one n x n weight matrix, one row sum and
+    # one matmul per iteration, in float32
+    P = P.astype('float32')
+    Y = Y.astype('float32')
+    update = np.zeros_like(Y)
+    gains = np.ones_like(Y)
+    for step in range(iterations):
+        early = step < exaggeration_iterations
+        num = _squared_distances(Y)
+        num += 1.0
+        np.reciprocal(num, out=num)
+        np.fill_diagonal(num, 0)
+        W = num / -num.sum()
+        W += (exaggeration if early else 1.0) * P
+        W *= num
+        grad = 4 * (W.sum(axis=1)[:, None] * Y - W @ Y)
+
+        momentum = 0.5 if early else 0.8
+        same_sign = np.sign(grad) == np.sign(update)
+        gains = np.maximum(np.where(same_sign, gains * 0.8, gains + 0.2), 0.01)
+        update = momentum * update - learning_rate * gains * grad
+        Y = Y + update
+        Y = Y - Y.mean(axis=0)
+    return Y.astype('float64')
+
+
+EMBEDDERS = {'tsne': tsne, 'mds': mds}
+
+
+def cache_key(matrix, method, params):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([method, sorted(params.items()), list(matrix.columns)]).encode())
+    digest.update(np.asarray(matrix.index, dtype=str).astype('U').tobytes())
+    digest.update(np.ascontiguousarray(matrix.to_numpy(dtype='float64')).tobytes())
+    return digest.hexdigest()
+
+
+def cache_path(key, method):
+    return os.path.join(EMBEDDING_DIR, '%s-%s.parquet' % (method, key))
+
+
+def embed(matrix, method='tsne', **params):
+    # (dim1, dim2) for every row of the matrix, read from the disk cache when this exact input and
+    # these parameters were embedded before
+    if method not in EMBEDDERS:
+        raise ValueError('method must be one of %s' % ', '.join(METHODS))
+    path = cache_path(cache_key(matrix, method, params), method)
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+
+    Y = EMBEDDERS[method](standardize(matrix), **params)
+    out = pd.DataFrame(Y, index=matrix.index, columns=['dim1', 'dim2'])
+    os.makedirs(EMBEDDING_DIR, exist_ok=True)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    out.to_parquet(tmp)
+    os.replace(tmp, path)
+    return out
+
+
+def embedding_frame(grain='month', method='tsne', **params):
+    # the coordinates plus what the similarity page draws: the activity columns, period and label
+    matrix = activity_matrix(grain)
+    coords = embed(matrix, method, **params)
+    dates = pd.Series(pd.to_datetime(matrix.index))
+    out = pd.concat([coords, matrix], axis=1).reset_index()
+    out['time_period'] = time_periods(dates)
+    if grain == 'month':
+        out['date_label'] = month_labels(dates)
+    else:
+        out['date_label'] = dates.dt.strftime('%b %d %Y')
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Embed the month or day x activity matrix and cache the result.')
+    parser.add_argument('--grain', choices=GRAINS, default='month')
+    parser.add_argument('--method', choices=METHODS, default='tsne')
+    parser.add_argument('--perplexity', type=float)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    params = {k: v for k, v in (('perplexity', args.perplexity), ('seed', args.seed)) if v is not None}
+    if args.method == 'mds' and params:
+        parser.error('mds takes no parameters')
+    out = embedding_frame(args.grain, args.method, **params)
+    print(out[['date', 'dim1', 'dim2', 'time_period']].to_string(index=False))
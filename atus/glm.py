@@ -0,0 +1,270 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtri
+
+from atus.data import PUBLISHED_BOUNDARIES, time_periods
+from atus.ingest import ACTIVITIES, ACTIVITY_NAMES, HEALTHCARE_OCC2, diary_dates, eligible, read_extract, write_table
+
+
+# refits page 5's poisson log-link models of minutes per activity (models.csv) and the time period x
+# sex / marital status interaction models (models2.csv) straight from the extract. every activity
+# shares one design matrix, so IRLS runs all of a model's activities at once: per iteration one
+# (activities x respondents) weight matrix and one batched solve of the p x p normal equations.
+# activities are split over worker processes that each get the design matrix once, up front
+
+SIGNIFICANCE = 0.05
+# R's glm.control defaults
+TOLERANCE = 1e-8
+MAX_ITERATIONS = 25
+
+# model terms -> the design columns they add, named like the VARIABLE column of models.csv. the
+# reference groups are pre-COVID peak, male, white, never married, high school and weekday
+MAIN_TERMS = {
+    'time period': ['COVID Peak', 'Post-COVID Peak'],
+    'age': ['Age'],
+    'sex': ['Sex: Female'],
+    'race': ['Race: Black', 'Race: American Indian or Alaskan Native', 'Race: Asian or Pacific Islander',
+             'Race: Other'],
+    'marital status': ['Marital Status: Married', 'Marital Status: Previously Married'],
+    'education': ['Education: Less than High School', 'Education: Some College',
+                  'Education: Bachelors Degree', 'Education: Graduate Degree'],
+    'occupation': ['Occupation: Healthcare Worker'],
+    'weekend': ['Weekend Day'],
+}
+INTERACTION_TERMS = {
+    'time period x sex': ['COVID Peak x Female', 'Post-COVID x Female'],
+    'time period x marital status': ['COVID Peak x Married', 'Post-COVID Peak x Married',
+                                     'COVID Peak x Previously Married', 'Post-COVID x Previously Married'],
+}
+
+# output table -> (terms, activities). models.csv drops the intercepts and adds the interpretations
+MODELS = {
+    'models': (MAIN_TERMS, ACTIVITY_NAMES),
+    'models2': ({**MAIN_TERMS, **INTERACTION_TERMS}, ['Household Activities', 'Caring for Household']),
+}
+
+MODEL_COLUMNS = ['upperCI', 'lowerCI', 'ESTIMATE', 'EXP_EST', 'VARIABLE', 'CI_LENGTH', 'ACTIVITY', 'SIGNIFICANT']
+INTERP_COLUMNS = ['PERCENT_CHANGE', 'SIGN_PERCENT_CHANGE', 'INTERP']
+
+
+def _races(race):
+    # 100 white only (reference), 110 black, 120 american indian / alaskan native, 130-132 asian or
+    # pacific islander, everything multiracial (2xx and up) is other
+    return {
+        'Race: Black': race == 110,
+        'Race: American Indian or Alaskan Native': race == 120,
+        'Race: Asian or Pacific Islander': race.between(130, 132),
+        'Race: Other': race >= 200,
+    }
+
+
+def _marital_statuses(marst):
+    # 1-2 married, 3-5 widowed / divorced / separated, 6 never married (reference)
+    return {
+        'Marital Status: Married': marst.between(1, 2),
+        'Marital Status: Previously Married': marst.between(3, 5),
+    }
+
+
+def _educations(educ):
+    # 10-17 no diploma, 20-21 high school (reference), 30-32 some college or associate, 40 bachelor's,
+    # 41-43 master's / professional / doctorate
+    return {
+        'Education: Less than High School': educ.between(10, 17),
+        'Education: Some College': educ.between(30, 32),
+        'Education: Bachelors Degree': educ == 40,
+        'Education: Graduate Degree': educ.between(41, 43),
+    }
+
+
+def predictors(chunk, holidays=False):
+    # one row per eligible respondent with every main-effect and interaction column, plus weights
+    # and the minutes per activity. like the demographic tables, holiday diary days are left out
+    keep, weight = eligible(chunk)
+    keep = keep & (chunk['RACE'] < 9999) & chunk['MARST'].between(1, 6) & (chunk['EDUC'] < 999)
+    if not holidays:
+        keep = keep & (chunk['HOLIDAY'] != 1)
+    weight = weight[keep.to_numpy()]
+    chunk = chunk[keep]
+
+    # the published cutoffs, so a refit keeps models.csv's meaning of 'COVID Peak'
+    period = time_periods(diary_dates(chunk), PUBLISHED_BOUNDARIES)
+    columns = {
+        'COVID Peak': period == 'COVID Peak',
+        'Post-COVID Peak': period == 'Post-COVID Peak',
+        'Age': chunk['AGE'],
+        'Sex: Female': chunk['SEX'] == 2,
+        **_races(chunk['RACE']),
+        **_marital_statuses(chunk['MARST']),
+        **_educations(chunk['EDUC']),
+        'Occupation: Healthcare Worker': chunk['OCC2'].isin(HEALTHCARE_OCC2),
+        # DAY is 1 for sunday through 7 for saturday
+        'Weekend Day': chunk['DAY'].isin([1, 7]),
+    }
+    X = pd.DataFrame({name: np.asarray(values, dtype='float64') for name, values in columns.items()})
+    female = X['Sex: Female']
+    married = X['Marital Status: Married']
+    previously = X['Marital Status: Previously Married']
+    X['COVID Peak x Female'] = X['COVID Peak'] * female
+    X['Post-COVID x Female'] = X['Post-COVID Peak'] * female
+    X['COVID Peak x Married'] = X['COVID Peak'] * married
+    X['Post-COVID Peak x Married'] = X['Post-COVID Peak'] * married
+    X['COVID Peak x Previously Married'] = X['COVID Peak'] * previously
+    X['Post-COVID x Previously Married'] = X['Post-COVID Peak'] * previously
+    minutes = chunk[list(ACTIVITIES)].to_numpy(dtype='float64')
+    return X, np.asarray(weight, dtype='float64'), minutes
+
+
+def microdata(path, chunksize=100000, holidays=False):
+    parts = [predictors(chunk, holidays) for chunk in read_extract(path, chunksize=chunksize)]
+    X = pd.concat([p[0] for p in parts], ignore_index=True)
+    return X, np.concatenate([p[1] for p in parts]), np.concatenate([p[2] for p in parts])
+
+
+def irls(X, Y, weights=None, dispersion='poisson'):
+    # poisson log-link fits of every column of Y (respondents x activities) on the same X
+    # (respondents x p, intercept included). returns (activities x p) coefficients and standard errors
+    n, p = X.shape
+    prior = np.ones(n) if weights is None else weights / weights.mean()
+    mu = Y + 0.1
+    eta = np.log(mu)
+    deviance = np.full(Y.shape[1], np.inf)
+
+    def normal_equations(mu):
+        W = (prior[:, None] * mu).T
+        XW = W[:, :, None] * X[None]
+        return XW, XW.transpose(0, 2, 1) @ X
+
+    for _ in range(MAX_ITERATIONS):
+        XW, XtWX = normal_equations(mu)
+        z = eta + (Y - mu) / mu
+        XtWz = np.einsum('knp,nk->kp', XW, z)
+        beta = np.linalg.solve(XtWX, XtWz[..., None])[..., 0]
+        eta = X @ beta.T
+        mu = np.exp(eta)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            unit = np.where(Y > 0, Y * np.log(Y / mu), 0.0) - (Y - mu)
+        previous, deviance = deviance, 2 * (prior[:, None] * unit).sum(axis=0)
+        if np.all(np.abs(deviance - previous) / (np.abs(deviance) + 0.1) < TOLERANCE):
+            break
+
+    covariance = np.linalg.inv(normal_equations(mu)[1])
+    if dispersion == 'quasipoisson':
+        pearson = (prior[:, None] * (Y - mu) ** 2 / mu).sum(axis=0)
+        covariance = covariance * (pearson / (n - p))[:, None, None]
+    return beta, np.sqrt(np.diagonal(covariance, axis1=1, axis2=2))
+
+
+def bonferroni_z(terms):
+    # the page's "99.4%" intervals: alpha split over the model's predictors (8 of them -> 99.375%)
+    return ndtri(1 - SIGNIFICANCE / len(terms) / 2)
+
+
+def _percent_text(value):
+    # R's paste() prints 39.2 and 1.4, not 39.20 and 1.40
+    return ('%.2f' % value).rstrip('0').rstrip('.')
+
+
+def interpret(table):
+    change = table['EXP_EST'] - 1
+    table['PERCENT_CHANGE'] = (change.abs() * 100).round(2)
+    table['SIGN_PERCENT_CHANGE'] = np.sign(table['ESTIMATE']).astype('int64')
+    activity = table['ACTIVITY'].str.lower()
+    amount = table['PERCENT_CHANGE'].map(_percent_text) + np.where(change < 0, '% less', '% more')
+    categorical = ('On average, the amount of time spent on ' + activity + ' is ' + amount
+                   + ' than that of the reference group, given all other variables are held constant.')
+    age = ('On average, each additional year in age is associated with ' + amount + ' minutes on '
+           + activity + ' given the other variables are held constant.')
+    table['INTERP'] = np.where(table['VARIABLE'] == 'Age', age, categorical)
+    return table[MODEL_COLUMNS + INTERP_COLUMNS]
+
+
+def model_table(activities, variables, beta, se, z):
+    # rows in the models.csv schema. the R tidy-up wrote est + z*se as lowerCI and est - z*se as
+    # upperCI (so CI_LENGTH is negative); the pages only read the pair, the order is kept as shipped
+    k, p = beta.shape
+    estimate = beta.ravel()
+    half = z * se.ravel()
+    table = pd.DataFrame({
+        'upperCI': estimate - half,
+        'lowerCI': estimate + half,
+        'ESTIMATE': estimate,
+        'EXP_EST': np.exp(estimate),
+        'VARIABLE': np.tile(variables, k),
+        'CI_LENGTH': -2 * half,
+        'ACTIVITY': np.repeat(activities, p),
+        # the interval doesn't cover zero
+        'SIGNIFICANT': (np.abs(estimate) > half).astype('int64'),
+    })
+    return table[MODEL_COLUMNS]
+
+
+# design matrix, weights and minutes for the worker processes, set once per worker
+_shared = {}
+
+
+def _share(X, weights, minutes):
+    _shared.update(X=X, weights=weights, minutes=minutes)
+
+
+def _fit(columns, activity_index, weights, dispersion):
+    X = _shared['X']
+    design = np.column_stack([np.ones(len(X)), X[columns].to_numpy()])
+    return irls(design, _shared['minutes'][:, activity_index], _shared['weights'] if weights else None, dispersion)
+
+
+def fit_models(X, weights, minutes, models=None, weighted=False, dispersion='poisson', workers=None):
+    # {table name: models.csv / models2.csv style frame}. the published models were unweighted poisson
+    # fits; weighted=True uses the survey weights (scaled to mean 1) instead
+    models = MODELS if models is None else models
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    tasks = []
+    for name, (terms, activities) in models.items():
+        columns = [c for cols in terms.values() for c in cols]
+        index = [ACTIVITY_NAMES.index(a) for a in activities]
+        for part in np.array_split(np.arange(len(index)), min(workers, len(index))):
+            tasks.append((name, columns, [index[i] for i in part]))
+
+    if workers > 1:
+        with ProcessPoolExecutor(workers, initializer=_share, initargs=(X, weights, minutes)) as pool:
+            futures = [pool.submit(_fit, columns, part, weighted, dispersion) for _, columns, part in tasks]
+            results = [f.result() for f in futures]
+    else:
+        _share(X, weights, minutes)
+        results = [_fit(columns, part, weighted, dispersion) for _, columns, part in tasks]
+
+    out = {}
+    for (name, columns, part), (beta, se) in zip(tasks, results):
+        terms = models[name][0]
+        table = model_table([ACTIVITY_NAMES[i] for i in part], ['Intercept'] + columns, beta, se,
+                            bonferroni_z(terms))
+        out.setdefault(name, []).append(table)
+    for name, parts in out.items():
+        table = pd.concat(parts, ignore_index=True)
+        if name == 'models':
+            table = interpret(table[table['VARIABLE'] != 'Intercept'].reset_index(drop=True))
+        out[name] = table
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Refit the page 5 activity models from an IPUMS ATUS extract.')
+    parser.add_argument('extract', help='atus_000NN.dat(.gz) fixed-width file or the csv export')
+    parser.add_argument('--out', default='data')
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--weighted', action='store_true', help='use the survey weights')
+    parser.add_argument('--dispersion', choices=['poisson', 'quasipoisson'], default='poisson')
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    X, weights, minutes = microdata(args.extract, args.chunksize)
+    tables = fit_models(X, weights, minutes, weighted=args.weighted, dispersion=args.dispersion,
+                        workers=args.workers)
+    for name, table in tables.items():
+        path = os.path.join(args.out, name + '.csv')
+        write_table(table, path)
+        print('wrote', path)
@@ -0,0 +1,225 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from atus import ingest, sketch
+from atus.data import DATA_DIR, time_periods
+
+
+# the ingest state (weighted moments per day x demographic cell x activity), split into one parquet
+# file per survey month. a new release only touches the months it contains, so only those partitions
+# and the matching rows of the month-level tables get rewritten
+STATE_DIR = os.path.join(DATA_DIR, 'state')
+# the quantile sketches of the same cells (see atus.sketch), partitioned the same way
+SKETCH_DIR = os.path.join(DATA_DIR, 'sketch')
+
+# tables keyed by month that refresh() patches in place
+MONTHLY_TABLES = ['monthly_combined', 'avg_time_all_years_bymonth_occ', 'waterfall', 'tsne_barchart']
+# the ones refreshed from the sketches instead of the moments
+SKETCH_TABLES = ['med_time_bymonth']
+
+
+def partition_path(month, directory=STATE_DIR):
+    return os.path.join(directory, month + '.parquet')
+
+
+def partition_months(directory=STATE_DIR):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(f[:-8] for f in os.listdir(directory) if f.endswith('.parquet'))
+
+
+def _month_keys(dates):
+    return dates.dt.strftime('%Y-%m')
+
+
+def save_partitions(state, directory=STATE_DIR):
+    # replaces every month partition present in state, returns the months written
+    os.makedirs(directory, exist_ok=True)
+    months = _month_keys(state['DATE'])
+    written = []
+    for month, part in state.groupby(months, sort=True):
+        target = partition_path(month, directory)
+        tmp = '%s.%d.tmp' % (target, os.getpid())
+        part.reset_index(drop=True).to_parquet(tmp, index=False)
+        os.replace(tmp, target)
+        written.append(month)
+    return written
+
+
+def load_state(months=None, directory=STATE_DIR):
+    months = partition_months(directory) if months is None else months
+    parts = [pd.read_parquet(partition_path(m, directory)) for m in months]
+    return pd.concat(parts, ignore_index=True)
+
+
+def load_sketch(months=None):
+    return load_state(months, SKETCH_DIR)
+
+
+def _read_table(name):
+    path = os.path.join(DATA_DIR, name + '.csv')
+    if not os.path.exists(path):
+        return None
+    df = pd.read_csv(path)
+    return df.drop(columns=[c for c in df.columns if c.startswith('Unnamed: ')])
+
+
+def _month_number(month):
+    # MONTH is an int in some tables and 'Jan' style in others
+    if pd.api.types.is_numeric_dtype(month):
+        return month.astype('int64')
+    return month.map({m: i + 1 for i, m in enumerate(ingest.MONTH_ABBREVIATIONS)}).astype('int64')
+
+
+def _table_months(df):
+    return df['YEAR'].astype(str) + '-' + _month_number(df['MONTH']).map('{:02d}'.format)
+
+
+def _activity_order(activity):
+    return pd.Categorical(activity, categories=ingest.ACTIVITY_NAMES, ordered=True)
+
+
+def _patch(old, new, months):
+    # drop the stale rows for the refreshed months and put the new ones in their place
+    if old is None:
+        return new
+    keep = old[~_table_months(old).isin(months)]
+    return pd.concat([keep, new[old.columns]], ignore_index=True)
+
+
+def _sorted(df, by):
+    order = df.assign(_month=_month_number(df['MONTH']), _activity=_activity_order(df['ACTIVITY']))
+    by = ['_month' if c == 'MONTH' else '_activity' if c == 'ACTIVITY' else c for c in by]
+    return df.loc[order.sort_values(by, kind='stable').index]
+
+
+def refresh_monthly_combined(state, months):
+    new = ingest.monthly_combined(state)
+    return _sorted(_patch(_read_table('monthly_combined'), new, months), ['YEAR', 'MONTH', 'ACTIVITY'])
+
+
+def refresh_occ(state, months):
+    new = ingest.avg_time_all_years_bymonth_occ(state)
+    return _sorted(_patch(_read_table('avg_time_all_years_bymonth_occ'), new, months),
+                   ['OCC_GROUP', 'MONTH', 'YEAR', 'ACTIVITY'])
+
+
+def refresh_waterfall(state, months):
+    # count / nonzerocount / percent_nonzero only for the refreshed months
+    new = ingest.waterfall(state)
+    table = _patch(_read_table('waterfall'), new, months).reset_index(drop=True)
+
+    # ORDER is just the month's position, cheap to redo; amount is a month-over-month delta, so it
+    # changes for each refreshed month and for the month right after it
+    stamp = table['YEAR'] * 12 + _month_number(table['MONTH'])
+    table['ORDER'] = stamp.rank(method='dense').astype('int64')
+    refreshed = _table_months(table).isin(months)
+    after_refreshed = table['ORDER'].isin(table.loc[refreshed, 'ORDER'] + 1)
+    dirty = refreshed | after_refreshed
+
+    by_order = table.sort_values('ORDER')
+    previous = by_order.groupby('ACTIVITY', sort=False)['percent_nonzero'].shift()
+    amount = (by_order['percent_nonzero'] - previous).fillna(by_order['percent_nonzero'])
+    table.loc[dirty, 'amount'] = amount[dirty[dirty].index]
+    return _sorted(table, ['MONTH', 'YEAR', 'ACTIVITY'])
+
+
+def refresh_tsne_barchart(state, months):
+    # value is the monthly mean; the embedding coordinates are kept for months we already had and
+    # left empty for brand new months until the embedding is rerun
+    old = _read_table('tsne_barchart')
+    monthly = ingest.monthly_combined(state)
+    dates = pd.to_datetime(dict(year=monthly['YEAR'], month=monthly['MONTH'], day=1))
+    new = pd.DataFrame({
+        'date': dates.dt.strftime('%Y-%m'),
+        'MONTH': monthly['MONTH'],
+        'YEAR': monthly['YEAR'],
+        'time_period': np.asarray(time_periods(dates)),
+        'date_label': dates.dt.strftime('%b %Y'),
+        'ACTIVITY': monthly['ACTIVITY'],
+        'value': monthly['mean'],
+    })
+    if old is not None:
+        coords = old[['date', 'tsne1', 'tsne2']].drop_duplicates('date')
+        new = new.merge(coords, on='date', how='left')
+    else:
+        new['tsne1'] = np.nan
+        new['tsne2'] = np.nan
+    return _sorted(_patch(old, new, months), ['YEAR', 'MONTH', 'ACTIVITY'])
+
+
+def refresh_med_time(sketches, months):
+    new = sketch.med_time_bymonth(sketches)
+    return _patch(_read_table('med_time_bymonth'), new, months).sort_values(['YEAR', 'MONTH'], kind='stable')
+
+
+REFRESHERS = {
+    'monthly_combined': refresh_monthly_combined,
+    'avg_time_all_years_bymonth_occ': refresh_occ,
+    'waterfall': refresh_waterfall,
+    'tsne_barchart': refresh_tsne_barchart,
+    'med_time_bymonth': refresh_med_time,
+}
+
+
+def _write(df, name):
+    path = os.path.join(DATA_DIR, name + '.csv')
+    ingest.write_table(df, path)
+    return path
+
+
+def refresh(extract, chunksize=100000, tables=None):
+    # ingest only the new release, swap in its month partitions (a release carries whole months,
+    # so they replace ours outright) and patch the month-level tables
+    state, sketches = sketch.ingest(extract, chunksize=chunksize)
+    months = save_partitions(state)
+    save_partitions(sketches, SKETCH_DIR)
+
+    written = []
+    for name in tables or MONTHLY_TABLES + SKETCH_TABLES:
+        source = sketches if name in SKETCH_TABLES else state
+        written.append(_write(REFRESHERS[name](source, months), name))
+    return months, written
+
+
+def init(extract, chunksize=100000):
+    # full ingest, partitioned, plus every table the ingest knows about
+    state, sketches = sketch.ingest(extract, chunksize=chunksize)
+    months = save_partitions(state)
+    save_partitions(sketches, SKETCH_DIR)
+    written = ingest.build_tables(state, DATA_DIR)
+    written.append(_write(sketch.med_time_bymonth(sketches), 'med_time_bymonth'))
+    return months, written
+
+
+def rebuild():
+    # every table from the saved partitions, no extract needed
+    state = load_state()
+    written = ingest.build_tables(state, DATA_DIR)
+    if partition_months(SKETCH_DIR):
+        written.append(_write(sketch.med_time_bymonth(load_sketch()), 'med_time_bymonth'))
+    return partition_months(), written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep per-month ingest state and refresh month-level tables.')
+    parser.add_argument('command', choices=['init', 'refresh', 'rebuild'])
+    parser.add_argument('extract', nargs='?', help='IPUMS ATUS extract (.dat or csv) holding the months to (re)load')
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--tables', nargs='*', choices=MONTHLY_TABLES + SKETCH_TABLES)
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        months, written = rebuild()
+    elif args.extract is None:
+        parser.error('%s needs an extract' % args.command)
+    elif args.command == 'init':
+        months, written = init(args.extract, chunksize=args.chunksize)
+    else:
+        months, written = refresh(args.extract, chunksize=args.chunksize, tables=args.tables)
+    print('months:', ', '.join(months))
+    for path in written:
+        print('wrote', path)
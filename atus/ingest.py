@@ -0,0 +1,344 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+from atus.moments import Moments, aggregate
+from atus.significance import welch
+
+
+# replaces the R cleaning scripts: streams the IPUMS ATUS person-level extract (one row per
+# respondent diary day, with the ACT_* activity summary minutes) and rebuilds the avg_time_*
+# style tables in data/ with the same columns the pages read.
+
+# fixed-width layout from data/person_data_codebook.pdf (1-based, inclusive positions)
+LAYOUT = {
+    'YEAR': (1, 5),
+    'STATEFIP': (21, 22),
+    'MONTH': (60, 62),
+    'DAY': (63, 64),
+    'HOLIDAY': (65, 66),
+    'DATE': (67, 75),
+    'WT06': (76, 92),
+    'WT20': (93, 107),
+    'AGE': (108, 110),
+    'SEX': (111, 112),
+    'RACE': (113, 116),
+    'MARST': (124, 125),
+    'EDUC': (131, 133),
+    'OCC2': (147, 150),
+    'ACT_CAREHH': (198, 201),
+    'ACT_CARENHH': (202, 205),
+    'ACT_EDUC': (206, 209),
+    'ACT_FOOD': (210, 213),
+    'ACT_GOVSERV': (214, 217),
+    'ACT_HHACT': (218, 221),
+    'ACT_HHSERV': (222, 225),
+    'ACT_PCARE': (226, 229),
+    'ACT_PHONE': (230, 233),
+    'ACT_PROFSERV': (234, 237),
+    'ACT_PURCH': (238, 241),
+    'ACT_RELIG': (242, 245),
+    'ACT_SOCIAL': (246, 249),
+    'ACT_SPORTS': (250, 253),
+    'ACT_TRAVEL': (254, 257),
+    'ACT_VOL': (258, 261),
+    'ACT_WORK': (262, 265),
+}
+# the .dat file leaves decimal points out, the csv export writes them
+IMPLIED_DECIMALS = {'WT20': 6}
+
+# IPUMS activity variables and the names the pages use, in the order the tables list them
+ACTIVITIES = {
+    'ACT_CAREHH': 'Caring for Household',
+    'ACT_CARENHH': 'Caring for Non-Household',
+    'ACT_EDUC': 'Education',
+    'ACT_FOOD': 'Eating and Drinking',
+    'ACT_GOVSERV': 'Civic Duties',
+    'ACT_HHACT': 'Household Activities',
+    'ACT_HHSERV': 'Household Services',
+    'ACT_PCARE': 'Personal Care',
+    'ACT_PHONE': 'Phone Calls',
+    'ACT_PROFSERV': 'Care Services',
+    'ACT_PURCH': 'Consumer Purchasing',
+    'ACT_RELIG': 'Religious/Spiritual Activities',
+    'ACT_SOCIAL': 'Socializing and Leisure',
+    'ACT_SPORTS': 'Sports and Exercise',
+    'ACT_TRAVEL': 'Traveling',
+    'ACT_VOL': 'Volunteering',
+    'ACT_WORK': 'Work',
+}
+ACTIVITY_NAMES = list(ACTIVITIES.values())
+
+SEXES = ['Male', 'Female']
+AGE_GROUPS = ['15-24', '25-34', '35-44', '45-54', '55-64', '65-74', '75+']
+AGE_BINS = [14, 24, 34, 44, 54, 64, 74, 200]
+OCC_GROUPS = ['Healthcare Worker', 'Non-Healthcare Worker']
+# OCC2 codes for healthcare practitioner/technical and healthcare support occupations
+HEALTHCARE_OCC2 = [127, 130]
+MONTH_ABBREVIATIONS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                       'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+# the finest grain we keep. every table is a roll-up of this, so the raw rows never have to be held at once
+STATE_KEYS = ['DATE', 'HOLIDAY', 'SEX', 'AGE_GROUP', 'OCC_GROUP', 'ACTIVITY']
+# per cell: total weight, weighted mean, weighted sum of squared deviations, respondents, respondents with time > 0
+STATE_COLUMNS = ['W', 'mean', 'M2', 'n', 'nonzero']
+
+
+def read_extract(path, chunksize=100000):
+    names = list(LAYOUT)
+    if path.endswith(('.csv', '.csv.gz')):
+        reader = pd.read_csv(path, usecols=names, chunksize=chunksize)
+        scale = {}
+    else:
+        colspecs = [(start - 1, end) for start, end in LAYOUT.values()]
+        reader = pd.read_fwf(path, colspecs=colspecs, names=names, header=None,
+                             chunksize=chunksize, dtype='float64')
+        scale = IMPLIED_DECIMALS
+
+    for chunk in reader:
+        for col, places in scale.items():
+            chunk[col] = chunk[col] / 10 ** places
+        yield chunk
+
+
+def eligible(chunk):
+    # 2020 respondents need the 2020-methodology weights, the other years use WT06
+    weight = np.where(chunk['YEAR'] == 2020, chunk['WT20'], chunk['WT06'])
+    keep = (chunk['DATE'] < 99999999) & (chunk['AGE'] < 996) & chunk['SEX'].isin([1, 2]) & (weight > 0)
+    return keep, weight
+
+
+def diary_dates(chunk):
+    return pd.to_datetime(chunk['DATE'].astype('int64').astype(str), format='%Y%m%d')
+
+
+def respondents(chunk):
+    keep, weight = eligible(chunk)
+    chunk = chunk[keep]
+
+    people = pd.DataFrame({
+        'DATE': diary_dates(chunk),
+        'STATEFIP': chunk['STATEFIP'].astype('int64'),
+        'HOLIDAY': chunk['HOLIDAY'] == 1,
+        'SEX': pd.Categorical.from_codes(chunk['SEX'].astype(int) - 1, categories=SEXES),
+        'AGE_GROUP': pd.cut(chunk['AGE'], bins=AGE_BINS, labels=AGE_GROUPS),
+        'OCC_GROUP': pd.Categorical.from_codes(np.where(chunk['OCC2'].isin(HEALTHCARE_OCC2), 0, 1),
+                                               categories=OCC_GROUPS),
+        'weight': weight[keep.to_numpy()],
+    })
+    minutes = chunk[list(ACTIVITIES)].to_numpy(dtype='float64')
+    return people, minutes
+
+
+def chunk_state(people, minutes):
+    # long format: one row per respondent x activity
+    n_people, n_acts = minutes.shape
+    long = people.loc[people.index.repeat(n_acts), STATE_KEYS[:-1]].reset_index(drop=True)
+    long['ACTIVITY'] = pd.Categorical.from_codes(np.tile(np.arange(n_acts), n_people), categories=ACTIVITY_NAMES)
+    w = np.repeat(people['weight'].to_numpy(), n_acts)
+    x = minutes.ravel()
+
+    long['W'] = w
+    long['WX'] = w * x
+    long['n'] = 1
+    long['nonzero'] = (x > 0).astype('int64')
+    groups = long.groupby(STATE_KEYS, observed=True, sort=False)
+    # two passes inside the chunk so M2 is built from deviations, not from sum(w*x^2) - W*mean^2
+    mean = groups['WX'].transform('sum') / groups['W'].transform('sum')
+    long['M2'] = w * (x - mean) ** 2
+
+    state = long.groupby(STATE_KEYS, observed=True)[['W', 'WX', 'M2', 'n', 'nonzero']].sum()
+    state['mean'] = state['WX'] / state['W']
+    return state[STATE_COLUMNS].reset_index()
+
+
+def rollup(state, by):
+    # exact merge of the cells into groups, see atus.moments
+    cells = Moments(state['W'], state['mean'], state['M2'], state['n'])
+    out, merged = aggregate(state, by, cells, sums=['nonzero'])
+    out['W'] = merged.w
+    out['mean'] = merged.mean
+    out['M2'] = merged.m2
+    out['n'] = merged.n.astype('int64')
+    out['nonzero'] = out['nonzero'].astype('int64')
+    return out[by + STATE_COLUMNS]
+
+
+def ingest(path, chunksize=100000):
+    # single pass over the extract, memory is bounded by the number of state cells, not respondents
+    state = None
+    pending = []
+    for chunk in read_extract(path, chunksize=chunksize):
+        pending.append(chunk_state(*respondents(chunk)))
+        # only fold the partials in once they outgrow the state, so merging stays linear overall
+        if state is None or sum(len(p) for p in pending) >= len(state):
+            state = rollup(pd.concat(([] if state is None else [state]) + pending, ignore_index=True), STATE_KEYS)
+            pending = []
+    if pending:
+        state = rollup(pd.concat([state] + pending, ignore_index=True), STATE_KEYS)
+    return state
+
+
+def finish(table):
+    # weighted sd with the usual n/(n-1) small-sample correction
+    n = table['n'].astype('float64')
+    variance = table['M2'] / table['W'] * n / (n - 1)
+    table['sd'] = np.sqrt(variance.where(n > 1))
+    return table
+
+
+def _with_calendar(state):
+    state = state.copy()
+    state['YEAR'] = state['DATE'].dt.year
+    state['MONTH'] = state['DATE'].dt.month
+    return state
+
+
+def _no_holidays(state):
+    # the monthly and demographic tables were built without holiday diary days (see page 1)
+    return state[~state['HOLIDAY']]
+
+
+def _with_overall(state, by, label='Overall'):
+    # the tables stack an 'Overall' row on top of the per-group rows
+    overall = rollup(state, [c for c in by if c not in ('SEX', 'AGE_GROUP', 'MONTH')] + ['ACTIVITY'])
+    for col in by:
+        if col in ('SEX', 'AGE_GROUP', 'MONTH'):
+            overall[col] = label
+    detail = rollup(state, by + ['ACTIVITY'])
+    for col in by:
+        if col in ('SEX', 'AGE_GROUP', 'MONTH'):
+            detail[col] = detail[col].astype(str)
+    return pd.concat([overall, detail], ignore_index=True)
+
+
+def compare_years(state, by, first=2019, second=2021):
+    state = _with_calendar(_no_holidays(state))
+    years = {}
+    for year in (first, second):
+        table = finish(_with_overall(state[state['YEAR'] == year], by))
+        years[year] = table.set_index(by + ['ACTIVITY'])[['mean', 'sd', 'n']]
+
+    both = years[first].join(years[second], lsuffix='_%d' % first, rsuffix='_%d' % second, how='inner')
+    out = both.reset_index()
+    out = out[by + ['ACTIVITY', 'mean_%d' % first, 'mean_%d' % second, 'sd_%d' % first, 'sd_%d' % second,
+                    'n_%d' % first, 'n_%d' % second]]
+    out['DIFF'] = out['mean_%d' % first] - out['mean_%d' % second]
+    out['t_test'] = welch(out['mean_%d' % first], out['sd_%d' % first], out['n_%d' % first],
+                          out['mean_%d' % second], out['sd_%d' % second], out['n_%d' % second])[2]
+    out['significant'] = np.where(out['t_test'] < 0.05, 'YES', 'NO')
+    return out
+
+
+def avg_time_all_years_byday(state):
+    # daily tables keep holidays, otherwise those dates would just be missing from the series
+    out = finish(rollup(state, ['DATE', 'ACTIVITY']))
+    out['day_of_week'] = out['DATE'].dt.day_name()
+    out['DATE'] = out['DATE'].dt.strftime('%Y-%m-%d')
+    return out[['DATE', 'ACTIVITY', 'mean', 'sd', 'n', 'day_of_week']]
+
+
+def avg_time_2020_byday(state):
+    out = finish(rollup(state[state['DATE'].dt.year == 2020], ['DATE', 'ACTIVITY']))
+    out['DATE'] = out['DATE'].dt.strftime('%Y-%m-%d')
+    return out[['DATE', 'ACTIVITY', 'mean', 'sd', 'n']]
+
+
+def avg_time_2020_bymonth(state):
+    state = _with_calendar(_no_holidays(state))
+    out = finish(_with_overall(state[state['YEAR'] == 2020], ['MONTH']))
+    return out[['MONTH', 'ACTIVITY', 'mean', 'sd', 'n']]
+
+
+def avg_time_2020(state):
+    state = _with_calendar(_no_holidays(state))
+    out = finish(_with_overall(state[state['YEAR'] == 2020], ['SEX', 'AGE_GROUP']))
+    return out[['SEX', 'AGE_GROUP', 'ACTIVITY', 'mean', 'sd', 'n']]
+
+
+def avg_time_2019_2021(state):
+    return compare_years(state, ['SEX', 'AGE_GROUP'])
+
+
+def avg_time_2019_2021_bymonth(state):
+    return compare_years(state, ['MONTH'])
+
+
+def avg_time_all_years_bymonth_occ(state):
+    state = _with_calendar(_no_holidays(state))
+    out = finish(rollup(state, ['OCC_GROUP', 'YEAR', 'MONTH', 'ACTIVITY']))
+    out = out.sort_values(['OCC_GROUP', 'MONTH', 'YEAR', 'ACTIVITY'])
+    month = out['MONTH'] - 1
+    out['MONTH'] = np.array(MONTH_ABBREVIATIONS)[month]
+    out['MONTH_YEAR'] = out['MONTH'] + ' ' + out['YEAR'].astype(str)
+    return out[['OCC_GROUP', 'MONTH', 'YEAR', 'ACTIVITY', 'mean', 'sd', 'n', 'MONTH_YEAR']]
+
+
+def monthly_combined(state):
+    state = _with_calendar(_no_holidays(state))
+    out = rollup(state, ['YEAR', 'MONTH', 'ACTIVITY'])
+    return out[['MONTH', 'YEAR', 'ACTIVITY', 'mean']]
+
+
+def waterfall(state):
+    state = _with_calendar(_no_holidays(state))
+    out = rollup(state, ['YEAR', 'MONTH', 'ACTIVITY'])
+    out['ORDER'] = (out['YEAR'] * 12 + out['MONTH']).rank(method='dense').astype('int64')
+    out = out.sort_values(['MONTH', 'YEAR', 'ACTIVITY'])
+
+    out['count'] = out['n']
+    out['nonzerocount'] = out['nonzero']
+    out['percent_nonzero'] = out['nonzerocount'] / out['count']
+    out['label'] = np.array(MONTH_ABBREVIATIONS)[out['MONTH'] - 1] + ' ' + out['YEAR'].astype(str)
+    out['MONTH'] = np.array(MONTH_ABBREVIATIONS)[out['MONTH'] - 1]
+    # month over month change in participation, the first month starts from zero
+    by_order = out.sort_values('ORDER')
+    out['amount'] = by_order.groupby('ACTIVITY', observed=True)['percent_nonzero'].diff().fillna(by_order['percent_nonzero'])
+    return out[['MONTH', 'YEAR', 'ACTIVITY', 'count', 'nonzerocount', 'percent_nonzero', 'label', 'ORDER', 'amount']]
+
+
+# output file name -> builder. med_time_bymonth needs quantiles, not moments (atus.sketch builds
+# it); tsne*, mds and the coded-activity daily tables still come from elsewhere
+TABLES = {
+    'avg_time_all_years_byday': avg_time_all_years_byday,
+    'avg_time_2020_byday': avg_time_2020_byday,
+    'avg_time_2020_bymonth': avg_time_2020_bymonth,
+    'avg_time_2020': avg_time_2020,
+    'avg_time_2019_2021': avg_time_2019_2021,
+    'avg_time_2019_2021_bymonth': avg_time_2019_2021_bymonth,
+    'avg_time_all_years_bymonth_occ': avg_time_all_years_bymonth_occ,
+    'monthly_combined': monthly_combined,
+    'waterfall': waterfall,
+}
+
+
+def write_table(df, path):
+    # same layout R's write.csv produced: quoted header and strings, 1-based row names in an unnamed column
+    df = df.reset_index(drop=True)
+    df.index = df.index + 1
+    tmp = path + '.tmp'
+    df.to_csv(tmp, index_label='', quoting=csv.QUOTE_NONNUMERIC)
+    os.replace(tmp, path)
+
+
+def build_tables(state, out_dir='data', tables=None):
+    written = []
+    for name in tables or TABLES:
+        path = os.path.join(out_dir, name + '.csv')
+        write_table(TABLES[name](state), path)
+        written.append(path)
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the avg_time_* tables from an IPUMS ATUS extract.')
+    parser.add_argument('extract', help='atus_000NN.dat(.gz) fixed-width file or the csv export')
+    parser.add_argument('--out', default='data')
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--tables', nargs='*', choices=sorted(TABLES))
+    args = parser.parse_args()
+
+    for path in build_tables(ingest(args.extract, chunksize=args.chunksize), args.out, args.tables):
+        print('wrote', path)
@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.Slider_pb2 import Slider
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+
+# concurrent viewers of one streamlit process. the app is started with `streamlit run` (or an
+# already running one is given with --url) and every viewer is a websocket client speaking the same
+# protocol as a browser tab: it opens main.py and each page and makes random selections on it the
+# way a viewer would (switching activities on pages 3, 4 and 8, moving the month range, flipping the
+# embedding...), sending back every widget's state like the frontend does. a rerun's latency is from
+# the request to the server's script_finished. for every concurrency level we report p50 / p95 /
+# p99 rerun latency, reruns per second and the server memory each open session holds. (AppTest
+# can't do this: it swaps the runtime in and out of process-wide globals on every run, so two of
+# them in threads trip over each other)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ['main.py'] + sorted('pages/' + f for f in os.listdir(os.path.join(ROOT, 'pages')) if f.endswith('.py'))
+
+# page -> the widgets a viewer plays with, as (kind, label)
+ACTIONS = {
+    'pages/2_Similarities_Among_Time_Periods.py': [('radio', 'Points:'), ('radio', 'Method:'),
+                                                   ('selectbox', 'Compare to:'), ('slider', 'How many:')],
+    'pages/3_Trends_in_Average_Time_Spent.py': [('selectbox', 'Select activity:'), ('radio', 'Show:'),
+                                                ('radio', 'Periods:')],
+    'pages/4_COVID_Impact_on_Activity_Participation.py': [('selectbox', 'Select activity:'),
+                                                          ('select_slider', 'Months:')],
+    'pages/5_The_Numbers_Behind_These_Trends.py': [('selectbox', 'Select activity:')],
+    'pages/7_Trends_by_Age_&_Sex.py': [('selectbox', 'Select sex:'), ('selectbox', 'Select age group:'),
+                                       ('selectbox', 'Multiple-comparison correction:')],
+    'pages/8_Healthcare_Workers.py': [('selectbox', 'Select activity:')],
+    'pages/9_Stringency_and_Time_Use.py': [('selectbox', 'Select region:'), ('selectbox', 'Select activity:'),
+                                           ('radio', 'Average time use over:')],
+}
+
+LEVELS = [1, 2, 4, 8]
+# selections per page per session
+STEPS = 3
+# seconds
+TIMEOUT = 120
+STARTUP = 60
+
+
+def page_name(page):
+    # the name streamlit gives a page file in the sidebar (and in its navigation message)
+    if page == 'main.py':
+        return 'main'
+    return re.sub(r'^\d*_?', '', os.path.basename(page)[:-3]).replace('_', ' ')
+
+
+def rss(pid):
+    # resident memory of a process in bytes
+    with open('/proc/%d/statm' % pid) as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def start_server(port):
+    # `streamlit run main.py` on port, once it answers its health check
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', os.path.join(ROOT, 'main.py'), '--server.headless', 'true',
+         '--server.port', str(port), '--server.fileWatcherType', 'none', '--browser.gatherUsageStats', 'false'],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + STARTUP
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:%d/_stcore/health' % port, timeout=1):
+                return server
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.25)
+    server.kill()
+    raise RuntimeError('streamlit did not come up on port %d' % port)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _kind(element):
+    kind = element.WhichOneof('type')
+    if kind == 'slider' and element.slider.type == Slider.SELECT_SLIDER:
+        return 'select_slider'
+    return kind
+
+
+def _select(state, kind, widget, rng):
+    # a random new value for the widget, the way a viewer would pick one
+    if kind == 'select_slider':
+        first, second = sorted(rng.sample(range(len(widget.options)), 2))
+        state.string_array_value.data[:] = [widget.options[first], widget.options[second]]
+    elif kind == 'slider':
+        steps = int(round((widget.max - widget.min) / (widget.step or 1)))
+        state.double_array_value.data[:] = [widget.min + rng.randint(0, steps) * (widget.step or 1)]
+    else:
+        state.string_value = rng.choice(list(widget.options))
+    return state
+
+
+class Viewer:
+    # one browser tab: a websocket session, the pages the app has and the widgets on screen
+    def __init__(self, socket_):
+        self.socket = socket_
+        self.pages = {}
+        self.widgets = {}
+        self.states = {}
+
+    @classmethod
+    async def connect(cls, url):
+        viewer = cls(await websockets.connect(url.rstrip('/') + '/_stcore/stream', max_size=None))
+        await viewer.rerun()
+        return viewer
+
+    async def rerun(self, page=None, states=()):
+        # seconds until the script finished and whether it ran without an exception
+        message = BackMsg()
+        message.rerun_script.SetInParent()
+        if page is not None:
+            message.rerun_script.page_script_hash = self.pages[page]
+        message.rerun_script.widget_states.widgets.extend(states)
+        start = time.perf_counter()
+        await self.socket.send(message.SerializeToString())
+        self.widgets, ok = {}, True
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await asyncio.wait_for(self.socket.recv(), TIMEOUT))
+            kind = forward.WhichOneof('type')
+            if kind == 'navigation':
+                self.pages = {p.page_name: p.page_script_hash for p in forward.navigation.app_pages}
+            elif kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                widget_kind = _kind(element)
+                if widget_kind == 'exception':
+                    ok = False
+                widget = getattr(element, element.WhichOneof('type'))
+                if getattr(widget, 'label', None) and getattr(widget, 'id', None):
+                    self.widgets[widget_kind, widget.label] = widget
+            elif kind == 'script_finished' and forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return time.perf_counter() - start, ok and forward.script_finished != ForwardMsg.FINISHED_WITH_COMPILE_ERROR
+
+    async def open(self, page):
+        self.states = {}
+        return await self.rerun(page_name(page))
+
+    async def choose(self, page, kind, label, rng):
+        # None when the widget isn't on the page (e.g. missing optional data)
+        widget = self.widgets.get((kind, label))
+        if widget is None:
+            return None
+        self.states[widget.id] = _select(WidgetState(id=widget.id), kind, widget, rng)
+        return await self.rerun(page_name(page), self.states.values())
+
+    async def close(self):
+        await self.socket.close()
+
+
+async def session(url, rng, steps=STEPS, pages=PAGES):
+    # one viewer going through every page: (page, 'open' or widget label, seconds, ok) per rerun,
+    # plus the viewer, still connected, so the caller decides how long the session stays alive
+    viewer = await Viewer.connect(url)
+    samples = []
+    for page in pages:
+        samples.append((page, 'open') + await viewer.open(page))
+        actions = ACTIONS.get(page, [])
+        for _ in range(steps if actions else 0):
+            kind, label = rng.choice(actions)
+            result = await viewer.choose(page, kind, label, rng)
+            if result is not None:
+                samples.append((page, label) + result)
+    return samples, viewer
+
+
+def percentiles(seconds):
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) if len(seconds) else (np.nan,) * 3
+    return {'p50': p50, 'p95': p95, 'p99': p99}
+
+
+async def run_level(url, sessions, steps=STEPS, seed=0, pages=PAGES, pid=None):
+    # sessions viewers at once; each stays connected until all of them are done, so the server
+    # memory measured then is every session open at the same time
+    before = rss(pid) if pid else None
+    start = time.perf_counter()
+    results = await asyncio.gather(*(session(url, random.Random(seed + i), steps, pages) for i in range(sessions)))
+    wall = time.perf_counter() - start
+    held = rss(pid) - before if pid else np.nan
+    for _, viewer in results:
+        await viewer.close()
+
+    samples = [s for result, _ in results for s in result]
+    seconds = np.array([s[2] for s in samples])
+    out = {'sessions': sessions, 'reruns': len(samples), 'errors': sum(not s[3] for s in samples),
+           'seconds': wall, 'reruns_per_second': len(samples) / wall,
+           'mb_per_session': max(held, 0) / sessions / 2 ** 20}
+    out.update(percentiles(seconds))
+    out['pages'] = {page: percentiles(seconds[[s[0] == page for s in samples]]) for page in pages}
+    return out
+
+
+async def _run(url, levels, steps, seed, warmup, pages, pid):
+    if warmup:
+        # one viewer first, so the first level doesn't pay for the process-wide caches
+        _, viewer = await session(url, random.Random(seed), 1, pages)
+        await viewer.close()
+    return [await run_level(url, n, steps, seed, pages, pid) for n in levels]
+
+
+def run(levels=LEVELS, steps=STEPS, seed=0, warmup=True, pages=PAGES, url=None):
+    # against the app at url, or a fresh `streamlit run` of this checkout (then with memory too)
+    server = None
+    if url is None:
+        port = free_port()
+        server = start_server(port)
+        url = 'ws://127.0.0.1:%d' % port
+    try:
+        return asyncio.run(_run(url, levels, steps, seed, warmup, pages, server and server.pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def report(levels):
+    lines = ['%8s %7s %6s %9s %9s %9s %9s %10s' % ('sessions', 'reruns', 'errors', 'p50', 'p95', 'p99',
+                                                 'reruns/s', 'MB/session')]
+    for level in levels:
+        lines.append('%8d %7d %6d %7.0fms %7.0fms %7.0fms %9.2f %10.1f' % (
+            level['sessions'], level['reruns'], level['errors'], 1e3 * level['p50'], 1e3 * level['p95'],
+            1e3 * level['p99'], level['reruns_per_second'], level['mb_per_session']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate concurrent viewers of the app and report rerun latency.')
+    parser.add_argument('--levels', nargs='+', type=int, default=LEVELS, help='numbers of simultaneous sessions')
+    parser.add_argument('--steps', type=int, default=STEPS, help='selections per page per session')
+    parser.add_argument('--pages', nargs='+', choices=PAGES, default=PAGES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-warmup', action='store_true')
+    parser.add_argument('--url', help='load an app that is already running, e.g. ws://localhost:8501 '
+                                      '(no memory figures then)')
+    parser.add_argument('--out', help='also write the results (with per-page percentiles) to this json file')
+    args = parser.parse_args()
+
+    levels = run(args.levels, args.steps, args.seed, not args.no_warmup, args.pages, args.url)
+    print(report(levels))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(levels, f, indent=2)
+        print('wrote', args.out)
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+
+# weighted (weight, mean, M2, n) summaries that merge exactly, so daily cells can be rolled up to
+# weeks / months / years (or any slice) without going back to the microdata.
+# M2 is the weighted sum of squared deviations from the mean; sd uses the same n/(n-1)
+# correction as atus.ingest.finish, so from_mean_sd(...).sd() gives back the sd it was built from.
+
+
+class Moments:
+    __slots__ = ('w', 'mean', 'm2', 'n')
+
+    def __init__(self, w, mean, m2, n):
+        self.w = np.asarray(w, dtype='float64')
+        self.mean = np.asarray(mean, dtype='float64')
+        self.m2 = np.asarray(m2, dtype='float64')
+        self.n = np.asarray(n, dtype='float64')
+
+    @classmethod
+    def from_mean_sd(cls, mean, sd, n, w=None):
+        # the shipped tables only carry mean/sd/n; without the survey weights, n stands in for the weight
+        mean = np.asarray(mean, dtype='float64')
+        n = np.asarray(n, dtype='float64')
+        w = n if w is None else np.asarray(w, dtype='float64')
+        sd = np.nan_to_num(np.asarray(sd, dtype='float64'))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m2 = np.where(n > 1, sd ** 2 * w * (n - 1) / n, 0.0)
+        return cls(w, mean, m2, n)
+
+    @classmethod
+    def from_frame(cls, df, mean='mean', sd='sd', n='n', w=None):
+        return cls.from_mean_sd(df[mean], df[sd], df[n], None if w is None else df[w])
+
+    def __len__(self):
+        return len(self.w)
+
+    def __getitem__(self, index):
+        return Moments(self.w[index], self.mean[index], self.m2[index], self.n[index])
+
+    def __add__(self, other):
+        # elementwise pooled merge of two aligned sets of cells
+        w = self.w + other.w
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = other.mean - self.mean
+            mean = np.where(w > 0, self.mean + delta * other.w / w, np.nan)
+            m2 = self.m2 + other.m2 + np.where(w > 0, delta ** 2 * self.w * other.w / w, 0.0)
+        return Moments(w, mean, m2, self.n + other.n)
+
+    def var(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.n > 1, self.m2 / self.w * self.n / (self.n - 1), np.nan)
+
+    def sd(self):
+        return np.sqrt(self.var())
+
+    def reduce(self, codes, size=None):
+        # merges every cell into group codes[i] in one pass: bincount for the sums, then one more
+        # for the between-cell spread around each group's mean
+        codes = np.asarray(codes)
+        size = int(codes.max()) + 1 if size is None else size
+        w = np.bincount(codes, self.w, size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.bincount(codes, self.w * self.mean, size) / w
+        spread = self.w * (self.mean - mean[codes]) ** 2
+        m2 = np.bincount(codes, self.m2, size) + np.bincount(codes, spread, size)
+        return Moments(w, mean, m2, np.bincount(codes, self.n, size))
+
+    def collapse(self, axis):
+        # merges a dense grid of cells along one or more axes, keeping those axes with length 1
+        filled = np.nan_to_num(self.mean)
+        w = self.w.sum(axis=axis, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = (self.w * filled).sum(axis=axis, keepdims=True) / w
+        spread = (self.w * (filled - np.nan_to_num(mean)) ** 2).sum(axis=axis, keepdims=True)
+        m2 = self.m2.sum(axis=axis, keepdims=True) + spread
+        return Moments(w, mean, m2, self.n.sum(axis=axis, keepdims=True))
+
+    def rolling(self, window):
+        # trailing window over axis 0 of a (time x series) grid, via cumulative sums. deviations are
+        # taken around each series' overall mean so the differenced sums don't cancel badly
+        w, mean, m2, n = (a.reshape(len(a), -1) for a in (self.w, self.mean, self.m2, self.n))
+        filled = np.nan_to_num(mean)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            center = (w * filled).sum(axis=0) / w.sum(axis=0)
+        shifted = filled - np.nan_to_num(center)
+
+        def window_sum(values):
+            total = np.cumsum(values, axis=0)
+            total[window:] = total[window:] - total[:-window]
+            return total
+
+        W = window_sum(w)
+        S = window_sum(w * shifted)
+        Q = window_sum(m2 + w * shifted ** 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            local = S / W
+            out_mean = np.where(W > 0, local + np.nan_to_num(center), np.nan)
+            out_m2 = np.where(W > 0, Q - W * local ** 2, 0.0)
+        return Moments(W, out_mean, np.maximum(out_m2, 0.0), window_sum(n))
+
+    def to_frame(self, index=None):
+        return pd.DataFrame({'mean': self.mean, 'sd': self.sd(), 'n': self.n, 'weight': self.w}, index=index)
+
+
+def aggregate(df, by, moments=None, sums=()):
+    # groupby + exact merge for a frame of cells; returns the group keys (plus any plain additive
+    # columns named in sums) and the merged moments, in sorted key order
+    moments = Moments.from_frame(df) if moments is None else moments
+    grouped = df.groupby(by, observed=True, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    merged = moments.reduce(codes, grouped.ngroups)
+    keys = df[by].iloc[np.unique(codes, return_index=True)[1]].reset_index(drop=True)
+    for col in sums:
+        keys[col] = np.bincount(codes, df[col].to_numpy(dtype='float64'), grouped.ngroups)
+    return keys, merged
+
+
+FREQUENCIES = {'week': 'W-SAT', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+
+
+def resample(daily, freq='month'):
+    # daily (DATE, ACTIVITY, mean, sd, n) table rolled up to weeks (Sun-Sat), months, quarters or years
+    periods = daily['DATE'].dt.to_period(FREQUENCIES.get(freq, freq))
+    keys, merged = aggregate(daily.assign(PERIOD=periods.dt.start_time), ['PERIOD', 'ACTIVITY'])
+    out = pd.concat([keys.rename(columns={'PERIOD': 'DATE'}), merged.to_frame()], axis=1)
+    return out[['DATE', 'ACTIVITY', 'mean', 'sd', 'n']]
+
+
+def rolling(daily, days=7, by=()):
+    # trailing calendar-day window (7 or 28 days, say) for every activity at once, within every by
+    # group (a state, say). days with no interviews, like Mar 18 - May 9 2020, just contribute
+    # nothing to the window. tables without an sd column (the per-state one) get means and n only
+    by = list(by) + ['ACTIVITY']
+    grid = pd.date_range(daily['DATE'].min(), daily['DATE'].max(), freq='D')
+    grouped = daily.groupby(by, observed=True, sort=True)
+    cols = grouped.ngroup().to_numpy()
+    keys = daily[by].iloc[np.unique(cols, return_index=True)[1]].reset_index(drop=True)
+    rows = grid.get_indexer(daily['DATE'])
+
+    cells = Moments.from_mean_sd(daily['mean'], daily['sd'] if 'sd' in daily else 0.0, daily['n'])
+    shape = (len(grid), len(keys))
+    dense = [np.zeros(shape) for _ in range(4)]
+    for target, values in zip(dense, (cells.w, cells.mean, cells.m2, cells.n)):
+        target[rows, cols] = values
+    window = Moments(*dense).rolling(days)
+
+    out = keys.iloc[np.tile(np.arange(len(keys)), len(grid))].reset_index(drop=True)
+    out.insert(0, 'DATE', np.repeat(grid, len(keys)))
+    out['mean'] = window.mean.ravel()
+    out['sd'] = window.sd().ravel()
+    out['n'] = window.n.ravel()
+    return out[out['n'] > 0].reset_index(drop=True)
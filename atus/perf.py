@@ -0,0 +1,228 @@
+import argparse
+import functools
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from atus.data import DATA_DIR
+from atus.shards import remember
+
+
+# timing spans around the hot paths of a rerun: every loader (with whether st.cache_resource had
+# it), the frame work inside the loaders, chart construction and spec serialization. a span is two
+# perf_counter calls and a dict update under a lock, so it stays on in production. spans are
+# aggregated per (page, span, hit or miss) in this process: counts, totals, max and the latest
+# RECENT durations for percentiles. pages call start_page / end_page around their script; end_page
+# writes the aggregates to data/perf/ every EXPORT_INTERVAL seconds (json, plus the prometheus text
+# format for node_exporter's textfile collector) and, with ?perf=1 in the url or ATUS_PERF=1 in the
+# environment, draws them in the sidebar
+
+PERF_DIR = os.path.join(DATA_DIR, 'perf')
+# durations kept per span for percentiles
+RECENT = 256
+# seconds between metrics file writes
+EXPORT_INTERVAL = 10.0
+
+_lock = threading.Lock()
+# (page, span, hit) -> [count, total seconds, max seconds, recent durations]
+_stats = {}
+_local = threading.local()
+# one export at a time, and when the last one was
+_export_lock = threading.Lock()
+_exported = [0.0]
+
+
+class Span:
+    # hit=None takes after the span it opens in: work inside a cache miss is part of the miss
+    __slots__ = ('name', 'hit', 'start')
+
+    def __init__(self, name, hit=None):
+        self.name = name
+        self.hit = hit
+
+    def __enter__(self):
+        spans = _open()
+        if self.hit is None:
+            self.hit = spans[-1].hit if spans else True
+        spans.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        _open().remove(self)
+        record(self.name, seconds, self.hit)
+        return False
+
+
+def _open():
+    spans = getattr(_local, 'spans', None)
+    if spans is None:
+        spans = _local.spans = []
+    return spans
+
+
+def span(name, hit=None):
+    return Span(name, hit)
+
+
+def miss():
+    # the spans open on this thread didn't find what they needed cached
+    for open_span in _open():
+        open_span.hit = False
+
+
+def record(name, seconds, hit=True):
+    page = getattr(_local, 'page', None) or '-'
+    rerun = getattr(_local, 'rerun', None)
+    if rerun is not None:
+        rerun.append((name, seconds, hit))
+    with _lock:
+        stat = _stats.get((page, name, hit))
+        if stat is None:
+            stat = _stats[page, name, hit] = [0, 0.0, 0.0, deque(maxlen=RECENT)]
+        stat[0] += 1
+        stat[1] += seconds
+        stat[2] = max(stat[2], seconds)
+        stat[3].append(seconds)
+
+
+def cache_resource(func):
+    # st.cache_resource plus a span named after the function around every call, a miss whenever
+    # the function body actually ran. the frames it returns are shared, so they're fingerprinted
+    # once (atus.shards)
+    @functools.wraps(func)
+    def body(*args, **kwargs):
+        miss()
+        result = func(*args, **kwargs)
+        remember(result)
+        return result
+
+    # streamlit keys the cache on module, qualname and source, and every page runs as __main__, so
+    # two pages with the same one-line loader would share its entry. the page file tells them apart
+    body.__qualname__ = '%s:%s' % (os.path.basename(func.__code__.co_filename), func.__qualname__)
+    cached = st.cache_resource(body)
+
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        with Span(func.__name__, hit=True):
+            return cached(*args, **kwargs)
+
+    call.clear = cached.clear
+    return call
+
+
+def start_page(path):
+    # the spans that follow on this thread belong to this page, until end_page
+    _local.page = os.path.splitext(os.path.basename(path))[0]
+    _local.rerun = []
+    _local.spans = []
+    _local.started = time.perf_counter()
+
+
+def end_page():
+    rerun = _local.rerun
+    # a rerun is a hit when everything it asked the caches for was there
+    record('rerun', time.perf_counter() - _local.started, all(hit for _, _, hit in rerun))
+    _local.rerun = None
+    if time.monotonic() - _exported[0] >= EXPORT_INTERVAL and _export_lock.acquire(blocking=False):
+        try:
+            _exported[0] = time.monotonic()
+            export()
+        except OSError:
+            # a read-only checkout still serves pages, it just doesn't leave metrics behind
+            pass
+        finally:
+            _export_lock.release()
+    if enabled():
+        panel(_local.page, rerun)
+
+
+def enabled():
+    return bool(os.environ.get('ATUS_PERF')) or st.query_params.get('perf') not in (None, '', '0')
+
+
+def summary(page=None):
+    # one row per (page, span, cache) with counts, mean / p50 / p95 / max milliseconds
+    with _lock:
+        items = [(key, stat[0], stat[1], stat[2], np.array(stat[3])) for key, stat in _stats.items()
+                 if page is None or key[0] == page]
+    rows = [{'page': p, 'span': name, 'cache': 'hit' if hit else 'miss', 'count': count,
+             'total_ms': 1e3 * total, 'mean_ms': 1e3 * total / count,
+             'p50_ms': 1e3 * np.percentile(recent, 50), 'p95_ms': 1e3 * np.percentile(recent, 95),
+             'max_ms': 1e3 * longest} for (p, name, hit), count, total, longest, recent in items]
+    columns = ['page', 'span', 'cache', 'count', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms']
+    return pd.DataFrame(rows, columns=columns).sort_values(['page', 'total_ms'], ascending=[True, False],
+                                                           ignore_index=True)
+
+
+def panel(page, rerun):
+    with st.sidebar.expander('Performance', expanded=True):
+        this = pd.DataFrame(rerun, columns=['span', 'seconds', 'hit'])
+        st.caption('This rerun')
+        st.dataframe(pd.DataFrame({'span': this['span'], 'ms': (1e3 * this['seconds']).round(1),
+                                   'cache': np.where(this['hit'], 'hit', 'miss')}),
+                     hide_index=True, width='stretch')
+        st.caption('Since the server started')
+        totals = summary(page).drop(columns=['page', 'total_ms'])
+        st.dataframe(totals.round(1), hide_index=True, width='stretch')
+
+
+def _prometheus(table):
+    lines = ['# HELP atus_span_seconds time spent in each instrumented span',
+             '# TYPE atus_span_seconds summary']
+    for row in table.itertuples(index=False):
+        labels = 'page="%s",span="%s",cache="%s"' % (row.page.replace('"', '\\"'), row.span, row.cache)
+        for quantile, value in (('0.5', row.p50_ms), ('0.95', row.p95_ms)):
+            lines.append('atus_span_seconds{%s,quantile="%s"} %.6f' % (labels, quantile, value / 1e3))
+        lines.append('atus_span_seconds_sum{%s} %.6f' % (labels, row.total_ms / 1e3))
+        lines.append('atus_span_seconds_count{%s} %d' % (labels, row.count))
+    return '\n'.join(lines) + '\n'
+
+
+def _write(text, path):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def export(directory=PERF_DIR):
+    # this process's aggregates as metrics-<pid>.json and metrics-<pid>.prom
+    table = summary()
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, 'metrics-%d' % os.getpid())
+    meta = {'pid': os.getpid(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    _write(json.dumps({'meta': meta, 'spans': table.to_dict('records')}, indent=2), base + '.json')
+    _write(_prometheus(table), base + '.prom')
+    return base + '.json'
+
+
+def collect(directory=PERF_DIR):
+    # every process's exported spans, one frame with a pid column
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, 'metrics-*.json'))):
+        with open(path) as f:
+            metrics = json.load(f)
+        frames.append(pd.DataFrame(metrics['spans']).assign(pid=metrics['meta']['pid']))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show where rerun time goes, from the metrics the app exports.')
+    parser.add_argument('--dir', default=PERF_DIR)
+    parser.add_argument('--page', help="only this page, e.g. '3_Trends_in_Average_Time_Spent'")
+    args = parser.parse_args()
+
+    table = collect(args.dir)
+    if args.page and len(table):
+        table = table[table['page'] == args.page]
+    pd.set_option('display.width', 200)
+    print(table.to_string(index=False, float_format='%.1f') if len(table) else 'no metrics in ' + args.dir)
@@ -0,0 +1,49 @@
+import hashlib
+import weakref
+
+import pandas as pd
+
+
+# pages split their frames once per process into per-selection shards, so a chart only ever
+# embeds the rows for the activity / group picked in the streamlit widget.
+#
+# what a cached loader returns (see perf.cache_resource) is shared by every session and never
+# modified, so those frames are fingerprinted once: id(frame) -> fingerprint (None until asked
+# for), dropped with the frame. anything else is hashed whenever it's asked for
+_cached = {}
+
+
+def split(df, by):
+    # {value: rows} for every value of the by column(s), rows kept in their original order
+    return {key: part.reset_index(drop=True) for key, part in df.groupby(by, observed=True, sort=False)}
+
+
+def remember(result):
+    # the frames in a cached loader's result: a frame, or dicts / tuples / lists of them
+    if isinstance(result, pd.DataFrame):
+        if id(result) not in _cached:
+            _cached[id(result)] = None
+            weakref.finalize(result, _cached.pop, id(result), None)
+    elif isinstance(result, dict):
+        for value in result.values():
+            remember(value)
+    elif isinstance(result, (tuple, list)):
+        for value in result:
+            remember(value)
+
+
+def content_hash(df):
+    # column names, dtypes and values (index ignored)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr([(c, str(t)) for c, t in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def fingerprint(df):
+    key = id(df)
+    if key not in _cached:
+        return content_hash(df)
+    if _cached[key] is None:
+        _cached[key] = content_hash(df)
+    return _cached[key]
@@ -0,0 +1,146 @@
+import os
+import re
+import threading
+
+import pandas as pd
+import pyarrow as pa
+
+from atus.data import DATA_DIR, dataset_names, is_stale as parquet_is_stale, load, parquet_path
+
+
+# uncompressed arrow ipc copies of the parquet cache. these get memory-mapped, so every
+# session and every streamlit process on the host reads the same pages out of the OS page cache
+ARROW_DIR = os.path.join(DATA_DIR, 'arrow')
+
+_lock = threading.Lock()
+# name -> (arrow file mtime, pyarrow table, pandas frame)
+_cache = {}
+
+_SMAPS_HEADER = re.compile(r'^[0-9a-f]+-[0-9a-f]+ ')
+
+
+def arrow_path(name):
+    return os.path.join(ARROW_DIR, name + '.arrow')
+
+
+def is_stale(name):
+    # older than the parquet copy it's made from, or than the csv behind that
+    if parquet_is_stale(name):
+        return True
+    target = arrow_path(name)
+    return not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(parquet_path(name))
+
+
+def build(name):
+    os.makedirs(ARROW_DIR, exist_ok=True)
+    table = pa.Table.from_pandas(load(name), preserve_index=False)
+
+    # same temp file + rename trick as atus.data, other processes keep their old mapping until they reload
+    target = arrow_path(name)
+    tmp = '%s.%d.tmp' % (target, os.getpid())
+    with pa.OSFile(tmp, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, target)
+    return target
+
+
+def _entry(name):
+    if is_stale(name):
+        build(name)
+    path = arrow_path(name)
+    mtime = os.path.getmtime(path)
+
+    entry = _cache.get(name)
+    if entry is None or entry[0] != mtime:
+        # read_all on a memory map doesn't copy, the table's buffers point straight into the file
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        # split_blocks keeps numeric/date columns as read-only views on those buffers instead of consolidating them
+        frame = table.to_pandas(split_blocks=True)
+        entry = (mtime, table, frame)
+        _cache[name] = entry
+    return entry
+
+
+def table(name):
+    with _lock:
+        return _entry(name)[1]
+
+
+def frame(name):
+    # pages wrap their loaders in st.cache_resource rather than st.cache_data, so sessions share
+    # what this returns instead of each unpickling their own copy.
+    # shallow copy, so a page can add or replace columns without touching the shared arrays
+    with _lock:
+        return _entry(name)[2].copy(deep=False)
+
+
+def _mapped_memory():
+    # resident (Rss) and proportional (Pss) bytes of each mapped arrow file, linux only.
+    # Pss splits shared pages between the processes mapping them, so it should shrink as processes are added
+    usage = {}
+    root = os.path.abspath(ARROW_DIR)
+    try:
+        smaps = open('/proc/self/smaps')
+    except OSError:
+        return usage
+
+    current = None
+    with smaps:
+        for line in smaps:
+            if _SMAPS_HEADER.match(line):
+                parts = line.split()
+                current = parts[5] if len(parts) > 5 and parts[5].startswith(root) else None
+            elif current is not None and line.startswith(('Rss:', 'Pss:')):
+                key, kb = line.split()[:2]
+                counts = usage.setdefault(current, {'Rss': 0, 'Pss': 0})
+                counts[key[:-1]] += int(kb) * 1024
+    return usage
+
+
+def process_rss():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def memory_report():
+    # one row per dataset loaded in this process. private_bytes is what the pandas frame holds
+    # on top of the mapping (strings, categorical codes, anything arrow couldn't hand over zero-copy)
+    mapped = _mapped_memory()
+    rows = []
+    with _lock:
+        for name, (mtime, tbl, df) in sorted(_cache.items()):
+            path = os.path.abspath(arrow_path(name))
+            shared = sum(buf.size for col in tbl.columns for chunk in col.chunks
+                         for buf in chunk.buffers() if buf is not None)
+            frame_bytes = int(df.memory_usage(deep=True, index=False).sum())
+            zero_copy = [c for c in df.columns
+                         if getattr(df[c].values, 'base', None) is not None and not df[c].values.flags.writeable]
+            zero_copy_bytes = int(df[zero_copy].memory_usage(index=False).sum()) if zero_copy else 0
+            rows.append({
+                'dataset': name,
+                'rows': tbl.num_rows,
+                'file_bytes': os.path.getsize(path),
+                'arrow_bytes': shared,
+                'frame_bytes': frame_bytes,
+                'private_bytes': frame_bytes - zero_copy_bytes,
+                'rss_bytes': mapped.get(path, {}).get('Rss', 0),
+                'pss_bytes': mapped.get(path, {}).get('Pss', 0),
+            })
+    return pd.DataFrame(rows, columns=['dataset', 'rows', 'file_bytes', 'arrow_bytes', 'frame_bytes',
+                                       'private_bytes', 'rss_bytes', 'pss_bytes'])
+
+
+if __name__ == '__main__':
+    # python -m atus.shared builds the arrow files for every dataset and prints the memory report
+    for name in dataset_names():
+        frame(name)
+    pd.set_option('display.width', 200)
+    print(memory_report().to_string(index=False))
+    print('process rss:', process_rss())
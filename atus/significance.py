@@ -0,0 +1,200 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.special import stdtr
+
+from atus.moments import aggregate
+
+
+# two-sample tests for whole tables of (group, activity, period pair) cells at once. welch works
+# straight from mean / sd / n arrays, so any pair of periods or slices that atus.moments can merge
+# can be tested without the microdata. the permutation mode does need the respondents, see the
+# command line at the bottom
+
+SIGNIFICANCE = 0.05
+CORRECTIONS = ['none', 'bonferroni', 'holm', 'bh']
+
+
+def welch(mean1, sd1, n1, mean2, sd2, n2):
+    # (t, degrees of freedom, two-sided p) for every cell. cells with no spread in either sample
+    # or fewer than two respondents come back as nan
+    mean1, sd1, n1, mean2, sd2, n2 = (np.asarray(a, dtype='float64') for a in (mean1, sd1, n1, mean2, sd2, n2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v1 = sd1 ** 2 / n1
+        v2 = sd2 ** 2 / n2
+        t = (mean1 - mean2) / np.sqrt(v1 + v2)
+        df = (v1 + v2) ** 2 / (v1 ** 2 / (n1 - 1) + v2 ** 2 / (n2 - 1))
+        p = 2 * stdtr(df, -np.abs(t))
+    return t, df, p
+
+
+def adjust(p, method='holm', groups=None):
+    # multiple-comparison adjusted p-values, each family being one value of groups (all cells
+    # when groups is None). nan p-values stay nan and don't count towards a family's size
+    p = np.asarray(p, dtype='float64')
+    if method == 'none':
+        return p.copy()
+    if method not in CORRECTIONS:
+        raise ValueError('method must be one of %s' % ', '.join(CORRECTIONS))
+
+    out = np.full(p.shape, np.nan)
+    valid = ~np.isnan(p)
+    codes = np.zeros(len(p), dtype='int64') if groups is None else pd.factorize(np.asarray(groups))[0]
+    codes, values = codes[valid], p[valid]
+    # sort by family, then p, so every family is one ascending run
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    size = np.bincount(codes)[codes]
+    rank = np.arange(len(values)) - np.searchsorted(codes, codes) + 1
+
+    if method == 'bonferroni':
+        adjusted = values * size
+    elif method == 'holm':
+        # step-down: p_(i) * (m - i + 1), kept monotone from the smallest p up
+        adjusted = pd.Series(values * (size - rank + 1)).groupby(codes).cummax().to_numpy()
+    else:
+        # benjamini-hochberg step-up: p_(i) * m / i, kept monotone from the largest p down
+        stepped = pd.Series((values * size / rank)[::-1])
+        adjusted = stepped.groupby(codes[::-1]).cummin().to_numpy()[::-1]
+
+    unsorted = np.empty(len(values))
+    unsorted[order] = np.minimum(adjusted, 1.0)
+    out[valid] = unsorted
+    return out
+
+
+def test_table(table, first, second, by=None, correction='none', alpha=SIGNIFICANCE):
+    # adds t_test (adjusted p) and significant (YES / NO) to a table with mean_X, sd_X and n_X
+    # columns for the two periods, like avg_time_2019_2021. with a correction, every value of by
+    # (a demographic group, say) is its own family of tests across activities
+    columns = [table['%s_%s' % (stat, period)] for period in (first, second) for stat in ('mean', 'sd', 'n')]
+    _, _, p = welch(*columns)
+    groups = None if by is None else table.groupby(by, observed=True, sort=False).ngroup().to_numpy()
+    table = table.copy()
+    table['t_test'] = adjust(p, correction, groups)
+    table['significant'] = np.where(table['t_test'] < alpha, 'YES', 'NO')
+    return table
+
+
+def window_moments(daily, start, end, by=('ACTIVITY',)):
+    # mean / sd / n per activity for the daily cells with start <= DATE <= end, merged exactly
+    cells = daily[(daily['DATE'] >= start) & (daily['DATE'] <= end)]
+    keys, merged = aggregate(cells, list(by))
+    return keys.assign(mean=merged.mean, sd=merged.sd(), n=merged.n)
+
+
+def compare_windows(daily, first, second, correction='none', alpha=SIGNIFICANCE):
+    # any two (start, end) date windows of a daily (DATE, ACTIVITY, mean, sd, n) table tested
+    # against each other for every activity, e.g. pre-COVID peak vs COVID peak months. the columns
+    # follow avg_time_2019_2021, suffixed _1 and _2 for the two windows
+    one = window_moments(daily, *first).set_index('ACTIVITY')
+    two = window_moments(daily, *second).set_index('ACTIVITY')
+    both = one.join(two, lsuffix='_1', rsuffix='_2', how='inner').reset_index()
+    both['DIFF'] = both['mean_1'] - both['mean_2']
+    return test_table(both, 1, 2, correction=correction, alpha=alpha)
+
+
+def _weighted_mean_differences(values, weights, labels):
+    # (weighted mean of the True side) - (weighted mean of the rest) for every row of labels
+    L = labels.astype('float64')
+    wv = weights * values
+    total_w, total_wv = weights.sum(), wv.sum()
+    w1 = L @ weights
+    s1 = L @ wv
+    return s1 / w1 - (total_wv - s1) / (total_w - w1)
+
+
+def permutation_p(x, y, wx=None, wy=None, resamples=9999, seed=0, batch=256):
+    # two-sided permutation p-value for the difference in (weighted) means of x and y: the period
+    # labels are reshuffled resamples times, a batch of shuffles per matrix product
+    values = np.concatenate([x, y]).astype('float64')
+    weights = np.concatenate([np.ones(len(x)) if wx is None else wx,
+                              np.ones(len(y)) if wy is None else wy]).astype('float64')
+    labels = np.arange(len(values)) < len(x)
+    observed = abs(_weighted_mean_differences(values, weights, labels[None])[0])
+
+    rng = np.random.default_rng(seed)
+    extreme = 0
+    for start in range(0, resamples, batch):
+        shuffled = rng.permuted(np.tile(labels, (min(batch, resamples - start), 1)), axis=1)
+        differences = _weighted_mean_differences(values, weights, shuffled)
+        # a little slack so ties with the observed difference count despite rounding
+        extreme += int((np.abs(differences) >= observed * (1 - 1e-12)).sum())
+    return (extreme + 1) / (resamples + 1)
+
+
+def _permutation_task(args):
+    return permutation_p(*args)
+
+
+def permutation_tests(samples, resamples=9999, seed=0, workers=1):
+    # permutation_p for a list of (x, y, wx, wy) samples, spread over worker processes. cell i
+    # uses seed + i, so results don't depend on the number of workers
+    tasks = [(x, y, wx, wy, resamples, seed + i) for i, (x, y, wx, wy) in enumerate(samples)]
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            return np.array(list(pool.map(_permutation_task, tasks, chunksize=max(1, len(tasks) // (4 * workers)))))
+    return np.array([_permutation_task(task) for task in tasks])
+
+
+def respondent_samples(people, minutes, activities, table, by, first, second):
+    # (x, y, wx, wy) per row of a compare_years table: the minutes (columns named by activities)
+    # and weights of the respondents in that row's group in each year. 'Overall' matches everyone
+    years = people['DATE'].dt.year.to_numpy()
+    weights = people['weight'].to_numpy()
+    samples = []
+    for row in table.itertuples(index=False):
+        group = np.ones(len(people), dtype=bool)
+        for col in by:
+            value = getattr(row, col)
+            if value != 'Overall':
+                group &= (people[col].astype(str) == str(value)).to_numpy()
+        column = minutes[:, activities.index(row.ACTIVITY)]
+        a = group & (years == first)
+        b = group & (years == second)
+        samples.append((column[a], column[b], weights[a], weights[b]))
+    return samples
+
+
+if __name__ == '__main__':
+    from atus.ingest import (ACTIVITY_NAMES, STATE_KEYS, chunk_state, compare_years, read_extract, respondents,
+                             rollup, write_table)
+
+    parser = argparse.ArgumentParser(description='Test every group x activity difference between two years of an IPUMS ATUS extract.')
+    parser.add_argument('extract', help='atus_000NN.dat(.gz) fixed-width file or the csv export')
+    parser.add_argument('--by', nargs='*', default=['SEX', 'AGE_GROUP'], choices=['SEX', 'AGE_GROUP', 'OCC_GROUP'])
+    parser.add_argument('--first', type=int, default=2019)
+    parser.add_argument('--second', type=int, default=2021)
+    parser.add_argument('--correction', choices=CORRECTIONS, default='none')
+    parser.add_argument('--permutations', type=int, default=0, help='also run a permutation test with this many resamples')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--out', help='write the table to this csv instead of printing it')
+    args = parser.parse_args()
+
+    people, minutes, states = [], [], []
+    for chunk in read_extract(args.extract):
+        chunk_people, chunk_minutes = respondents(chunk)
+        # like the tables, holiday diary days are left out
+        keep = ~chunk_people['HOLIDAY'].to_numpy()
+        people.append(chunk_people[keep])
+        minutes.append(chunk_minutes[keep])
+        states.append(chunk_state(chunk_people, chunk_minutes))
+    people = pd.concat(people, ignore_index=True)
+    minutes = np.concatenate(minutes)
+    state = rollup(pd.concat(states, ignore_index=True), STATE_KEYS)
+
+    table = compare_years(state, args.by, args.first, args.second)
+    table = test_table(table, args.first, args.second, args.by, args.correction)
+    if args.permutations:
+        samples = respondent_samples(people, minutes, ACTIVITY_NAMES, table, args.by, args.first, args.second)
+        p = permutation_tests(samples, args.permutations, args.seed, args.workers)
+        groups = table.groupby(args.by, observed=True, sort=False).ngroup().to_numpy()
+        table['permutation_test'] = adjust(p, args.correction, groups)
+
+    if args.out:
+        write_table(table, args.out)
+    else:
+        print(table.to_string(index=False))
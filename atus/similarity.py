@@ -0,0 +1,97 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import pdist, squareform
+
+from atus.data import PUBLISHED_BOUNDARIES
+from atus.embedding import GRAINS, activity_matrix, standardize
+
+
+# nearest neighbours among months or days by their 17-activity profile. every activity is scaled
+# to unit variance first, and distances are root mean squared over activities, so a distance of 0.5
+# means the two profiles are half a standard deviation apart on a typical activity. with ~1,000 days
+# the full distance matrix is 4MB of float32, and ranking every row once up front makes any
+# "k most similar" query a slice: no tree needed at 17 dimensions and this few points
+
+BASELINE_YEAR = 2019
+
+
+class SimilarityIndex:
+    __slots__ = ('grain', 'labels', 'distances', 'order')
+
+    def __init__(self, grain, labels, distances):
+        self.grain = grain
+        self.labels = pd.Index(labels)
+        self.distances = distances
+        # every row's neighbours, nearest first (itself included, at distance 0)
+        self.order = np.argsort(distances, axis=1, kind='stable').astype('int32')
+
+    @classmethod
+    def from_matrix(cls, matrix, grain='month'):
+        X = standardize(matrix)
+        distances = squareform(pdist(X)) / np.sqrt(X.shape[1])
+        return cls(grain, matrix.index, distances.astype('float32'))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _position(self, label):
+        position = self.labels.get_indexer([label])[0]
+        if position < 0:
+            raise KeyError('%s is not in the %s index' % (label, self.grain))
+        return position
+
+    def distance(self, first, second):
+        return float(self.distances[self._position(first), self._position(second)])
+
+    def nearest(self, label, k=5):
+        # the k months (or days) most similar to label, leaving label itself out
+        i = self._position(label)
+        neighbours = self.order[i, 1:k + 1]
+        return pd.DataFrame({'date': self.labels[neighbours], 'distance': self.distances[i, neighbours],
+                             'rank': np.arange(1, len(neighbours) + 1)})
+
+    def counterpart(self, label, year=BASELINE_YEAR):
+        # the same month of the baseline year, or for days the same weekday 52 weeks per year back
+        date = pd.Timestamp(label)
+        if self.grain == 'month':
+            return date.replace(year=year).strftime('%Y-%m')
+        return (date - pd.Timedelta(weeks=52 * (date.year - year))).strftime('%Y-%m-%d')
+
+    def counterpart_distances(self, start=None, year=BASELINE_YEAR):
+        # (date, counterpart, distance) for every label from start on, nan where the counterpart
+        # wasn't observed (no interviews in spring 2020, or a day that fell on a holiday)
+        labels = self.labels[self.labels >= start] if start is not None else self.labels
+        labels = labels[pd.to_datetime(labels).year > year]
+        counterparts = [self.counterpart(label, year) for label in labels]
+        rows = self.labels.get_indexer(labels)
+        columns = self.labels.get_indexer(counterparts)
+        distances = np.where(columns >= 0, self.distances[rows, np.maximum(columns, 0)], np.nan)
+        return pd.DataFrame({'date': labels, 'counterpart': counterparts, 'distance': distances})
+
+    def first_return(self, epsilon, start=None, year=BASELINE_YEAR):
+        # first label from start on within epsilon of its baseline-year counterpart, or None
+        distances = self.counterpart_distances(start, year)
+        close = distances[distances['distance'] <= epsilon]
+        return None if close.empty else close['date'].iloc[0]
+
+
+def build(grain='month'):
+    return SimilarityIndex.from_matrix(activity_matrix(grain), grain)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the months or days most like a given one.')
+    parser.add_argument('date', nargs='?', help="'2020-04' for months or '2020-04-15' for days")
+    parser.add_argument('--grain', choices=GRAINS, default='month')
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--epsilon', type=float, help='report the first month or day after the COVID peak this close to %d' % BASELINE_YEAR)
+    args = parser.parse_args()
+
+    index = build(args.grain)
+    if args.date:
+        print(index.nearest(args.date, args.k).to_string(index=False))
+    if args.epsilon is not None:
+        start = pd.Timestamp(PUBLISHED_BOUNDARIES[1]).strftime('%Y-%m' if args.grain == 'month' else '%Y-%m-%d')
+        print('first within %.2f of %d: %s' % (args.epsilon, BASELINE_YEAR, index.first_return(args.epsilon, start)))
@@ -0,0 +1,159 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from atus.ingest import (ACTIVITIES, ACTIVITY_NAMES, STATE_KEYS, chunk_state, read_extract, respondents, rollup,
+                         write_table)
+
+
+# weighted quantile sketches per ingest state cell (day x holiday x demographic cell x activity), so
+# medians and percentiles for any date range or slice come from merging sketches, the way the
+# moments in the state give means. a sketch is a handful of centroid rows (W, n, mean, low, high)
+# per cell; merging is concatenating and compressing again. compression is a t-digest with the
+# arcsine scale: centroids are narrow in the tails and at most DELTA + 2 per cell whatever the
+# number of respondents behind it. zeros are kept in a centroid of their own, so
+# participation-conditional quantiles just leave that centroid out, and the share of the weight
+# at zero is exact. within a centroid, values are taken as spread evenly from low to high, which
+# makes single respondents and ties (the zero centroid) exact
+
+DELTA = 100
+SKETCH_COLUMNS = ['W', 'n', 'mean', 'low', 'high']
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def chunk_sketch(people, minutes, delta=DELTA):
+    # one centroid per respondent x activity, compressed into the state cells
+    n_people, n_acts = minutes.shape
+    long = people.loc[people.index.repeat(n_acts), STATE_KEYS[:-1]].reset_index(drop=True)
+    long['ACTIVITY'] = pd.Categorical.from_codes(np.tile(np.arange(n_acts), n_people), categories=ACTIVITY_NAMES)
+    x = minutes.ravel()
+    long['W'] = np.repeat(people['weight'].to_numpy(), n_acts)
+    long['n'] = 1
+    long['mean'] = x
+    long['low'] = x
+    long['high'] = x
+    return compress(long, STATE_KEYS, delta)
+
+
+def compress(centroids, by, delta=DELTA):
+    # merges the centroids of every group of by down to at most delta + 2, in one sort for all groups.
+    # each centroid lands in bucket floor(k(q)) of its midpoint quantile q within the group, with
+    # k(q) = delta * (asin(2q - 1) / pi + 1/2), and every bucket becomes one centroid
+    cells = centroids.groupby(by, observed=True, sort=True).ngroup().to_numpy()
+    order = np.lexsort((centroids['mean'].to_numpy(), cells))
+    cells = cells[order]
+    sorted_ = centroids.iloc[order].reset_index(drop=True)
+    w = sorted_['W'].to_numpy()
+
+    cum = pd.Series(w).groupby(cells).cumsum().to_numpy()
+    total = np.bincount(cells, w)[cells]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q = np.clip((cum - w / 2) / total, 0, 1)
+    bucket = np.floor(delta * (np.arcsin(2 * q - 1) / np.pi + 0.5)).astype('int64')
+    bucket[sorted_['high'].to_numpy() == 0] = -1
+
+    keys = pd.DataFrame({'cell': cells, 'bucket': bucket})
+    sorted_['WX'] = w * sorted_['mean'].to_numpy()
+    grouped = sorted_.groupby([keys['cell'], keys['bucket']], sort=True)
+    out = grouped[by].first().reset_index(drop=True)
+    sums = grouped[['W', 'WX', 'n']].sum().reset_index(drop=True)
+    out['W'] = sums['W'].to_numpy()
+    out['n'] = sums['n'].to_numpy().astype('int64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['mean'] = sums['WX'].to_numpy() / out['W'].to_numpy()
+    out['low'] = grouped['low'].min().to_numpy()
+    out['high'] = grouped['high'].max().to_numpy()
+    return out[by + SKETCH_COLUMNS]
+
+
+def merge(*sketches, by=STATE_KEYS, delta=DELTA):
+    return compress(pd.concat(sketches, ignore_index=True), by, delta)
+
+
+def quantiles(sketch, by, qs=QUANTILES, nonzero=False, delta=DELTA):
+    # weighted quantiles (qs in [0, 1]) of every group of by, merged from the cell sketches. with
+    # nonzero, only respondents who spent any time on the activity count
+    cells = sketch[sketch['high'] > 0] if nonzero else sketch
+    merged = compress(cells, by, delta)
+    codes = merged.groupby(by, observed=True, sort=False).ngroup().to_numpy()
+    w = merged['W'].to_numpy()
+    end = pd.Series(w).groupby(codes).cumsum().to_numpy()
+    first = np.unique(codes, return_index=True)[1]
+    total = np.bincount(codes, w)
+    low, high = merged['low'].to_numpy(), merged['high'].to_numpy()
+
+    out = merged[by].iloc[first].reset_index(drop=True)
+    groups = np.arange(len(first))
+    # each group's centroids are one run of keys in (code, code + 1]. rounding can leave a group's
+    # last key a hair under code + 1, so the search is kept inside the group for q = 1
+    keys = codes + end / total[codes]
+    last = np.append(first[1:], len(codes)) - 1
+    for q in qs:
+        i = np.minimum(np.searchsorted(keys, groups + max(q, 1e-12), side='left'), last)
+        start = (end[i] - w[i]) / total
+        fraction = np.clip((q - start) * total / w[i], 0, 1)
+        out['p%g' % (100 * q)] = low[i] + (high[i] - low[i]) * fraction
+    # the weighted share of respondents with any time, from every centroid
+    weights = sketch.assign(zero=np.where(sketch['high'] == 0, sketch['W'], 0.0))
+    shares = weights.groupby(by, observed=True)[['W', 'zero']].sum()
+    share = (1 - shares['zero'] / shares['W']).rename('nonzero_share')
+    return out.join(share, on=by)
+
+
+def _with_calendar(sketch):
+    return sketch.assign(YEAR=sketch['DATE'].dt.year, MONTH=sketch['DATE'].dt.month)
+
+
+def med_time_bymonth(sketch):
+    # the published monthly medians (holiday diary days left out, activities by their ACT_ codes),
+    # now survey weighted
+    monthly = quantiles(_with_calendar(sketch[~sketch['HOLIDAY']]), ['YEAR', 'MONTH', 'ACTIVITY'], [0.5])
+    codes = dict(zip(ACTIVITY_NAMES, ACTIVITIES))
+    return pd.DataFrame({'YEAR': monthly['YEAR'], 'MONTH': monthly['MONTH'],
+                         'ACTIVITY': monthly['ACTIVITY'].astype(str).map(codes), 'MEDIAN': monthly['p50']})
+
+
+def ingest(path, chunksize=100000, delta=DELTA):
+    # atus.ingest.ingest plus the sketches, from the same single pass over the extract. both are
+    # folded in the same way, once the partials outgrow what's been merged so far
+    state, sketch = None, None
+    pending_state, pending_sketch = [], []
+    for chunk in read_extract(path, chunksize=chunksize):
+        people, minutes = respondents(chunk)
+        pending_state.append(chunk_state(people, minutes))
+        pending_sketch.append(chunk_sketch(people, minutes, delta))
+        if state is None or sum(len(p) for p in pending_state) >= len(state):
+            state = rollup(pd.concat(([] if state is None else [state]) + pending_state, ignore_index=True), STATE_KEYS)
+            sketch = merge(*([] if sketch is None else [sketch]) + pending_sketch, delta=delta)
+            pending_state, pending_sketch = [], []
+    if pending_state:
+        state = rollup(pd.concat([state] + pending_state, ignore_index=True), STATE_KEYS)
+        sketch = merge(sketch, *pending_sketch, delta=delta)
+    return state, sketch
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Weighted quantiles of time per activity from an IPUMS ATUS extract.')
+    parser.add_argument('extract', help='atus_000NN.dat(.gz) fixed-width file or the csv export')
+    parser.add_argument('--by', nargs='*', default=['YEAR', 'MONTH'],
+                        choices=['DATE', 'YEAR', 'MONTH', 'SEX', 'AGE_GROUP', 'OCC_GROUP'])
+    parser.add_argument('--quantiles', nargs='*', type=float, default=list(QUANTILES))
+    parser.add_argument('--start', help='first diary date, YYYY-MM-DD')
+    parser.add_argument('--end', help='last diary date, YYYY-MM-DD')
+    parser.add_argument('--nonzero', action='store_true', help='only respondents who did the activity')
+    parser.add_argument('--holidays', action='store_true', help='keep holiday diary days')
+    parser.add_argument('--out', help='write the table to this csv instead of printing it')
+    args = parser.parse_args()
+
+    _, sketch = ingest(args.extract)
+    sketch = _with_calendar(sketch if args.holidays else sketch[~sketch['HOLIDAY']])
+    if args.start:
+        sketch = sketch[sketch['DATE'] >= args.start]
+    if args.end:
+        sketch = sketch[sketch['DATE'] <= args.end]
+    table = quantiles(sketch, args.by + ['ACTIVITY'], args.quantiles, args.nonzero)
+    if args.out:
+        write_table(table, args.out)
+    else:
+        print(table.to_string(index=False))
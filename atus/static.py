@@ -0,0 +1,219 @@
+import argparse
+import html
+import json
+import os
+import re
+import shutil
+
+import pyarrow as pa
+from streamlit.testing.v1 import AppTest
+
+from atus.bench import page_definitions
+from atus.charts import compile_chart
+from atus.data import DATA_DIR
+from atus.warmup import CHARTS
+
+
+# the app as a static site: every page is run once (AppTest) for its narrative in order, and every
+# chart is compiled for every value of its page's main selectbox (the selections atus.warmup
+# prefetches). datasets become one json file each, named by content hash like the arrow datasets
+# in atus.charts, so shards shared between charts are written once, and specs point at them by
+# url. each page is one html file that draws its charts with vega-embed and swaps the spec when the
+# select changes, so a plain file server or CDN can serve all of it
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SITE_DIR = os.path.join(DATA_DIR, 'site')
+PAGES = ['main.py'] + sorted('pages/' + f for f in os.listdir(os.path.join(ROOT, 'pages')) if f.endswith('.py'))
+
+# element type -> html tag, for the text a page writes
+TEXT = {'title': 'h1', 'header': 'h2', 'subheader': 'h3', 'markdown': None, 'caption': 'small'}
+
+SCRIPTS = ['https://cdn.jsdelivr.net/npm/vega@5', 'https://cdn.jsdelivr.net/npm/vega-lite@5',
+           'https://cdn.jsdelivr.net/npm/vega-embed@6', 'https://cdn.jsdelivr.net/npm/marked@4/marked.min.js']
+
+TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+%(scripts)s
+<style>
+body { font-family: sans-serif; margin: 0; display: flex; }
+nav { width: 16em; padding: 1em; background: #f0f2f6; min-height: 100vh; }
+nav a { display: block; margin: 0.4em 0; color: #31333f; }
+main { padding: 1em 3em; max-width: 60em; }
+select { margin: 0.5em 0 1em; }
+</style>
+</head>
+<body>
+<nav>%(nav)s</nav>
+<main>
+%(body)s
+</main>
+<script>
+document.querySelectorAll('.markdown').forEach(function (div) {
+  div.innerHTML = marked.parse(div.dataset.source);
+});
+document.querySelectorAll('.chart').forEach(function (chart) {
+  var select = chart.querySelector('select'), view = chart.querySelector('.view');
+  function draw(spec) { vegaEmbed(view, spec, {actions: false}); }
+  draw(chart.dataset.spec);
+  if (select) select.addEventListener('change', function () { draw(select.value); });
+});
+</script>
+</body>
+</html>
+"""
+
+
+def page_slug(page):
+    # 'pages/3_Trends_in_Average_Time_Spent.py' -> 'trends-in-average-time-spent', main.py -> 'index'
+    if page == 'main.py':
+        return 'index'
+    name = re.sub(r'^\d*_?', '', os.path.basename(page)[:-3])
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+def page_title(page):
+    return 'Home' if page == 'main.py' else re.sub(r'^\d*_?', '', os.path.basename(page)[:-3]).replace('_', ' ')
+
+
+def _elements(node):
+    # the page's elements in order, tab contents after the tab label
+    for child in getattr(node, 'children', {}).values():
+        if getattr(child, 'type', None) == 'tab':
+            yield child
+        if hasattr(child, 'children'):
+            yield from _elements(child)
+        else:
+            yield child
+
+
+def narrative(page):
+    # ('text', tag, body) and ('chart',) in the order the page draws them
+    at = AppTest.from_file(os.path.join(ROOT, page), default_timeout=600).run()
+    if at.exception:
+        raise RuntimeError('%s failed: %s' % (page, at.exception[0].message))
+    out = []
+    for element in _elements(at.main):
+        kind = getattr(element, 'type', None)
+        if kind in TEXT:
+            out.append(('text', TEXT[kind], element.value))
+        elif kind == 'tab':
+            out.append(('text', 'h4', element.label))
+        elif kind in ('vega_lite_chart', 'arrow_vega_lite_chart'):
+            out.append(('chart',))
+    return out
+
+
+def dataset_json(data_bytes):
+    # arrow ipc bytes (what atus.charts puts in a spec) -> json records vega can load by url
+    frame = pa.ipc.open_stream(data_bytes).read_all().to_pandas()
+    return frame.to_json(orient='records', date_format='iso')
+
+
+def _by_url(spec, names):
+    # {'name': X} data references -> {'url': 'data/X.json'}
+    if isinstance(spec, dict):
+        if set(spec) == {'name'} and spec['name'] in names:
+            return {'url': 'data/%s.json' % spec['name']}
+        return {key: _by_url(value, names) for key, value in spec.items()}
+    if isinstance(spec, list):
+        return [_by_url(value, names) for value in spec]
+    return spec
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def export_charts(page, out):
+    # every chart of the page for every selection: [(label, [(option, spec path)])] per chart, in the
+    # order the page draws them
+    ns = page_definitions(os.path.basename(page), '__main__')
+    slots = {}
+    for plotter, label, option, frames, params in CHARTS[os.path.basename(page)](ns, True):
+        text, datasets = compile_chart(ns[plotter](*frames, **params))
+        for name, data_bytes in datasets.items():
+            path = os.path.join(out, 'data', name + '.json')
+            if not os.path.exists(path):
+                _write(path, dataset_json(data_bytes))
+        options = slots.setdefault(plotter, (label, []))[1]
+        spec_path = 'specs/%s/%s-%d.json' % (page_slug(page), plotter, len(options))
+        _write(os.path.join(out, spec_path), json.dumps(_by_url(json.loads(text), set(datasets))))
+        options.append((option, spec_path))
+    return list(slots.values())
+
+
+def _chart_html(label, options):
+    if len(options) == 1 or label is None:
+        return '<div class="chart" data-spec="%s"><div class="view"></div></div>' % html.escape(options[0][1])
+    select = ''.join('<option value="%s">%s</option>' % (html.escape(path), html.escape(str(option)))
+                     for option, path in options)
+    return ('<div class="chart" data-spec="%s"><label>%s <select>%s</select></label><div class="view"></div></div>'
+            % (html.escape(options[0][1]), html.escape(label), select))
+
+
+def page_html(page, parts, charts):
+    body = []
+    for part in parts:
+        if part[0] == 'chart':
+            # charts past the ones atus.warmup knows (the sex / age slice that needs the ingest state)
+            # only exist live
+            if charts:
+                body.append(_chart_html(*charts.pop(0)))
+        elif part[1] is None:
+            body.append('<div class="markdown" data-source="%s"></div>' % html.escape(part[2]))
+        else:
+            body.append('<%s>%s</%s>' % (part[1], html.escape(part[2]), part[1]))
+    nav = ''.join('<a href="%s.html">%s</a>' % (page_slug(p), html.escape(page_title(p))) for p in PAGES)
+    scripts = '\n'.join('<script src="%s"></script>' % src for src in SCRIPTS)
+    return TEMPLATE % {'title': html.escape(page_title(page)), 'scripts': scripts, 'nav': nav,
+                       'body': '\n'.join(body)}
+
+
+def export(out=SITE_DIR, pages=PAGES):
+    # the whole site under out, plus manifest.json: page -> html file and chart specs. the site is
+    # built next to out and swapped in at the end. an existing out is only ever replaced when it
+    # holds a manifest.json, i.e. an earlier export, never some other directory
+    out = os.path.abspath(out)
+    if os.path.exists(out) and not os.path.isfile(os.path.join(out, 'manifest.json')):
+        raise FileExistsError('%s exists and is not an earlier export (no manifest.json), not replacing it' % out)
+    build = '%s.%d.tmp' % (out, os.getpid())
+    if os.path.exists(build):
+        shutil.rmtree(build)
+    manifest = {}
+    for page in pages:
+        charts = export_charts(page, build) if os.path.basename(page) in CHARTS else []
+        manifest[page] = {'html': page_slug(page) + '.html',
+                          'charts': [{'select': label, 'options': [{'option': option, 'spec': path}
+                                                                   for option, path in options]}
+                                     for label, options in charts]}
+        _write(os.path.join(build, page_slug(page) + '.html'), page_html(page, narrative(page), charts))
+    _write(os.path.join(build, 'manifest.json'), json.dumps(manifest, indent=2))
+
+    if os.path.exists(out):
+        old = '%s.%d.old' % (out, os.getpid())
+        os.replace(out, old)
+        os.replace(build, out)
+        shutil.rmtree(old)
+    else:
+        os.replace(build, out)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the app out as a static site.')
+    parser.add_argument('--out', default=SITE_DIR)
+    parser.add_argument('--pages', nargs='+', choices=PAGES, default=PAGES)
+    args = parser.parse_args()
+
+    try:
+        manifest = export(args.out, args.pages)
+    except FileExistsError as e:
+        parser.error(str(e))
+    specs = sum(len(chart['options']) for page in manifest.values() for chart in page['charts'])
+    data = len(os.listdir(os.path.join(args.out, 'data'))) if os.path.isdir(os.path.join(args.out, 'data')) else 0
+    print('wrote %d pages, %d specs and %d data shards to %s' % (len(manifest), specs, data, args.out))
@@ -0,0 +1,111 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from atus.ingest import write_table
+from atus.shared import frame
+
+
+# OxCGRT stringency (data/covid_data.csv) indexed by (state, day) in one sorted key array, so any
+# number of time-use rows (daily tables, respondents) get their state's stringency by as-of lookup:
+# one searchsorted over the keys, never a rows x days cross product. the national series is
+# stored as state 0 (the 'USA' rows)
+
+NATIONAL = 0
+# key = state * KEY_SPAN + days since 1970, KEY_SPAN leaves room for dates through the 2240s
+KEY_SPAN = 1 << 17
+
+
+def _days(dates):
+    return np.asarray(pd.to_datetime(dates), dtype='datetime64[D]').astype('int64')
+
+
+def state_codes(statefip):
+    # STATEFIP as int, with covid_data's 'USA' rows as NATIONAL
+    codes = pd.Series(np.asarray(statefip, dtype=object)).astype(str).replace('USA', str(NATIONAL))
+    return codes.astype('int64').to_numpy()
+
+
+class Stringency:
+    __slots__ = ('keys', 'values')
+
+    def __init__(self, keys, values):
+        # keys already sorted
+        self.keys = keys
+        self.values = values
+
+    @classmethod
+    def from_arrays(cls, states, dates, values):
+        keys = np.asarray(states, dtype='int64') * KEY_SPAN + _days(dates)
+        order = np.argsort(keys, kind='stable')
+        return cls(keys[order], np.asarray(values, dtype='float64')[order])
+
+    @classmethod
+    def from_frame(cls, df, value='StringencyIndex'):
+        return cls.from_arrays(state_codes(df['STATEFIP']), df['Date'], df[value])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _query(self, states, dates, lag=0):
+        # sorted-key position of the last observation at or before date - lag in the same state
+        states = np.broadcast_to(np.asarray(states, dtype='int64'), (len(dates),))
+        days = _days(dates) - lag
+        position = np.searchsorted(self.keys, states * KEY_SPAN + days, side='right') - 1
+        found = position >= 0
+        position = np.maximum(position, 0)
+        found &= self.keys[position] // KEY_SPAN == states
+        return position, found, days - self.keys[position] % KEY_SPAN
+
+    def lookup(self, states, dates, lag=0, tolerance=None):
+        # stringency in force lag days before each date: the latest observation at or before then,
+        # nan when the state has none yet (or the latest is more than tolerance days old)
+        position, found, age = self._query(states, dates, lag)
+        if tolerance is not None:
+            found &= age <= tolerance
+        return np.where(found, self.values[position], np.nan)
+
+    def rolling(self, days):
+        # trailing mean over the last `days` calendar days of each state's observations, via
+        # cumulative sums. the key gap between states is far wider than any window, so one
+        # searchsorted finds every window start without crossing into the previous state
+        start = np.searchsorted(self.keys, self.keys - days + 1, side='left')
+        total = np.concatenate([[0.0], np.cumsum(self.values)])
+        end = np.arange(1, len(self.keys) + 1)
+        return Stringency(self.keys, (total[end] - total[start]) / (end - start))
+
+
+def load(value='StringencyIndex'):
+    return Stringency.from_frame(frame('covid_data'), value)
+
+
+def attach(df, stringency=None, state='STATEFIP', date='DATE', lags=(), windows=(), tolerance=None):
+    # df with StringencyIndex (same-day, as of), StringencyIndex_lagN (N days earlier) and
+    # StringencyIndex_meanN (trailing N-day mean) columns. rows without a state column (the
+    # national daily tables) get the national series
+    stringency = load() if stringency is None else stringency
+    states = state_codes(df[state]) if state in df else NATIONAL
+    out = df.copy()
+    out['StringencyIndex'] = stringency.lookup(states, df[date], tolerance=tolerance)
+    for lag in lags:
+        out['StringencyIndex_lag%d' % lag] = stringency.lookup(states, df[date], lag, tolerance)
+    for window in windows:
+        out['StringencyIndex_mean%d' % window] = stringency.rolling(window).lookup(states, df[date], tolerance=tolerance)
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Attach stringency to the daily time-use table.')
+    parser.add_argument('--table', default='avg_time_all_years_byday')
+    parser.add_argument('--lags', nargs='*', type=int, default=[])
+    parser.add_argument('--windows', nargs='*', type=int, default=[])
+    parser.add_argument('--out', help='write the joined table to this csv instead of printing it')
+    args = parser.parse_args()
+
+    daily = frame(args.table)
+    joined = attach(daily[daily['DATE'] >= '2020-01-01'], lags=args.lags, windows=args.windows)
+    if args.out:
+        write_table(joined, args.out)
+    else:
+        print(joined.to_string(index=False))
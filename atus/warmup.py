@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from atus.bench import page_definitions
+from atus.charts import spec
+
+
+# cache warm-up, so no visitor hits a cold page after a deploy. the first script run in a process
+# (whichever page it is) starts warming every page, one at a time in a background thread: the
+# page's loaders run through its own st.cache_resource functions (its definitions are loaded as
+# __main__, like streamlit runs it, so the cache keys match) and the charts for its default
+# selections go into the atus.charts spec cache. after that, each page prefetches the pages that
+# follow it in the sidebar, with a chart for every value of their main selectbox, in one background
+# thread. neither builds anything heavy (HEAVY): that's python -m atus.warmup's job before a deploy,
+# along with the on-disk caches (bands, embeddings). before the first visitor even arrives,
+# python -m atus.warmup --url opens every page of a running server once
+
+# threads warming pages from the command line
+WORKERS = 4
+# pages prefetched after each page
+NEXT = 2
+
+
+def _options(keys, every):
+    keys = list(keys)
+    return keys if every else keys[:1]
+
+
+def _similarities(ns, every):
+    yield 'tsne_plotter', None, None, (ns['load_bands']('month', None),), {'method': 'tSNE', 'grain': 'month'}
+    # the neighbours of the first COVID peak month (5 of them) and the distances to 2019, as the page
+    # opens
+    index = ns['load_index']('month')
+    labels = pd.Index(index.labels)
+    date = labels[labels.searchsorted(ns['PUBLISHED_BOUNDARIES'][0][:len(labels[0])])]
+    neighbours = index.nearest(date, 5)
+    neighbours['date_label'] = ns['display_label'](neighbours['date'], 'month').to_numpy()
+    yield 'neighbours_plotter', None, None, (neighbours,), {}
+    distances = index.counterpart_distances().dropna()
+    distances['date_label'] = ns['display_label'](distances['date'], 'month').to_numpy()
+    yield 'counterpart_plotter', None, None, (distances,), {'epsilon': 1.0, 'grain': 'month'}
+
+
+def _monthly(ns, every):
+    # the page opens on the published periods, by month
+    shards = ns['load_shards']('published', 'month')
+    ns['load_differences']('published')
+    for activity in _options(shards, every):
+        yield 'monthly_plotter', 'Select activity:', activity, (shards[activity],), {'grain': 'month'}
+
+
+def _waterfall(ns, every):
+    ns['load_months']()
+    shards = ns['load_shards'](*ns['DEFAULT_MONTHS'])
+    for activity in _options(shards, every):
+        yield 'fall_plotter', 'Select activity:', activity, (shards[activity],), {}
+
+
+def _models(ns, every):
+    models, shards = ns['load_data'](), ns['load_shards']()
+    for activity in _options(shards, every):
+        yield 'plotter', 'Select activity:', activity, (models, shards[activity]), {}
+
+
+def _shifting(ns, every):
+    yield 'plotter', None, None, (ns['load_data'](),), {}
+
+
+def _age_sex(ns, every):
+    data, shards = ns['load_data']('none'), ns['load_shards']('none')
+    domain = (data.DIFF.min(), data.DIFF.max())
+    groups = shards if every else [(data['SEX'].unique()[0], data['AGE_GROUP'].unique()[0])]
+    for group in groups:
+        yield ('bar_plotter', 'Select sex and age group:', ' / '.join(group), (shards.get(group, data.iloc[:0]),),
+               {'domain': domain})
+
+
+def _healthcare(ns, every):
+    shards, starts = ns['load_shards'](), ns['load_starts']()
+    for activity in _options(shards, every):
+        yield 'healthcare_plotter', 'Select activity:', activity, (shards[activity],), {'starts': starts}
+
+
+def _stringency(ns, every):
+    # the page opens on 1-day averages
+    region_shards, activity_shards = ns['load_shards'](1)
+    for region in _options(region_shards, every):
+        yield 'heatmap_plotter', 'Select region:', region, (region_shards[region],), {}
+    # lags only for the first region (the country), like the page opens
+    region = next(iter(region_shards))
+    for activity in _options(ns['load_data'](1)['ACTIVITY'].unique(), every):
+        yield 'lag_plotter', 'Select activity:', activity, (activity_shards[region, activity],), {}
+
+
+# page file -> charts(ns, every): (plotter, selectbox label, option, frames, params) for what the
+# page draws on its default selections, or with every for each value of its main selectbox (label
+# and option are None for charts without one). pages without data aren't here
+CHARTS = {
+    '2_Similarities_Among_Time_Periods.py': _similarities,
+    '3_Trends_in_Average_Time_Spent.py': _monthly,
+    '4_COVID_Impact_on_Activity_Participation.py': _waterfall,
+    '5_The_Numbers_Behind_These_Trends.py': _models,
+    '6_Are_We_Shifting_Back_to_Normal?.py': _shifting,
+    '7_Trends_by_Age_&_Sex.py': _age_sex,
+    '8_Healthcare_Workers.py': _healthcare,
+    '9_Stringency_and_Time_Use.py': _stringency,
+}
+PAGES = list(CHARTS)
+# page file -> loaders that build something big (the demographic cube from the ingest state), only
+# warmed from the command line, never next to a visitor's session
+HEAVY = {'8_Healthcare_Workers.py': ['load_cube']}
+
+
+class _Background(logging.Filter):
+    # the warm-up threads call cached functions outside any session on purpose, so streamlit's
+    # missing ScriptRunContext warning is noise for them
+    def filter(self, record):
+        return not record.threadName.startswith(('atus-warmup', 'atus-prefetch'))
+
+
+logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').addFilter(_Background())
+
+_lock = threading.Lock()
+# 'boot' once every page has been queued for warm-up, and every page queued for prefetch
+_queued = set()
+_prefetcher = ThreadPoolExecutor(1, thread_name_prefix='atus-prefetch')
+# page -> seconds its last warm-up took, or the error that stopped it
+status = {}
+
+
+def warm(page, every=False, heavy=False):
+    # runs the page's loaders and compiles its charts, plus its HEAVY loaders with heavy; seconds taken
+    start = time.perf_counter()
+    ns = page_definitions(page, '__main__')
+    for plotter, _, _, frames, params in CHARTS[page](ns, every):
+        spec(ns[plotter], *frames, **params)
+    for loader in HEAVY.get(page, []) if heavy else []:
+        try:
+            ns[loader]()
+        except FileNotFoundError:
+            pass
+    return time.perf_counter() - start
+
+
+def _warm_quietly(page, every=False, heavy=False):
+    # a page that fails here fails again, with its error on screen, when someone opens it
+    try:
+        status[page] = warm(page, every, heavy)
+    except Exception as e:
+        status[page] = e
+    return status[page]
+
+
+def warm_all(pages=PAGES, every=False, workers=WORKERS, heavy=False):
+    with ThreadPoolExecutor(workers, thread_name_prefix='atus-warmup') as pool:
+        return dict(zip(pages, pool.map(functools.partial(_warm_quietly, every=every, heavy=heavy), pages)))
+
+
+def start():
+    # warms every page's defaults in the background, once per process, one page at a time so the
+    # first visitor's session isn't competing with a burst of them
+    with _lock:
+        if 'boot' in _queued:
+            return
+        _queued.add('boot')
+    threading.Thread(target=warm_all, kwargs={'workers': 1}, name='atus-warmup', daemon=True).start()
+
+
+def prefetch(path, count=NEXT):
+    # queues the count pages after path (main.py or a page file) in the sidebar for a full warm-up
+    name = path.replace('\\', '/').rsplit('/', 1)[-1]
+    after = PAGES[PAGES.index(name) + 1:] if name in PAGES else PAGES
+    with _lock:
+        pages = [page for page in after[:count] if page not in _queued]
+        _queued.update(pages)
+    for page in pages:
+        _prefetcher.submit(_warm_quietly, page, True)
+
+
+async def _visit(url):
+    # every page of a running app opened once, through a websocket session like a browser tab
+    from atus.loadtest import PAGES as ALL_PAGES, Viewer
+
+    viewer = await Viewer.connect(url)
+    try:
+        return {page: await viewer.open(page) for page in ALL_PAGES}
+    finally:
+        await viewer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Warm the app caches, in this process or in a running server.')
+    parser.add_argument('--url', help='open every page of the app running here once, e.g. ws://localhost:8501')
+    parser.add_argument('--every', action='store_true', help='compile a chart for every selection, not just the defaults')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    if args.url:
+        for page, (seconds, ok) in asyncio.run(_visit(args.url)).items():
+            print('%-50s %7.2fs%s' % (page, seconds, '' if ok else '  error'))
+    else:
+        # builds the on-disk caches (parquet / arrow copies, bands, embeddings...) before a deploy
+        for page, result in warm_all(PAGES, args.every, args.workers, heavy=True).items():
+            print('%-50s %s' % (page, '%7.2fs' % result if isinstance(result, float) else 'failed: %r' % result))
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from atus.data import period_starts
+
+
+# the running totals, bar ends and labels of the altair waterfall gallery example, computed for
+# every activity in one groupby pass instead of as vega transforms in the browser. the chart then
+# only draws these columns
+
+
+def _percent(values, signed=False):
+    return values.map('{:+.2%}'.format if signed else '{:.2%}'.format)
+
+
+def steps(waterfall, start=None, end=None):
+    # waterfall table (label, ACTIVITY, amount, percent_nonzero, ...) cut to the start..end months.
+    # the first month in the window is the baseline bar, every later one steps by its amount
+    months = waterfall['label'].cat.categories
+    lo = 0 if start is None else months.get_loc(start)
+    hi = len(months) - 1 if end is None else months.get_loc(end)
+    codes = waterfall['label'].cat.codes
+    df = waterfall[(codes >= lo) & (codes <= hi)]
+    df = df.assign(label=df['label'].cat.remove_unused_categories())
+    df = df.sort_values(['ACTIVITY', 'label'], kind='stable').reset_index(drop=True)
+
+    first = df['label'].cat.codes == 0
+    amount = df['amount'].where(~first, df['percent_nonzero'])
+    window_sum = amount.groupby(df['ACTIVITY'], observed=True, sort=False).cumsum()
+    prev_sum = window_sum - amount
+    lead = df.groupby('ACTIVITY', observed=True, sort=False)['label'].shift(-1)
+
+    df['amount'] = amount
+    df['window_sum_amount'] = window_sum
+    df['calc_prev_sum'] = prev_sum
+    df['calc_center'] = (window_sum + prev_sum) / 2
+    df['calc_lead'] = lead.astype(object).where(lead.notna(), df['label'].astype(object))
+    df['direction'] = np.where(amount < 0, 'decrease', 'increase')
+    df['text_amount'] = _percent(amount, signed=True)
+
+    # running total above the bar when it went up, below it when it went down
+    df['sum_inc'] = window_sum.where(window_sum > prev_sum)
+    df['sum_dec'] = window_sum.where(window_sum < prev_sum)
+    df['text_sum'] = _percent(window_sum)
+
+    df['period_start'] = df['label'].isin(period_starts(months))
+    return df
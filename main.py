@@ -2,6 +2,12 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 
+from atus import perf, warmup
+
+
+perf.start_page(__file__)
+warmup.start()
+
 
 st.title('Impact of the COVID-19 Pandemic on American Time Use')
 
@@ -17,3 +23,6 @@ st.markdown("The tradition of complaining about how COVID-19 has impacted our li
             "This massive effort has enabled humble graduate students to access 26,879 detailed accounts of daily time use between 2019-2021. "
             "For your viewing pleasure, we have assembled a tour-de-force of interactive visualizations to quantitively analyze exactly how daily life has been altered by COVID-19. "
             "Thanks to our efforts, the next time you are cornered into a conversation with a poorly-informed citizen, simply refer them to our omniscient guide.")
+
+warmup.prefetch(__file__)
+perf.end_page()
@@ -1,5 +1,11 @@
 import streamlit as st
 
+from atus import perf, warmup
+
+
+perf.start_page(__file__)
+warmup.start()
+
 
 st.title("Let's talk data")
 
@@ -29,3 +35,6 @@ Here's a run-down of the activities the ATUS captured:
 - Work: Time spent on any income-earning activity.
 """
             )
+
+warmup.prefetch(__file__)
+perf.end_page()
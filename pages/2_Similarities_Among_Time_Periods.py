@@ -2,27 +2,81 @@ import pandas as pd
 import streamlit as st
 import altair as alt
 
-
-@st.cache_data
-def load_data():
-    # decided we want differences to be 2021-2019, so positive values reflect an increase in that activity in 2021
-    tsne = pd.read_csv('data/tsne.csv')
-    tsne['time_period'] = pd.Categorical(tsne.time_period, categories=[
-                                         'Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak'], ordered=True)
-
-    return tsne
-
-
-def tsne_plotter(tsne):
-    # based on avg_time_2019_2021_bymonth.csv, the activities with significantly different means in 2019 and 2021 are:
-    # Eating and Drinking, Civic Duties, Household Activities, Personal Care, Phone Calls, Consumer Purchasing, Religious/Spiritual Activities,
-    # Socializing and Leisure, Traveling, Volunteering
-
-    base = alt.Chart(tsne).encode(
-        x=alt.X('tsne1:Q', sort={'field': 'date'}, axis=alt.Axis(title='tSNE Dimension 1'),
-                scale=alt.Scale(domain=[(tsne.tsne1.min() - 4), (tsne.tsne1.max() + 6)])),
-        y=alt.Y('tsne2:Q', sort={'field': 'date'}, axis=alt.Axis(title='tSNE Dimension 2'),
-                scale=alt.Scale(domain=[(tsne.tsne2.min() - 2), (tsne.tsne2.max() + 2)])),
+from atus import perf, warmup
+from atus.bootstrap import attach, monthly_bands
+from atus.charts import spec, with_data
+from atus.data import PUBLISHED_BOUNDARIES
+from atus.embedding import embedding_frame
+from atus.shared import frame
+from atus.similarity import BASELINE_YEAR, build as build_index
+
+
+perf.start_page(__file__)
+warmup.start()
+
+
+# based on avg_time_2019_2021_bymonth.csv, the activities with significantly different means in 2019 and 2021
+SIGNIFICANT = ['Eating and Drinking', 'Civic Duties', 'Household Activities', 'Personal Care', 'Phone Calls',
+               'Consumer Purchasing', 'Religious/Spiritual Activities', 'Socializing and Leisure', 'Traveling',
+               'Volunteering']
+
+# radio label -> atus.embedding grain
+POINTS = {'Months': 'month', 'Days': 'day'}
+# radio label -> (atus.embedding method, or None for the coordinates we published; axis title)
+METHODS = {'t-SNE (published)': (None, 'tSNE'), 't-SNE': ('tsne', 'tSNE'), 'MDS': ('mds', 'MDS')}
+# axis title -> what the text calls it
+METHOD_NAMES = {'tSNE': 'T-distributed stochastic neighbor embedding (tSNE)', 'MDS': 'Multidimensional scaling (MDS)'}
+
+
+@perf.cache_resource
+def load_data(grain='month', method=None):
+    if method is None:
+        # decided we want differences to be 2021-2019, so positive values reflect an increase in that activity in 2021
+        # time_period comes back as an ordered categorical from the parquet cache
+        tsne = frame('tsne')
+        return tsne.rename(columns={'tsne1': 'dim1', 'tsne2': 'dim2'})
+    # worked out here (and cached on disk) from the monthly or daily averages, see atus.embedding
+    return embedding_frame(grain, method)
+
+
+@perf.cache_resource
+def load_bands(grain='month', method=None):
+    # the embedding frame plus 'X lower' / 'X upper' columns with each month's 95% bootstrap band
+    # for every activity X in the bar chart. days have no bands
+    tsne = load_data(grain, method)
+    if grain != 'month':
+        return tsne
+    long = tsne.melt(id_vars=['date'], value_vars=SIGNIFICANT, var_name='ACTIVITY', value_name='mean')
+    with perf.span('to_datetime'):
+        dates = pd.to_datetime(long['date'].astype(str))
+    with perf.span('bands'):
+        long = attach(long.assign(YEAR=dates.dt.year, MONTH=dates.dt.month), monthly_bands())
+        wide = long.pivot(index='date', columns='ACTIVITY', values=['lower', 'upper'])
+        wide.columns = ['%s %s' % (activity, bound) for bound, activity in wide.columns]
+    return tsne.join(wide, on='date')
+
+
+@perf.cache_resource
+def load_index(grain='month'):
+    # pairwise distances between every month (or day) and their neighbour rankings, once per process
+    return build_index(grain)
+
+
+def period_ranges(boundaries):
+    # 'January 2019 to February 2020' style spans of the three periods
+    starts = [pd.Timestamp('2019-01-01')] + [pd.Timestamp(b) for b in boundaries]
+    ends = [s - pd.offsets.MonthBegin(1) for s in starts[1:]] + [pd.Timestamp('2021-12-01')]
+    return tuple('%s to %s' % (s.strftime('%B %Y'), e.strftime('%B %Y')) for s, e in zip(starts, ends))
+
+
+def tsne_plotter(tsne, method='tSNE', grain='month'):
+    # the bar chart shows the SIGNIFICANT activities
+
+    base = alt.Chart().encode(
+        x=alt.X('dim1:Q', sort={'field': 'date'}, axis=alt.Axis(title=method + ' Dimension 1'),
+                scale=alt.Scale(domain=[(tsne.dim1.min() - 4), (tsne.dim1.max() + 6)])),
+        y=alt.Y('dim2:Q', sort={'field': 'date'}, axis=alt.Axis(title=method + ' Dimension 2'),
+                scale=alt.Scale(domain=[(tsne.dim2.min() - 2), (tsne.dim2.max() + 2)])),
         color=alt.Color('time_period:N', legend=alt.Legend(title=None), sort=['Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak'],
                         scale=alt.Scale(domain=['Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak'],
                                         range=['#fa8775', '#4b6be5', '#67009b'])),
@@ -32,7 +86,7 @@ def tsne_plotter(tsne):
     points = base.mark_circle()
     line = base.mark_line().encode(opacity=alt.value(.3))
     text = base.mark_text(dy=-10).encode(
-        text='date_label'
+        text='date_label:N'
     )
 
     # I want a barchart of the 10 significantly different activities to pop up when each point on this scatterplot is clicked
@@ -40,13 +94,9 @@ def tsne_plotter(tsne):
     # allowing for user to select one month
     selectMonth = alt.selection_single(on='mouseover', nearest=True)
 
-    month_barchart = base.transform_fold(['Eating and Drinking', 'Civic Duties', 'Household Activities', 'Personal Care',
-                                          'Phone Calls', 'Consumer Purchasing', 'Religious/Spiritual Activities',
-                                          'Socializing and Leisure', 'Traveling', 'Volunteering'], as_=['ACTIVITY', 'value']
+    month_barchart = base.transform_fold(SIGNIFICANT, as_=['ACTIVITY', 'value']
                                          ).mark_bar().transform_filter(
-        alt.FieldOneOfPredicate("ACTIVITY", oneOf=['Eating and Drinking', 'Civic Duties', 'Household Activities', 'Personal Care',
-                                                   'Phone Calls', 'Consumer Purchasing', 'Religious/Spiritual Activities',
-                                                   'Socializing and Leisure', 'Traveling', 'Volunteering'])
+        alt.FieldOneOfPredicate("ACTIVITY", oneOf=SIGNIFICANT)
     ).transform_window(sort=[alt.SortField("value", order="descending")], val_rank="rank(*)"
                        ).encode(
         x=alt.X('value:Q', axis=alt.Axis(
@@ -55,27 +105,119 @@ def tsne_plotter(tsne):
             field="val_rank", order="ascending"), axis=alt.Axis(title=None))
     ).transform_filter(selectMonth)
 
-    tsneplot = (points + line + text).add_selection(selectMonth).properties(
-        title='Trends in Time Usage by Month via tSNE Dimension Reduction') | month_barchart.properties(title='Average Minutes Spent on Each Activity')
+    # 95% band on each bar, picked out of the folded row's 'X lower' / 'X upper' columns
+    if SIGNIFICANT[0] + ' lower' in tsne:
+        def bound(suffix):
+            return ' : '.join("datum.ACTIVITY == '%s' ? datum['%s %s']" % (a, a, suffix) for a in SIGNIFICANT) + ' : null'
+
+        month_errors = month_barchart.transform_calculate(lower=bound('lower'), upper=bound('upper')).mark_rule(
+            color='black', opacity=0.6).encode(x='lower:Q', x2='upper:Q')
+        month_barchart = month_barchart + month_errors
+
+    # a thousand days are too many to label or join up
+    scatter = points + line + text if grain == 'month' else points.mark_circle(size=20)
+    tsneplot = scatter.add_selection(selectMonth).properties(
+        title='Trends in Time Usage by %s via %s Dimension Reduction' % (grain.capitalize(), method)) | month_barchart.properties(title='Average Minutes Spent on Each Activity')
+
+    # the scatter and the bar chart read one tsne dataset, so the mouseover selection lines up rows
+    return with_data(tsneplot, tsne)
+
+
+def display_label(labels, grain='month'):
+    dates = pd.to_datetime(pd.Series(labels))
+    return dates.dt.strftime('%b %Y' if grain == 'month' else '%b %d %Y')
+
+
+def neighbours_plotter(neighbours):
+    bars = alt.Chart().mark_bar(color='#4b6be5').encode(
+        x=alt.X('distance:Q', title='Distance (Standard Deviations per Activity)'),
+        y=alt.Y('date_label:N', sort=alt.EncodingSortField(field='rank', order='ascending'), title=None),
+        tooltip=[alt.Tooltip('date_label:N', title='Date'), alt.Tooltip('distance:Q', format='.2f', title='Distance')]
+    ).properties(title='Most Similar Activity Profiles')
 
-    return tsneplot
+    return with_data(bars, neighbours)
 
 
-tsne_data = load_data()
-tsneplot = tsne_plotter(tsne_data)
+def counterpart_plotter(distances, epsilon=1.0, grain='month'):
+    time_unit = 'yearmonth' if grain == 'month' else 'yearmonthdate'
+    line = alt.Chart().mark_line(color='#67009b', point=grain == 'month').encode(
+        x=alt.X('date:T', timeUnit=time_unit, title=None),
+        y=alt.Y('distance:Q', title='Distance from %d' % BASELINE_YEAR),
+        tooltip=[alt.Tooltip('date_label:N', title='Date'), alt.Tooltip('distance:Q', format='.2f', title='Distance')]
+    ).properties(title='Distance from the Same %s in %d' % ('Month' if grain == 'month' else 'Weekday', BASELINE_YEAR))
+
+    # anything under the dashed line counts as back to normal
+    threshold = alt.Chart().mark_rule(strokeDash=[4, 4], color='darkgrey').encode(
+        y=alt.datum(epsilon)
+    )
+
+    return with_data(line + threshold, distances)
+
 
 st.header("Visualizing monthly time use trends with dimensionality reduction")
 
-st.altair_chart(tsneplot, use_container_width=True, theme='streamlit')
+points_col, method_col = st.columns(2)
+points = points_col.radio('Points:', list(POINTS), horizontal=True)
+# only the monthly t-SNE was published
+methods = list(METHODS) if points == 'Months' else list(METHODS)[1:]
+method = method_col.radio('Method:', methods, horizontal=True)
+grain = POINTS[points]
+method, method_title = METHODS[method]
+with st.spinner('Embedding...'):
+    tsne_data = load_bands(grain, method)
+tsneplot = spec(tsne_plotter, tsne_data, method=method_title, grain=grain)
+
+st.vega_lite_chart(tsneplot, width='stretch', theme='streamlit')
 
 st.subheader(
-    " We used tSNE to plot each month in 2019, 2020, and 2021 in a 2-dimensional space. ")
+    " We used %s to plot each %s in 2019, 2020, and 2021 in a 2-dimensional space. " % (method_title, grain))
+
+periods = period_ranges(PUBLISHED_BOUNDARIES)
 st.markdown(
     """
-- T-distributed stochastic neighbor embedding (tSNE) is a fancy way to say we don't think you (or we) could read a 17-dimensional plot. Instead, we took all 17 activities the ATUS records and reduced them to 2-dimensions, which you see here. Months that have similar distributions of activity times are closer together. We connected months by their order in time. 
-- Take note of the colors here - you’ll see them again. We grouped our data into three sections: pre-COVID peak (January 2019 to February 2020), COVID peak (March 2020 to January 2021), and post-COVID peak (February 2021 to December 2021).
+- %s is a fancy way to say we don't think you (or we) could read a 17-dimensional plot. Instead, we took all 17 activities the ATUS records and reduced them to 2-dimensions, which you see here. %s that have similar distributions of activity times are closer together.%s
+- Take note of the colors here - you’ll see them again. We grouped our data into three sections: pre-COVID peak (%s), COVID peak (%s), and post-COVID peak (%s).
 - If you read nothing else on this page: Notice the orange points (months before the COVID peak hit us like a bus) have no overlap with the blue points (the peak COVID months). This means the time we spent on the 17 activity categories weren’t very similar before COVID and during the COVID peak. We see the purple months (the months after we got COVID hospitalizations under control) overlap with both the orange and blue points. So, post-COVID months are somewhere in between pre-COVID months and peak COVID months in terms of similarity of time spent in the 17 activity categories.
 - Hover over points in the plot on the left to see the average number of minutes spent in the 10 categories we found to have significantly different averages in 2019 and 2020 (using a two-sample t-test with non-equal variances at the 𝛂 = 0.05 significance level). The bars will move with each activity. The activity with the highest amount of time spent will always shift to the top. 
     
-"""
+""" % ((METHOD_NAMES[method_title], points, ' We connected months by their order in time.' if grain == 'month' else '')
+       + periods)
 )
+
+st.subheader("Which %s looked most alike?" % points.lower())
+
+index = load_index(grain)
+labels = list(index.labels)
+covid_start = PUBLISHED_BOUNDARIES[0]
+date_col, k_col = st.columns(2)
+date = date_col.selectbox('Compare to:', labels, format_func=lambda label: display_label([label], grain)[0],
+                          index=int(pd.Index(labels).searchsorted(covid_start[:len(labels[0])])))
+k = k_col.slider('How many:', 1, 10, 5)
+neighbours = index.nearest(date, k)
+neighbours['date_label'] = display_label(neighbours['date'], grain).to_numpy()
+st.vega_lite_chart(spec(neighbours_plotter, neighbours), width='stretch', theme='streamlit')
+
+epsilon = st.slider('Close enough to %d (distance):' % BASELINE_YEAR, 0.0, 2.0, 1.0, 0.05)
+distances = index.counterpart_distances().dropna()
+distances['date_label'] = display_label(distances['date'], grain).to_numpy()
+st.vega_lite_chart(spec(counterpart_plotter, distances, epsilon=epsilon, grain=grain),
+                   width='stretch', theme='streamlit')
+
+post_start = PUBLISHED_BOUNDARIES[1][:len(labels[0])]
+back = index.first_return(epsilon, post_start)
+if back is None:
+    st.markdown("No %s after the COVID peak came within %.2f of its %d counterpart."
+                % (points.lower()[:-1], epsilon, BASELINE_YEAR))
+else:
+    st.markdown("The first %s after the COVID peak within %.2f of its %d counterpart was %s."
+                % (points.lower()[:-1], epsilon, BASELINE_YEAR, display_label([back], grain)[0]))
+
+st.markdown(
+    """
+- Every activity is put on the same scale (its standard deviation across all %s) before comparing, so a distance of 1 means two profiles are one standard deviation apart on a typical activity.
+- Days are compared with the same weekday in %d, since weekends look nothing like weekdays. Days with no interviews, like spring 2020, are left out.
+    """ % (points.lower(), BASELINE_YEAR)
+)
+
+warmup.prefetch(__file__)
+perf.end_page()
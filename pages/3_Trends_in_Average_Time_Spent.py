@@ -2,101 +2,199 @@ import pandas as pd
 import streamlit as st
 import altair as alt
 
-# @st.cache_data
-def load_data():
-    monthly_combined = pd.read_csv('data/monthly_combined.csv')
+from atus import perf, warmup
+from atus.bootstrap import attach, monthly_bands, normal_bands
+from atus.changepoints import period_boundaries
+from atus.charts import layer, spec
+from atus.data import PUBLISHED_BOUNDARIES, month_labels, time_periods
+from atus.dimensions import period_labels
+from atus.ingest import ACTIVITY_NAMES
+from atus.moments import resample, rolling
+from atus.shards import split
+from atus.shared import frame
 
-    monthly_combined['DATE'] = pd.to_datetime(
-        monthly_combined[['YEAR', 'MONTH']].assign(DAY=1))
 
-    # adding pre covid, covid peak, and post covid variable to monthly_combined
-    monthly_combined['time_period'] = 'Post-COVID Peak'
-    monthly_combined.loc[monthly_combined['DATE'] <=
-                        '2021-01-01', 'time_period'] = 'COVID Peak'
-    monthly_combined.loc[monthly_combined['DATE'] <=
-                        '2020-02-01', 'time_period'] = 'Pre-COVID Peak'
+perf.start_page(__file__)
+warmup.start()
 
-    monthly_combined['time_period'] = pd.Categorical(monthly_combined.time_period, categories=[
-                                                    'Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak'], ordered=True)
+# radio label -> where the three periods are cut. the text and the models on pages 5 and 6 use the
+# published cut; the one atus.changepoints finds in the daily series is there to compare against
+PERIODS = {'Published': 'published', 'Detected in the daily data': 'detected'}
 
-    monthly_combined['month_label'] = (monthly_combined['DATE'].dt.strftime(
-        '%b') + ' ' + monthly_combined['DATE'].dt.strftime('%Y'))
-    monthly_combined['month_label'] = monthly_combined.month_label.astype(
-        'category')
+# radio label -> what each bar (or point) averages: a calendar month, a week (Sun-Sat) or the 7 days up to
+# each day (atus.moments)
+GRAINS = {'Months': 'month', 'Weeks': 'week', '7-day average': 'rolling'}
 
-    # ordering month_label column
-    my_order = ['Jan 2019', 'Feb 2019', 'Mar 2019', 'Apr 2019', 'May 2019', 'Jun 2019', 'Jul 2019', 'Aug 2019', 'Sep 2019', 'Oct 2019', 'Nov 2019', 'Dec 2019',
-                'Jan 2020', 'Feb 2020', 'Mar 2020', 'May 2020', 'Jun 2020', 'Jul 2020', 'Aug 2020', 'Sep 2020', 'Oct 2020', 'Nov 2020', 'Dec 2020',
-                'Jan 2021', 'Feb 2021', 'Mar 2021', 'Apr 2021', 'May 2021', 'Jun 2021', 'Jul 2021', 'Aug 2021', 'Sep 2021', 'Oct 2021', 'Nov 2021', 'Dec 2021']
+# what the black line (or band) around each mean is
+INTERVALS = {
+    'month': "The black line on each bar is a 95% confidence interval, from resampling the days of that month a week at a time.",
+    'week': "The black line on each bar is a 95% confidence interval around that week's mean, from the spread of its interviews.",
+    'rolling': "The grey band is a 95% confidence interval around each 7-day average, from the spread of its interviews.",
+}
 
-    monthly_combined['month_label'] = pd.Categorical(monthly_combined.month_label, categories=my_order, ordered=True)
 
-    return monthly_combined
+def boundaries(periods='published'):
+    return period_boundaries() if periods == 'detected' else PUBLISHED_BOUNDARIES
 
 
-def monthly_plotter(monthly_combined):
-    activities = list(monthly_combined['ACTIVITY'].unique())
+@perf.cache_resource
+def load_data(periods='published'):
+    with perf.span('read'):
+        monthly_combined = frame('monthly_combined')
+
+    with perf.span('to_datetime'):
+        monthly_combined['DATE'] = pd.to_datetime(
+            monthly_combined[['YEAR', 'MONTH']].assign(DAY=1))
+
+    with perf.span('categories'):
+        # adding pre covid, covid peak, and post covid variable to monthly_combined
+        monthly_combined['time_period'] = time_periods(monthly_combined['DATE'], boundaries(periods))
+
+        # 'Jan 2019' style labels, ordered by date
+        monthly_combined['month_label'] = month_labels(monthly_combined['DATE'])
+
+    with perf.span('bands'):
+        # 95% bootstrap band around every bar (block bootstrap over days, cached on disk by atus.bootstrap)
+        return attach(monthly_combined, monthly_bands())
+
+
+@perf.cache_resource
+def load_series(grain, periods='published'):
+    # weeks and 7-day averages merged exactly from the daily table's moments. the bootstrap only
+    # covers months, so their band is the normal one around each mean
+    with perf.span('read'):
+        daily = frame('avg_time_all_years_byday')
+        daily = daily[daily['ACTIVITY_ID'].between(1, len(ACTIVITY_NAMES)) & daily['mean'].notna()]
+        daily = daily[['DATE', 'ACTIVITY', 'mean', 'sd', 'n']]
+
+    with perf.span(grain):
+        series = resample(daily, 'week') if grain == 'week' else rolling(daily, 7)
+        series['ACTIVITY'] = series['ACTIVITY'].astype(str)
+
+    with perf.span('categories'):
+        series['time_period'] = time_periods(series['DATE'], boundaries(periods))
+
+    return normal_bands(series)
+
 
-    selectActivity = alt.selection_single(
-        fields=['ACTIVITY'],
-        init={'ACTIVITY': activities[0]},
-        bind=alt.binding_select(options=activities, name='Select activity: ')
-    )
+@perf.cache_resource
+def load_shards(periods='published', grain='month'):
+    # one shard per activity, so the chart only embeds the selected activity's rows
+    return split(load_data(periods) if grain == 'month' else load_series(grain, periods), 'ACTIVITY')
 
-    my_order = ['Jan 2019', 'Feb 2019', 'Mar 2019', 'Apr 2019', 'May 2019', 'Jun 2019', 'Jul 2019', 'Aug 2019', 'Sep 2019', 'Oct 2019', 'Nov 2019', 'Dec 2019',
-                'Jan 2020', 'Feb 2020', 'Mar 2020', 'May 2020', 'Jun 2020', 'Jul 2020', 'Aug 2020', 'Sep 2020', 'Oct 2020', 'Nov 2020', 'Dec 2020',
-                'Jan 2021', 'Feb 2021', 'Mar 2021', 'Apr 2021', 'May 2021', 'Jun 2021', 'Jul 2021', 'Aug 2021', 'Sep 2021', 'Oct 2021', 'Nov 2021', 'Dec 2021']
 
-    year2019 = alt.Chart(monthly_combined[monthly_combined.time_period == 'Pre-COVID Peak']).mark_bar().encode(
-        x=alt.X('month_label:N', sort=my_order, axis=alt.Axis(title=None)),
+@perf.cache_resource
+def load_differences(periods='published'):
+    # minutes of socializing and leisure in the COVID peak and post-COVID peak over the pre-COVID
+    # peak, for the text
+    social = load_shards(periods, 'month')['Socializing and Leisure']
+    means = social.groupby('time_period', observed=True)['mean'].mean()
+    return means['COVID Peak'] - means['Pre-COVID Peak'], means['Post-COVID Peak'] - means['Pre-COVID Peak']
+
+
+def monthly_plotter(monthly_combined, grain='month'):
+    activities = list(monthly_combined['ACTIVITY'].unique())
+
+    # a single activity shard was already filtered server-side; the in-chart drop-down is only
+    # needed when every activity is shipped
+    selectActivity = None
+    if len(activities) > 1:
+        selectActivity = alt.selection_single(
+            fields=['ACTIVITY'],
+            init={'ACTIVITY': activities[0]},
+            bind=alt.binding_select(options=activities, name='Select activity: ')
+        )
+
+    def selected(chart):
+        return chart if selectActivity is None else chart.transform_filter(selectActivity)
+
+    if grain == 'month':
+        # 'Jan 2019' style, in calendar order
+        x = alt.X('month_label:N', sort=period_labels(monthly_combined['PERIOD_ID']), axis=alt.Axis(title=None))
+    else:
+        x = alt.X('DATE:T', axis=alt.Axis(title=None, format='%b %Y'))
+
+    # a bar per month or week; a line through the daily 7-day averages, with its band as an area
+    def mark(chart):
+        return chart.mark_line() if grain == 'rolling' else chart.mark_bar()
+
+    year2019 = selected(mark(alt.Chart().transform_filter(alt.datum.time_period == 'Pre-COVID Peak')).encode(
+        x=x,
         y=alt.Y('mean:Q', axis=alt.Axis(title="Average Minutes Spent")),
         color=alt.Color('time_period:N', sort=['Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak'], title=None,
                         scale=alt.Scale(domain=['Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak'],
                                         range=['#f58a42', '#4b6be5', '#7f3eb0'])),
         tooltip=alt.Tooltip(['mean:Q'], format='.2f',
                             title='Average Number of Minutes')
-    ).transform_filter(selectActivity).properties(width=800, height=100)
+    ).properties(width=800, height=100))
 
-    year2020 = alt.Chart(monthly_combined[monthly_combined.time_period == 'COVID Peak']).mark_bar().encode(
-        x=alt.X('month_label:N', sort=my_order, axis=alt.Axis(title=None)),
+    year2020 = selected(mark(alt.Chart().transform_filter(alt.datum.time_period == 'COVID Peak')).encode(
+        x=x,
         y=alt.Y('mean:Q', axis=alt.Axis(title="Average Minutes Spent")),
         color=alt.Color('time_period:N', sort=['Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak'], title=None,
                         scale=alt.Scale(domain=['Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak'],
                                         range=['#f58a42', '#4b6be5', '#7f3eb0'])),
         tooltip=alt.Tooltip(['mean:Q'], format='.2f',
                             title='Average Number of Minutes')
-    ).transform_filter(selectActivity).properties(width=800, height=100)
+    ).properties(width=800, height=100))
 
-    year2021 = alt.Chart(monthly_combined[monthly_combined.time_period == 'Post-COVID Peak']).mark_bar().encode(
-        x=alt.X('month_label:N', sort=my_order, axis=alt.Axis(title=None)),
+    year2021 = selected(mark(alt.Chart().transform_filter(alt.datum.time_period == 'Post-COVID Peak')).encode(
+        x=x,
         y=alt.Y('mean:Q', axis=alt.Axis(title="Average Minutes Spent")),
         color=alt.Color('time_period:N', sort=['Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak'], title=None,
                         scale=alt.Scale(domain=['Pre-COVID Peak', 'COVID Peak', 'Post-COVID Peak'],
                                         range=['#f58a42', '#4b6be5', '#7f3eb0'])),
         tooltip=alt.Tooltip(['mean:Q'], format='.2f',
                             title='Average Number of Minutes')
-    ).transform_filter(selectActivity).properties(width=800, height=100)
-
-
-    monthly_plot = (year2019+year2020+year2021).add_selection(selectActivity).resolve_scale(x='shared',
-                                                                                y='shared').configure_legend(labelFontSize=14)
+    ).properties(width=800, height=100))
+
+    band = alt.Chart().mark_area(color='black', opacity=0.15) if grain == 'rolling' else \
+        alt.Chart().mark_rule(color='black', opacity=0.5)
+    errors = selected(band.encode(
+        x=x,
+        y='lower:Q',
+        y2='upper:Q',
+        tooltip=[alt.Tooltip('lower:Q', format='.2f', title='95% Interval From'),
+                 alt.Tooltip('upper:Q', format='.2f', title='95% Interval To')]
+    ).properties(width=800, height=100))
+
+    # the three periods read the one monthly_combined dataset
+    monthly_plot = layer(monthly_combined, year2019, year2020, year2021, errors)
+    if selectActivity is not None:
+        monthly_plot = monthly_plot.add_selection(selectActivity)
+    monthly_plot = monthly_plot.resolve_scale(x='shared', y='shared').configure_legend(labelFontSize=14)
 
     # maybe add horizontal lines for mean of each time period?
 
     return monthly_plot
 
-monthly_data = load_data()
-
-montly_plot = monthly_plotter(monthly_data)
 
 st.header("Monthly Average Time Use Trends")
 
-st.altair_chart(montly_plot, use_container_width=True, theme='streamlit')
+activity_col, grain_col, periods_col = st.columns(3)
+grain = GRAINS[grain_col.radio('Show:', list(GRAINS), horizontal=True)]
+periods = PERIODS[periods_col.radio('Periods:', list(PERIODS), horizontal=True)]
+monthly_shards = load_shards(periods, grain)
+activity = activity_col.selectbox('Select activity:', list(monthly_shards))
+montly_plot = spec(monthly_plotter, monthly_shards[activity], grain=grain)
+
+st.vega_lite_chart(montly_plot, width='stretch', theme='streamlit')
+
+if periods == 'detected':
+    covid_peak, post_covid_peak, published = (pd.Timestamp(b).strftime('%B %Y') for b in
+                                              boundaries(periods) + PUBLISHED_BOUNDARIES[1:])
+    st.caption("The daily series shifts in %s and again in %s, so here the post-COVID peak starts in %s instead "
+               "of %s. The models on the next pages were fitted on the published split."
+               % (covid_peak, post_covid_peak, post_covid_peak, published))
 
+peak, post_peak = load_differences(periods)
 st.markdown(
     """
-    Select whatever activity you want to see using the drop-down menu. Hover over each bar to see exact average values.
+    Select whatever activity you want to see using the drop-down menu. Hover over the chart to see exact average values. %s
     Our two favorite data points: First, the average American didn't let COVID affect the time they spent on personal care and we're here for it.
-    Second, the average time spent on socializing and leisure during COVID peak months was 30 minutes higher than that of pre-COVID peak months. And better yet, this average stayed higher(although only 6 minutes higher) in post-COVID peak months. Did COVID teach us to prioritize hanging out with other people and taking time to relax?
-    """
+    Second, the average time spent on socializing and leisure during COVID peak months was %.0f minutes higher than that of pre-COVID peak months. And better yet, this average stayed higher(although only %.0f minutes higher) in post-COVID peak months. Did COVID teach us to prioritize hanging out with other people and taking time to relax?
+    """ % (INTERVALS[grain], peak, post_peak)
 )
+
+warmup.prefetch(__file__)
+perf.end_page()
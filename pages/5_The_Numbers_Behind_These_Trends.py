@@ -2,28 +2,46 @@ import streamlit as st
 import altair as alt
 import pandas as pd
 
-@st.cache_data
+from atus import perf, warmup
+from atus.charts import layer, spec, with_data
+from atus.shards import split
+from atus.shared import frame
+
+
+perf.start_page(__file__)
+warmup.start()
+
+
+@perf.cache_resource
 def load_data():
-    models = pd.read_csv('data/models.csv')
+    models = frame('models')
     return models
 
 
-def plotter(models):
+@perf.cache_resource
+def load_shards():
+    return split(load_data(), 'ACTIVITY')
 
-    # interactive component
-    activities2 = list(models['ACTIVITY'].unique())
 
-    selectActivity2 = alt.selection_single(
-        fields=['ACTIVITY'],
-        init={'ACTIVITY': activities2[0]},
-        bind=alt.binding_select(options=activities2, name='Select activity: ')
-    )
+def plotter(models, activity_models=None):
+    # the bubble chart shows every model; the forest plot either gets one activity's shard from the
+    # page, or all of them plus an in-chart drop-down
+    selectActivity2 = None
+    if activity_models is None:
+        activity_models = models
+        activities2 = list(models['ACTIVITY'].unique())
+
+        selectActivity2 = alt.selection_single(
+            fields=['ACTIVITY'],
+            init={'ACTIVITY': activities2[0]},
+            bind=alt.binding_select(options=activities2, name='Select activity: ')
+        )
 
     colorCondition = alt.condition(
         alt.datum.ESTIMATE > 0, alt.value("#3cb371"), alt.value("#ff6666"))
 
     # point estimates
-    points = alt.Chart(models, title='Generalized Linear Model Results for Selected Activity').mark_point(filled=True, color='black').transform_window(
+    points = alt.Chart(title='Generalized Linear Model Results for Selected Activity').mark_point(filled=True, color='black').transform_window(
         sort=[alt.SortField("ESTIMATE", order="descending")],
         est_rank="rank(*)"
     ).encode(
@@ -35,7 +53,7 @@ def plotter(models):
     )
 
     # error bars
-    error_bars = alt.Chart(models).mark_errorbar().transform_window(
+    error_bars = alt.Chart().mark_errorbar().transform_window(
         sort=[alt.SortField("ESTIMATE", order="descending")],
         est_rank="rank(*)"
     ).encode(
@@ -48,13 +66,14 @@ def plotter(models):
         tooltip=alt.Tooltip(value=None)
     )
 
-    forest_plot = (
-        points + error_bars).add_selection(selectActivity2).transform_filter(selectActivity2)
+    forest_plot = layer(activity_models, points, error_bars)
+    if selectActivity2 is not None:
+        forest_plot = forest_plot.add_selection(selectActivity2).transform_filter(selectActivity2)
     
     opacityCondition = alt.condition(
         alt.datum.SIGNIFICANT == 1, alt.value(.8), alt.value(0))
 
-    bubble_chart = alt.Chart(models, title='Significant Effect Estimates from Generalized Linear Models').mark_circle(
+    bubble_chart = alt.Chart(title='Significant Effect Estimates from Generalized Linear Models').mark_circle(
         opacity=0.8, stroke='black', strokeWidth=.7
     ).encode(y=alt.Y('VARIABLE:N', sort=alt.EncodingSortField(field='VARIABLE:N', order='ascending')),
             x=alt.X('ACTIVITY:N'),
@@ -65,15 +84,18 @@ def plotter(models):
             opacity=opacityCondition
             ).transform_filter(alt.datum.VARIABLE != 'Intercept').transform_filter(alt.datum.ACTIVITY != 'Civic Duties')
 
-    return bubble_chart | forest_plot
+    return with_data(bubble_chart, models) | forest_plot
 
 models = load_data()
-plots = plotter(models)
+model_shards = load_shards()
 
 st.header("Generalized Linear Model")
 st.subheader("Enough with the hearsay. Let’s put some numbers behind these trends.")
 
-st.altair_chart(plots, use_container_width=True, theme=None)
+activity = st.selectbox('Select activity:', list(model_shards))
+plots = spec(plotter, models, model_shards[activity])
+
+st.vega_lite_chart(plots, width='stretch', theme=None)
 
 st.markdown(
     """
@@ -115,4 +137,5 @@ with tab2:
         """
     )
 
-
+warmup.prefetch(__file__)
+perf.end_page()
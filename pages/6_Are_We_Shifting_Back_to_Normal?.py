@@ -2,15 +2,24 @@ import streamlit as st
 import altair as alt
 import pandas as pd
 
-@st.cache_data
+from atus import perf, warmup
+from atus.charts import spec, with_data
+from atus.shared import frame
+
+
+perf.start_page(__file__)
+warmup.start()
+
+
+@perf.cache_resource
 def load_data():
-    models = pd.read_csv('data/models.csv')
+    models = frame('models')
     return models
 
 
 def plotter(models):
 
-    top = alt.Chart(models).transform_calculate(
+    top = alt.Chart().transform_calculate(
         PERCENT_CHANGE_SIGN=alt.datum.PERCENT_CHANGE * alt.datum.SIGN_PERCENT_CHANGE
     ).transform_filter(
         alt.FieldOneOfPredicate(
@@ -28,7 +37,7 @@ def plotter(models):
     ).properties(width=100)
 
 
-    bottom = alt.Chart(models).transform_calculate(
+    bottom = alt.Chart().transform_calculate(
         PERCENT_CHANGE_SIGN=alt.datum.PERCENT_CHANGE * alt.datum.SIGN_PERCENT_CHANGE
     ).transform_filter(
         alt.FieldOneOfPredicate(
@@ -46,15 +55,16 @@ def plotter(models):
         column=alt.Column('ACTIVITY:N', title=None)
     ).properties(width=100)
 
-    return top & bottom
+    # both rows read the one models dataset
+    return with_data(top & bottom, models)
 
 models = load_data()
-plots = plotter(models)
+plots = spec(plotter, models)
 
 st.header("Comparing Pre-COVID time use with COVID and post-COVID time use")
 st.markdown("We wanted to see how the effect sizes of each time period variable looked within each activity model. Remember the effect size of the COVID peak variable represents the average multiplicative effect on time spent between pre-COVID months and COVID peak months ( and likewise for the post-COVID peak variable). We converted these values into percent change values and plotted them below.")
 
-st.altair_chart(plots, use_container_width=True, theme=None)
+st.vega_lite_chart(plots, width='stretch', theme=None)
 
 st.markdown(
     """
@@ -66,3 +76,6 @@ st.markdown(
 
     """
 )
+
+warmup.prefetch(__file__)
+perf.end_page()
@@ -2,48 +2,78 @@ import pandas as pd
 import streamlit as st
 import altair as alt
 
+from atus import perf, warmup
+from atus.charts import layer, spec
+from atus.shards import split
+from atus.shared import frame
+from atus.significance import test_table
 
-@st.cache_data
-def load_data():
+
+perf.start_page(__file__)
+warmup.start()
+
+
+# selectbox label -> atus.significance correction. each (sex, age group) is one family of 17 tests
+CORRECTIONS = {'None': 'none', 'Holm': 'holm', 'Benjamini-Hochberg': 'bh', 'Bonferroni': 'bonferroni'}
+
+
+@perf.cache_resource
+def load_data(correction='none'):
 
     # bar chart of DIFFERENCE in average minutes spent on each activity between 2019 and 2021
 
     # reading in data I cleaned in R - AVERAGES HERE ARE WEIGHTED
-    barchart_data = pd.read_csv(
-        'data/avg_time_2019_2021.csv')
+    barchart_data = frame('avg_time_2019_2021')
 
     # decided we want differences to be 2021-2019, so positive values reflect an increase in that activity in 2021
     barchart_data['DIFF'] = barchart_data['DIFF'] * -1
 
-    return barchart_data
+    # t_test / significant worked out again from the means, sds and ns, so the p-values can be corrected
+    return test_table(barchart_data, 2019, 2021, ['SEX', 'AGE_GROUP'], correction)
+
+
+@perf.cache_resource
+def load_shards(correction='none'):
+    return split(load_data(correction), ['SEX', 'AGE_GROUP'])
+
 
-def bar_plotter(barchart_data):
+def bar_plotter(barchart_data, domain=None):
     ages = list(barchart_data['AGE_GROUP'].unique())
 
     sexes = list(barchart_data['SEX'].unique())
 
-    # interactive components
-    selectSex = alt.selection_single(
-        fields=['SEX'],
-        init={'SEX': sexes[0]},
-        bind=alt.binding_select(options=sexes, name='Select sex: ')
-    )
+    # keep the x axis fixed across groups; a single (sex, age group) shard doesn't know the full range
+    if domain is None:
+        domain = (barchart_data.DIFF.min(), barchart_data.DIFF.max())
 
-    selectAge = alt.selection_single(
-        fields=['AGE_GROUP'],
-        init={'AGE_GROUP': ages[0]},
-        bind=alt.binding_select(options=ages, name='Select age group: ')
-    )
+    barchart = alt.Chart(title="Comparing Average Time Spent in 2021 and 2019")
+
+    # interactive components, only when more than one group was shipped
+    selections = []
+    if len(sexes) > 1 or len(ages) > 1:
+        selectSex = alt.selection_single(
+            fields=['SEX'],
+            init={'SEX': sexes[0]},
+            bind=alt.binding_select(options=sexes, name='Select sex: ')
+        )
+
+        selectAge = alt.selection_single(
+            fields=['AGE_GROUP'],
+            init={'AGE_GROUP': ages[0]},
+            bind=alt.binding_select(options=ages, name='Select age group: ')
+        )
+        selections = [selectAge, selectSex]
+        barchart = barchart.transform_filter(selectAge & selectSex)
 
     # bar chart
-    barchart = alt.Chart(barchart_data, title="Comparing Average Time Spent in 2021 and 2019").transform_filter(selectAge & selectSex).transform_window(
+    barchart = barchart.transform_window(
         sort=[alt.SortField("DIFF", order="descending")],
         diff_rank="rank(*)"
     ).mark_bar().encode(
         alt.Y('ACTIVITY:N', sort=alt.EncodingSortField(
             field="diff_rank", order="ascending"), axis=alt.Axis(title=None)),
         alt.X('DIFF:Q', axis=alt.Axis(title="Average Difference Between 2021 and 2019 in Minutes"),
-            scale=alt.Scale(domain=[(barchart_data.DIFF.min() - 4), (barchart_data.DIFF.max() + 4)])),
+            scale=alt.Scale(domain=[(domain[0] - 4), (domain[1] + 4)])),
         color=alt.condition(
             alt.datum.DIFF > 0,
             alt.value("#3cb371"),  # positive color
@@ -66,18 +96,26 @@ def bar_plotter(barchart_data):
                             alt.value("#ff6666"), alt.value('lightgray'))
     )
 
-    final_barchart = barchart.add_selection(selectAge, selectSex) + text_right + text_left
+    if selections:
+        barchart = barchart.add_selection(*selections)
+    final_barchart = layer(barchart_data, barchart, text_right, text_left)
     return final_barchart
 
 
-data = load_data()
-plot = bar_plotter(data)
-
 st.header("Comparing Pre-COVID & Post-COVID time uses")
 
-st.altair_chart(plot, use_container_width=True, theme='streamlit')
-
-st.markdown("Here, you can view the % change in minutes spend on a variety of activities for different demographic groups. Changes which are not statistitcally significant, ie those which fail a P-test, are shown with gray text.")
+sex_col, age_col, correction_col = st.columns(3)
+correction = CORRECTIONS[correction_col.selectbox('Multiple-comparison correction:', list(CORRECTIONS))]
+data = load_data(correction)
+group_shards = load_shards(correction)
+sex = sex_col.selectbox('Select sex:', list(data['SEX'].unique()))
+age = age_col.selectbox('Select age group:', list(data['AGE_GROUP'].unique()))
+# 'Overall' only pairs with 'Overall'; other mixes draw an empty chart, as the in-chart filter did
+plot = spec(bar_plotter, group_shards.get((sex, age), data.iloc[:0]), domain=(data.DIFF.min(), data.DIFF.max()))
 
+st.vega_lite_chart(plot, width='stretch', theme='streamlit')
 
+st.markdown("Here, you can view the % change in minutes spend on a variety of activities for different demographic groups. Changes which are not statistitcally significant, ie those which fail a P-test, are shown with gray text. With 17 activities per group, pick a correction to control for the number of tests.")
 
+warmup.prefetch(__file__)
+perf.end_page()
@@ -2,71 +2,131 @@ import streamlit as st
 import altair as alt
 import pandas as pd
 
+from atus import perf, warmup
+from atus.bootstrap import attach, occupation_bands
+from atus.charts import layer, spec
+from atus.cube import load_cube
+from atus.data import period_categories, period_starts
+from atus.dimensions import id_of, period_ids, period_labels
+from atus.shards import split
+from atus.shared import frame
 
-@st.cache_data
+
+perf.start_page(__file__)
+warmup.start()
+
+
+@perf.cache_resource
 def load_data():
-    occ = pd.read_csv('data/avg_time_all_years_bymonth_occ.csv')
-    occ['MONTH_YEAR'] = pd.Categorical(occ['MONTH_YEAR'],
-                                       categories=['Jan 2019', 'Feb 2019', 'Mar 2019', 'Apr 2019', 'May 2019', 'Jun 2019', 'Jul 2019', 'Aug 2019', 'Sep 2019', 'Oct 2019', 'Nov 2019', 'Dec 2019',
-                                                   'Jan 2020', 'Feb 2020', 'Mar 2020', 'May 2020', 'Jun 2020', 'Jul 2020', 'Aug 2020', 'Sep 2020', 'Oct 2020', 'Nov 2020', 'Dec 2020',
-                                                   'Jan 2021', 'Feb 2021', 'Mar 2021', 'Apr 2021', 'May 2021', 'Jun 2021', 'Jul 2021', 'Aug 2021', 'Sep 2021', 'Oct 2021', 'Nov 2021', 'Dec 2021'],
-                                       ordered=True)
-    # removing Civic Duties
-    occ = occ[occ.ACTIVITY != 'Civic Duties']
+    with perf.span('read'):
+        # MONTH_YEAR comes back as an ordered categorical from the parquet cache
+        occ = frame('avg_time_all_years_bymonth_occ')
+    with perf.span('filter'):
+        # removing Civic Duties
+        occ = occ[occ.ACTIVITY_ID != id_of('ACTIVITY', 'Civic Duties')]
+
+    with perf.span('bands'):
+        # 95% band around each line, see atus.bootstrap
+        return attach(occ, occupation_bands(), ('YEAR', 'MONTH', 'OCC_GROUP', 'ACTIVITY'))
+
 
-    return occ
+@perf.cache_resource
+def load_starts():
+    # months where the COVID peak and post-COVID peak begin
+    return tuple(period_starts(period_categories(load_data()['MONTH_YEAR'])))
 
 
-def healthcare_plotter(occ):
+@perf.cache_resource
+def load_shards():
+    return split(load_data(), 'ACTIVITY')
+
+
+def healthcare_plotter(occ, starts=()):
     activities3 = list(occ['ACTIVITY'].unique())
-    selectActivity3 = alt.selection_single(
-        fields=['ACTIVITY'],
-        init={'ACTIVITY': activities3[0]},
-        bind=alt.binding_select(options=activities3, name='Select activity: ')
-    )
+    # only needed when the page hands over every activity instead of one shard
+    selectActivity3 = None
+    if len(activities3) > 1:
+        selectActivity3 = alt.selection_single(
+            fields=['ACTIVITY'],
+            init={'ACTIVITY': activities3[0]},
+            bind=alt.binding_select(options=activities3, name='Select activity: ')
+        )
 
-    linechart = alt.Chart(occ).mark_line(point=True).encode(
-        x=alt.X('MONTH_YEAR:O', sort=['Jan 2019', 'Feb 2019', 'Mar 2019', 'Apr 2019', 'May 2019', 'Jun 2019', 'Jul 2019', 'Aug 2019', 'Sep 2019', 'Oct 2019', 'Nov 2019', 'Dec 2019',
-                                      'Jan 2020', 'Feb 2020', 'Mar 2020', 'May 2020', 'Jun 2020', 'Jul 2020', 'Aug 2020', 'Sep 2020', 'Oct 2020', 'Nov 2020', 'Dec 2020',
-                                      'Jan 2021', 'Feb 2021', 'Mar 2021', 'Apr 2021', 'May 2021', 'Jun 2021', 'Jul 2021', 'Aug 2021', 'Sep 2021', 'Oct 2021', 'Nov 2021', 'Dec 2021'],
+    month_order = period_labels(occ['PERIOD_ID'])
+
+    linechart = alt.Chart().mark_line(point=True).encode(
+        x=alt.X('MONTH_YEAR:O', sort=month_order,
                 title=None),
         y=alt.Y('mean:Q', title='Average Number of Minutes Spent'),
         color=alt.Color('OCC_GROUP:N', title='Occupation Group', scale=alt.Scale(domain=[
                         'Healthcare Worker', 'Non-Healthcare Worker'], range=['#ed68ce', '#e8bc56'])),
         tooltip=alt.Tooltip(['mean:Q'], format='.2f',
                             title='Average Number of Minutes')
-    ).add_selection(selectActivity3).transform_filter(selectActivity3)
-
-    # we need a line between Feb 2020 and March 2020
-    covid_begins2 = alt.Chart(occ).mark_rule(xOffset=0, strokeWidth=2.5, strokeDash=[1, 1]).encode(
-        x=alt.X('MONTH_YEAR:O', sort=['Jan 2019', 'Feb 2019', 'Mar 2019', 'Apr 2019', 'May 2019', 'Jun 2019', 'Jul 2019', 'Aug 2019', 'Sep 2019', 'Oct 2019', 'Nov 2019', 'Dec 2019',
-                                      'Jan 2020', 'Feb 2020', 'Mar 2020', 'May 2020', 'Jun 2020', 'Jul 2020', 'Aug 2020', 'Sep 2020', 'Oct 2020', 'Nov 2020', 'Dec 2020',
-                                      'Jan 2021', 'Feb 2021', 'Mar 2021', 'Apr 2021', 'May 2021', 'Jun 2021', 'Jul 2021', 'Aug 2021', 'Sep 2021', 'Oct 2021', 'Nov 2021', 'Dec 2021']),
-        color=alt.value("darkgrey"),
-        opacity=alt.condition(alt.datum.MONTH_YEAR ==
-                              'Mar 2020', alt.value(1), alt.value(0))
     )
+    if selectActivity3 is not None:
+        linechart = linechart.add_selection(selectActivity3).transform_filter(selectActivity3)
+
+    lines = [linechart]
+    if 'lower' in occ:
+        band = alt.Chart().mark_area(opacity=0.2).encode(
+            x=alt.X('MONTH_YEAR:O', sort=month_order, title=None),
+            y='lower:Q',
+            y2='upper:Q',
+            color=alt.Color('OCC_GROUP:N', title='Occupation Group', scale=alt.Scale(domain=[
+                            'Healthcare Worker', 'Non-Healthcare Worker'], range=['#ed68ce', '#e8bc56']))
+        )
+        if selectActivity3 is not None:
+            band = band.transform_filter(selectActivity3)
+        lines.insert(0, band)
 
-    covid_ends2 = alt.Chart(occ).mark_rule(xOffset=0, strokeWidth=2.5, strokeDash=[1, 1]).encode(
-        x=alt.X('MONTH_YEAR:O', sort=['Jan 2019', 'Feb 2019', 'Mar 2019', 'Apr 2019', 'May 2019', 'Jun 2019', 'Jul 2019', 'Aug 2019', 'Sep 2019', 'Oct 2019', 'Nov 2019', 'Dec 2019',
-                                      'Jan 2020', 'Feb 2020', 'Mar 2020', 'May 2020', 'Jun 2020', 'Jul 2020', 'Aug 2020', 'Sep 2020', 'Oct 2020', 'Nov 2020', 'Dec 2020',
-                                      'Jan 2021', 'Feb 2021', 'Mar 2021', 'Apr 2021', 'May 2021', 'Jun 2021', 'Jul 2021', 'Aug 2021', 'Sep 2021', 'Oct 2021', 'Nov 2021', 'Dec 2021']),
+    # dotted line where each time period starts (atus.data.PUBLISHED_BOUNDARIES)
+    period_rules = alt.Chart().mark_rule(xOffset=0, strokeWidth=2.5, strokeDash=[1, 1]).encode(
+        x=alt.X('MONTH_YEAR:O', sort=month_order),
         color=alt.value("darkgrey"),
-        opacity=alt.condition(alt.datum.MONTH_YEAR ==
-                              'Feb 2021', alt.value(1), alt.value(0))
+        opacity=alt.condition(alt.FieldOneOfPredicate('MONTH_YEAR', oneOf=list(starts)), alt.value(1), alt.value(0))
     )
 
-    health_plot = alt.layer(linechart, covid_begins2, covid_ends2).properties(
+    health_plot = layer(occ, *lines, period_rules).properties(
         title='Comparing Trends in Time Use Among Healthcare Workers and Non-Healthcare Workers')
 
     return health_plot
 
 
-occ = load_data()
-plots = healthcare_plotter(occ)
+occ_shards = load_shards()
 
 st.header("Healthcare Worker Time Use")
 
-st.altair_chart(plots, use_container_width=True, theme=None)
+activity = st.selectbox('Select activity:', list(occ_shards))
+plots = spec(healthcare_plotter, occ_shards[activity], starts=load_starts())
+
+st.vega_lite_chart(plots, width='stretch', theme=None)
+
+st.markdown("This interactive chart allows for comparison between healthcare worker and non-healthcare worker time use from 2019-2021. The shaded bands are 95% confidence intervals. ")
+
+
+# finer slices need the ingest state (python -m atus.incremental init <extract>), skip them without it
+try:
+    cube = load_cube()
+except FileNotFoundError:
+    cube = None
+
+if cube is None:
+    st.subheader("Narrow it down by sex and age")
+    st.markdown("The published tables only break healthcare workers out by occupation, so narrowing this chart "
+                "down by sex and age needs the respondent-level data. Download an ATUS extract from "
+                "[IPUMS ATUS](https://www.atusdata.org) and build the ingest state with "
+                "`python -m atus.incremental init <extract>`; this section then appears below the chart.")
+else:
+    st.subheader("Narrow it down by sex and age")
+    sexes = st.multiselect('Sex', cube.members['SEX'])
+    ages = st.multiselect('Age group', cube.members['AGE_GROUP'])
+
+    sliced = cube.slice(by=['OCC_GROUP', 'MONTH_YEAR'], ACTIVITY=activity, SEX=sexes or None,
+                        AGE_GROUP=ages or None)
+    sliced['ACTIVITY'] = activity
+    sliced['PERIOD_ID'] = period_ids(sliced)
+
+    st.vega_lite_chart(spec(healthcare_plotter, sliced, starts=load_starts()), width='stretch', theme=None)
 
-st.markdown("This interactive chart allows for comparison between healthcare worker and non-healthcare worker time use from 2019-2021. ")
\ No newline at end of file
+warmup.prefetch(__file__)
+perf.end_page()
@@ -0,0 +1,110 @@
+import streamlit as st
+import altair as alt
+import pandas as pd
+
+from atus import perf, warmup
+from atus.charts import layer, spec, with_data
+from atus.crosscorr import MAX_LAG, national_correlations, state_correlations, strongest
+from atus.shards import split
+
+
+perf.start_page(__file__)
+warmup.start()
+
+# radio label -> trailing days the time use is averaged over before correlating (atus.moments.rolling)
+WINDOWS = {'1 day': 1, '7 days': 7, '28 days': 28}
+
+
+@perf.cache_resource
+def load_data(window=1):
+    # every region x activity x lag, worked out once per process (see atus.crosscorr).
+    # the states only show up once avg_time_state_byday.csv has been built from the extract
+    correlations = national_correlations(window=window)
+    try:
+        correlations = pd.concat([correlations, state_correlations(window=window)], ignore_index=True)
+    except FileNotFoundError:
+        pass
+    correlations['peak'] = strongest(correlations)
+    return correlations
+
+
+@perf.cache_resource
+def load_shards(window=1):
+    return split(load_data(window), 'REGION'), split(load_data(window), ['REGION', 'ACTIVITY'])
+
+
+def heatmap_plotter(correlations):
+    heatmap = alt.Chart().mark_rect().encode(
+        x=alt.X('lag:O', title='Lag in Days (Positive = Time Use Follows Stringency)',
+                axis=alt.Axis(values=list(range(-MAX_LAG, MAX_LAG + 1, 15)), labelAngle=0)),
+        y=alt.Y('ACTIVITY:N', title=None),
+        color=alt.Color('r:Q', title='Correlation',
+                        scale=alt.Scale(scheme='redblue', domain=[-0.4, 0.4], clamp=True)),
+        tooltip=[alt.Tooltip('ACTIVITY:N', title='Activity'), alt.Tooltip('lag:O', title='Lag (days)'),
+                 alt.Tooltip('r:Q', format='.3f', title='Correlation'),
+                 alt.Tooltip('pairs:Q', title='Days Compared')]
+    ).properties(title='Correlation Between Stringency and Daily Time Spent, by Lag', height=400)
+
+    return with_data(heatmap, correlations)
+
+
+def lag_plotter(correlations):
+    line = alt.Chart().mark_line(color='#4b6be5').encode(
+        x=alt.X('lag:Q', title='Lag in Days (Positive = Time Use Follows Stringency)',
+                scale=alt.Scale(domain=[-MAX_LAG, MAX_LAG])),
+        y=alt.Y('r:Q', title='Correlation'),
+        tooltip=[alt.Tooltip('lag:Q', title='Lag (days)'), alt.Tooltip('r:Q', format='.3f', title='Correlation')]
+    )
+
+    # same-day line, and the strongest lag marked
+    same_day = alt.Chart().mark_rule(strokeWidth=2.5, strokeDash=[1, 1], color='darkgrey').encode(
+        x='lag:Q'
+    ).transform_filter(alt.datum.lag == 0)
+
+    peak = alt.Chart().mark_point(filled=True, size=80, color='#67009b').encode(
+        x='lag:Q',
+        y='r:Q'
+    ).transform_filter(alt.datum.peak)
+
+    return layer(correlations, line, same_day, peak)
+
+
+st.header("Stringency and Time Use")
+st.subheader("Did tighter COVID-19 restrictions line up with changes in how we spent our days?")
+
+st.markdown(
+    """
+    The Oxford COVID-19 Government Response Tracker scores how strict each state's policies were every day (school and workplace closures, stay-at-home orders, travel limits and so on) on a 0-100 stringency index. Here we line that index up with the average minutes spent on each activity per day in 2020 and 2021, and shift one against the other by up to 90 days in either direction to see when the two move together.
+    """
+)
+
+region_col, window_col = st.columns(2)
+window = WINDOWS[window_col.radio('Average time use over:', list(WINDOWS), horizontal=True)]
+region_shards, activity_shards = load_shards(window)
+region = region_col.selectbox('Select region:', list(region_shards))
+st.vega_lite_chart(spec(heatmap_plotter, region_shards[region]), width='stretch', theme='streamlit')
+
+activity = st.selectbox('Select activity:', list(load_data(window)['ACTIVITY'].unique()))
+correlations = activity_shards[(region, activity)]
+st.vega_lite_chart(spec(lag_plotter, correlations), width='stretch', theme='streamlit')
+
+best = correlations[correlations['peak']]
+if len(best):
+    lag, r = int(best['lag'].iloc[0]), best['r'].iloc[0]
+    # a positive lag pairs each day's time use with the stringency from lag days before
+    when = 'the same day' if lag == 0 else '%d days %s' % (abs(lag), 'earlier' if lag > 0 else 'later')
+    place = 'the United States' if region == 'United States' else region
+    st.markdown("For %s, time spent on %s lines up most strongly with the stringency of %s (r = %.2f)."
+                % (place, activity.lower(), when, r))
+
+st.markdown(
+    """
+    - Blue squares mean more restrictions went with more time on that activity, red squares mean less. The further a square sits to the right, the longer after the stringency change the time use followed.
+    - Remember that correlation is not causation: stringency rose and fell with case counts, the seasons and everything else going on in 2020 and 2021.
+    - No interviews were collected between mid-March and mid-May 2020, so those days are left out of every comparison rather than filled in.
+    - A single day's average rests on a few dozen interviews, so it's noisy. Averaging time use over the last 7 or 28 days (pooling every interview in the window) smooths that out, at the cost of blurring exactly when a change happened.
+    """
+)
+
+warmup.prefetch(__file__)
+perf.end_page()
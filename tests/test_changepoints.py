@@ -0,0 +1,25 @@
+import numpy as np
+
+from atus.changepoints import SegmentCost, fixed_count, optimal, pelt
+
+
+def steps(*levels, length=50, seed=0):
+    # one activity column, length rows at each level, with a little noise
+    rng = np.random.default_rng(seed)
+    return np.repeat(levels, length)[:, None] + 0.1 * rng.standard_normal((len(levels) * length, 1))
+
+
+def test_pelt_finds_a_known_change_point():
+    assert pelt(SegmentCost(steps(0.0, 3.0)), penalty=10.0) == [50]
+
+
+def test_fixed_count_gives_the_requested_count():
+    assert fixed_count(SegmentCost(steps(0.0, 3.0, -2.0)), 2) == [50, 100]
+
+
+def test_fixed_count_falls_back_when_no_penalty_gives_the_count():
+    # low, high, low: one change point never pays for itself while two do, so PELT jumps from none
+    # to two and only the exact split can give one
+    cost = SegmentCost(steps(0.0, 5.0, 0.0))
+    assert fixed_count(cost, 1) == optimal(cost, 1)
+    assert optimal(cost, 1) in ([50], [100])
@@ -0,0 +1,50 @@
+import numpy as np
+
+from atus.crosscorr import lagged_correlations
+
+
+def pearson(x, y, lag):
+    # np.corrcoef of x[t] and y[t + lag] over the days where both are present
+    if lag >= 0:
+        a, b = x[:len(x) - lag], y[lag:]
+    else:
+        a, b = x[-lag:], y[:len(y) + lag]
+    both = ~np.isnan(a) & ~np.isnan(b)
+    return np.corrcoef(a[both], b[both])[0, 1], both.sum()
+
+
+def series(days=200, seed=0):
+    # y follows x five days later, with noise and a stretch of missing days in each
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.normal(size=days))
+    y = np.roll(x, 5) + rng.normal(scale=0.5, size=days)
+    x[60:75] = np.nan
+    y[100:130] = np.nan
+    return x, y
+
+
+def test_every_lag_matches_corrcoef():
+    x, y = series()
+    r, pairs = lagged_correlations(x, y, max_lag=20, min_pairs=10)
+    for i, lag in enumerate(range(-20, 21)):
+        expected, overlap = pearson(x, y, lag)
+        assert pairs[i] == overlap
+        assert np.isclose(r[i], expected, atol=1e-9), lag
+    assert np.argmax(r) - 20 == 5
+
+
+def test_batched_series_broadcast_against_one_stringency():
+    x, y = series()
+    ys = np.stack([y, -y, np.roll(y, 3)])
+    r, _ = lagged_correlations(x, ys, max_lag=10, min_pairs=10)
+    for row, other in enumerate(ys):
+        for i, lag in enumerate(range(-10, 11)):
+            assert np.isclose(r[row, i], pearson(x, other, lag)[0], atol=1e-9)
+
+
+def test_short_overlaps_and_flat_series_are_nan():
+    x, y = series()
+    r, pairs = lagged_correlations(x, y, max_lag=20, min_pairs=190)
+    assert np.isnan(r[pairs < 190]).all()
+    flat, _ = lagged_correlations(np.full(200, 3.0), y, max_lag=5)
+    assert np.isnan(flat).all()
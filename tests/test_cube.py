@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from atus.cube import DIMENSIONS, Cube
+
+MEMBERS = {
+    'MONTH_YEAR': ['Jan 2020', 'Feb 2020', 'Mar 2020'],
+    'SEX': ['Male', 'Female'],
+    'AGE_GROUP': ['15-24', '25-34', '35-44'],
+    'OCC_GROUP': ['Healthcare Worker', 'Non-Healthcare Worker'],
+    'ACTIVITY': ['Work', 'Traveling'],
+}
+
+
+def cube(seed=0):
+    # every combination of MEMBERS as a base cell, a few left out
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product([MEMBERS[d] for d in DIMENSIONS], names=DIMENSIONS)
+    cells = index.to_frame(index=False).sample(frac=0.9, random_state=seed).reset_index(drop=True)
+    n = rng.integers(1, 30, len(cells)).astype('float64')
+    cells['W'] = n * rng.uniform(500, 5000, len(cells))
+    cells['mean'] = rng.uniform(0, 300, len(cells))
+    cells['M2'] = cells['W'] * rng.uniform(0, 2000, len(cells))
+    cells['n'] = n
+    cells['nonzero'] = np.floor(n * rng.uniform(0, 1, len(cells)))
+    return Cube(cells)
+
+
+SLICES = [
+    (('MONTH_YEAR', 'ACTIVITY'), {}),
+    (('MONTH_YEAR', 'OCC_GROUP'), {'ACTIVITY': 'Work', 'SEX': 'Female'}),
+    (('ACTIVITY',), {'AGE_GROUP': '25-34', 'OCC_GROUP': 'Healthcare Worker'}),
+    (('SEX', 'AGE_GROUP'), {'ACTIVITY': 'Traveling', 'MONTH_YEAR': 'Feb 2020'}),
+]
+
+
+@pytest.mark.parametrize('by, filters', SLICES)
+def test_lookup_matches_scan(by, filters):
+    c = cube()
+    selected = tuple(sorted((dim, (value,)) for dim, value in filters.items()))
+    lookup, scan = c._lookup(by, dict(selected)), c._scan(by, dict(selected))
+    lookup = lookup.astype({col: str for col in by}).sort_values(list(by), ignore_index=True)
+    scan = scan[list(lookup.columns)].astype({col: str for col in by}).sort_values(list(by), ignore_index=True)
+    pd.testing.assert_frame_equal(lookup, scan, check_exact=False)
+
+
+def test_multiple_values_or_together():
+    c = cube()
+    both = c.slice(by=['MONTH_YEAR'], ACTIVITY='Work', AGE_GROUP=['15-24', '25-34'])
+    merged = c.slice(by=['MONTH_YEAR', 'AGE_GROUP'], ACTIVITY='Work')
+    merged = merged[merged['AGE_GROUP'].isin(['15-24', '25-34'])]
+    n = merged.groupby('MONTH_YEAR', observed=True)['n'].sum()
+    assert (both.set_index('MONTH_YEAR')['n'] == n).all()
+
+
+def test_a_filter_on_a_grouped_dimension_keeps_only_its_groups():
+    out = cube().slice(by=['SEX', 'MONTH_YEAR'], ACTIVITY='Work', SEX='Female')
+    assert set(out['SEX']) == {'Female'}
+    assert len(out) == 3
+
+
+def test_unknown_values_name_the_dimension():
+    with pytest.raises(KeyError, match='AGE_GROUP'):
+        cube().slice(ACTIVITY='Work', AGE_GROUP='12-14')
+    with pytest.raises(KeyError, match='unknown cube dimension'):
+        cube().slice(ACTIVITY='Work', RACE='Asian')
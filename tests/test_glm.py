@@ -0,0 +1,41 @@
+import numpy as np
+
+from atus.glm import irls
+
+
+def simulate(beta, n=20000, seed=0):
+    # poisson counts for every row of beta (one activity each) on an intercept and two covariates
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([np.ones(n), rng.integers(0, 2, n), rng.normal(0, 1, n)])
+    Y = rng.poisson(np.exp(X @ np.asarray(beta).T)).astype('float64')
+    return X, Y
+
+
+BETA = [[3.0, 0.5, -0.2], [1.0, -1.0, 0.3], [4.5, 0.0, 0.05]]
+
+
+def test_irls_recovers_known_coefficients():
+    X, Y = simulate(BETA)
+    beta, se = irls(X, Y)
+    assert beta.shape == se.shape == (3, 3)
+    assert np.all(np.abs(beta - BETA) < 4 * se)
+
+
+def test_irls_solves_the_score_equations():
+    # at the maximum likelihood estimate X'W(y - mu) = 0, with and without weights
+    X, Y = simulate(BETA, n=5000, seed=1)
+    weights = np.random.default_rng(2).uniform(0.5, 2.0, len(X))
+    for w in (None, weights):
+        beta, _ = irls(X, Y, w)
+        prior = np.ones(len(X)) if w is None else w / w.mean()
+        score = X.T @ (prior[:, None] * (Y - np.exp(X @ beta.T)))
+        assert np.allclose(score / len(X), 0.0, atol=1e-6)
+
+
+def test_quasipoisson_scales_the_errors_by_the_dispersion():
+    X, Y = simulate(BETA, n=5000, seed=3)
+    beta, se = irls(X, Y)
+    _, quasi = irls(X, Y, dispersion='quasipoisson')
+    mu = np.exp(X @ beta.T)
+    dispersion = ((Y - mu) ** 2 / mu).sum(axis=0) / (len(X) - X.shape[1])
+    assert np.allclose(quasi, se * np.sqrt(dispersion)[:, None])
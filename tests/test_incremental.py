@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from atus import incremental, ingest, sketch
+
+
+def extract(months, seed):
+    # a csv export with a few respondents on every day of the given (year, month)s
+    rng = np.random.default_rng(seed)
+    dates = pd.DatetimeIndex([])
+    for year, month in months:
+        start = pd.Timestamp(year=year, month=month, day=1)
+        dates = dates.append(pd.date_range(start, start + pd.offsets.MonthEnd(0), freq='D'))
+    dates = dates.repeat(3)
+    rows = pd.DataFrame({
+        'YEAR': dates.year,
+        'STATEFIP': rng.choice([6, 36, 48], len(dates)),
+        'MONTH': dates.month,
+        'DAY': dates.dayofweek + 1,
+        'HOLIDAY': (rng.random(len(dates)) < 0.05).astype(int),
+        'DATE': dates.strftime('%Y%m%d').astype('int64'),
+        'WT06': rng.uniform(1000, 9000, len(dates)),
+        'WT20': rng.uniform(1000, 9000, len(dates)),
+        'AGE': rng.integers(15, 85, len(dates)),
+        'SEX': rng.integers(1, 3, len(dates)),
+        'RACE': 100,
+        'MARST': 1,
+        'EDUC': 73,
+        'OCC2': rng.choice([127, 130, 10, 40], len(dates)),
+    })
+    for col in ingest.ACTIVITIES:
+        rows[col] = np.where(rng.random(len(dates)) < 0.4, 0, rng.integers(1, 600, len(dates)))
+    return rows
+
+
+def write(rows, path):
+    rows.to_csv(path, index=False)
+    return str(path)
+
+
+TABLES = ['monthly_combined', 'avg_time_all_years_bymonth_occ', 'waterfall', 'med_time_bymonth']
+
+
+def tables(state, sketches):
+    # every month-level table, written and read back the way the pages see them
+    ingest.build_tables(state, incremental.DATA_DIR, [t for t in TABLES if t in ingest.TABLES])
+    incremental._write(sketch.med_time_bymonth(sketches), 'med_time_bymonth')
+    return {name: incremental._read_table(name) for name in TABLES}
+
+
+def same(got, expected):
+    got = got.sort_values(list(got.columns[:4]), ignore_index=True)
+    expected = expected[list(got.columns)].sort_values(list(got.columns[:4]), ignore_index=True)
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False, check_exact=False)
+
+
+@pytest.fixture
+def releases(tmp_path, monkeypatch):
+    monkeypatch.setattr(incremental, 'DATA_DIR', str(tmp_path))
+    old = extract([(2019, 11), (2019, 12), (2020, 1), (2020, 2)], seed=0)
+    # the new release revises February and adds March
+    new = extract([(2020, 2), (2020, 3)], seed=1)
+    full = pd.concat([old[old['DATE'] < 20200201], new], ignore_index=True)
+    return [write(df, tmp_path / name) for df, name in ((old, 'old.csv'), (new, 'new.csv'), (full, 'full.csv'))]
+
+
+def test_refresh_matches_a_full_rebuild(releases):
+    old, new, full = releases
+    expected = tables(*sketch.ingest(full, chunksize=500))
+
+    tables(*sketch.ingest(old, chunksize=500))
+    state, sketches = sketch.ingest(new, chunksize=500)
+    months = sorted(incremental._month_keys(state['DATE']).unique())
+    assert months == ['2020-02', '2020-03']
+    for name in TABLES:
+        source = sketches if name in incremental.SKETCH_TABLES else state
+        incremental._write(incremental.REFRESHERS[name](source, months), name)
+        same(incremental._read_table(name), expected[name])
+
+
+def test_partitions_swap_whole_months(releases, tmp_path):
+    old, new, full = releases
+    directory = str(tmp_path / 'state')
+    incremental.save_partitions(ingest.ingest(old), directory)
+    assert incremental.save_partitions(ingest.ingest(new), directory) == ['2020-02', '2020-03']
+    assert incremental.partition_months(directory) == ['2019-11', '2019-12', '2020-01', '2020-02', '2020-03']
+
+    keys = ['DATE', 'SEX', 'AGE_GROUP', 'OCC_GROUP', 'ACTIVITY', 'HOLIDAY']
+    got = incremental.load_state(directory=directory)
+    expected = ingest.ingest(full)
+    got = got.astype({k: str for k in keys}).sort_values(keys, ignore_index=True)
+    expected = expected.astype({k: str for k in keys}).sort_values(keys, ignore_index=True)
+    pd.testing.assert_frame_equal(got, expected[list(got.columns)], check_dtype=False)
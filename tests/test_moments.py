@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+from atus.moments import Moments, resample, rolling
+
+
+def direct(x, w):
+    # weighted mean and the n/(n-1) corrected weighted variance, straight from the values
+    mean = np.average(x, weights=w)
+    return mean, np.sum(w * (x - mean) ** 2) / np.sum(w) * len(x) / (len(x) - 1)
+
+
+def cells(x, w, codes):
+    # one Moments cell per group of raw values
+    weight, mean, m2, n = [], [], [], []
+    for c in np.unique(codes):
+        xc, wc = x[codes == c], w[codes == c]
+        m = np.average(xc, weights=wc)
+        weight.append(wc.sum())
+        mean.append(m)
+        m2.append(np.sum(wc * (xc - m) ** 2))
+        n.append(len(xc))
+    return Moments(weight, mean, m2, n)
+
+
+def sample(size=400, groups=12, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.gamma(2.0, 30.0, size), rng.uniform(0.5, 3.0, size), rng.integers(0, groups, size)
+
+
+def test_add_merges_two_cells_exactly():
+    x, w, codes = sample()
+    half = codes < 6
+    merged = cells(x[half], w[half], np.zeros(half.sum())) + cells(x[~half], w[~half], np.zeros((~half).sum()))
+    mean, var = direct(x, w)
+    assert np.allclose(merged.mean, mean)
+    assert np.allclose(merged.var(), var)
+    assert merged.n[0] == len(x)
+
+
+def test_reduce_matches_the_pooled_values():
+    x, w, codes = sample()
+    parts = cells(x, w, codes)
+    # cells 0-3 -> group 0, 4-7 -> 1, 8-11 -> 2
+    merged = parts.reduce(np.arange(12) // 4, 3)
+    for g in range(3):
+        keep = codes // 4 == g
+        mean, var = direct(x[keep], w[keep])
+        assert np.allclose(merged.mean[g], mean)
+        assert np.allclose(merged.var()[g], var)
+
+
+def test_rolling_matches_each_window():
+    x, w, codes = sample(size=600, groups=30, seed=1)
+    days = cells(x, w, codes)
+    window = days.rolling(7)
+    for end in (0, 3, 6, 7, 18, 29):
+        keep = (codes > end - 7) & (codes <= end)
+        mean, var = direct(x[keep], w[keep])
+        assert np.allclose(window.mean[end], mean)
+        assert np.allclose(window.var()[end], var)
+
+
+def test_from_mean_sd_round_trips():
+    mean, sd, n = np.array([10.0, 20.0]), np.array([3.0, 4.0]), np.array([5, 8])
+    m = Moments.from_mean_sd(mean, sd, n)
+    assert np.allclose(m.mean, mean)
+    assert np.allclose(m.sd(), sd)
+
+
+def daily_table(seed=2):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-01-01', '2020-03-31', freq='D')
+    df = pd.DataFrame({'DATE': np.repeat(dates, 2), 'ACTIVITY': np.tile(['Work', 'Sleep'], len(dates))})
+    df['mean'] = rng.uniform(0, 500, len(df))
+    df['sd'] = rng.uniform(10, 100, len(df))
+    df['n'] = rng.integers(5, 40, len(df)).astype('float64')
+    return df
+
+
+def test_resample_to_months_pools_the_days():
+    daily = daily_table()
+    monthly = resample(daily, 'month').set_index(['DATE', 'ACTIVITY'])
+    for (month, activity), part in daily.groupby([daily['DATE'].dt.to_period('M').dt.start_time, 'ACTIVITY']):
+        expected = Moments.from_frame(part).reduce(np.zeros(len(part), dtype=int), 1)
+        row = monthly.loc[(month, activity)]
+        assert np.isclose(row['mean'], expected.mean[0])
+        assert np.isclose(row['sd'], expected.sd()[0])
+        assert row['n'] == part['n'].sum()
+
+
+def test_rolling_frame_of_one_day_is_the_table():
+    daily = daily_table()
+    out = rolling(daily, 1).sort_values(['DATE', 'ACTIVITY'], ignore_index=True)
+    expected = daily.sort_values(['DATE', 'ACTIVITY'], ignore_index=True)
+    assert np.allclose(out['mean'], expected['mean'])
+    assert np.allclose(out['sd'], expected['sd'])
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+from atus.significance import adjust, welch
+
+
+def holm(p):
+    # step-down by hand: p_(i) * (m - i + 1), running max, capped at 1
+    order = np.argsort(p)
+    out, running = np.empty(len(p)), 0.0
+    for i, j in enumerate(order):
+        running = max(running, p[j] * (len(p) - i))
+        out[j] = min(running, 1.0)
+    return out
+
+
+def test_welch_matches_scipy():
+    rng = np.random.default_rng(0)
+    mean1, mean2 = rng.uniform(0, 100, 20), rng.uniform(0, 100, 20)
+    sd1, sd2 = rng.uniform(1, 50, 20), rng.uniform(1, 50, 20)
+    n1, n2 = rng.integers(2, 500, 20), rng.integers(2, 500, 20)
+    t, df, p = welch(mean1, sd1, n1, mean2, sd2, n2)
+    expected = stats.ttest_ind_from_stats(mean1, sd1, n1, mean2, sd2, n2, equal_var=False)
+    assert np.allclose(t, expected.statistic)
+    assert np.allclose(p, expected.pvalue)
+
+
+def test_welch_without_spread_is_nan():
+    t, df, p = welch([1.0], [0.0], [10], [1.0], [0.0], [10])
+    assert np.isnan(p).all()
+
+
+@pytest.mark.parametrize('method', ['bonferroni', 'holm', 'bh'])
+def test_adjust_matches_the_textbook_corrections(method):
+    p = np.random.default_rng(1).uniform(0, 0.2, 30)
+    expected = {'bonferroni': np.minimum(p * len(p), 1.0), 'holm': holm(p),
+                'bh': stats.false_discovery_control(p, method='bh')}[method]
+    assert np.allclose(adjust(p, method), expected)
+
+
+def test_adjust_corrects_each_family_on_its_own_and_skips_nan():
+    rng = np.random.default_rng(2)
+    p = rng.uniform(0, 0.1, 12)
+    p[[3, 8]] = np.nan
+    groups = np.repeat(['a', 'b', 'c'], 4)
+    out = adjust(p, 'bh', groups)
+    assert np.isnan(out[[3, 8]]).all()
+    for g in 'abc':
+        family = (groups == g) & ~np.isnan(p)
+        assert np.allclose(out[family], stats.false_discovery_control(p[family], method='bh'))
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from atus.sketch import merge, quantiles
+
+QS = (0.0, 0.1, 0.5, 0.9, 0.99, 1.0)
+
+
+def centroids(groups, size, seed=0):
+    # one single-respondent centroid per row, about a third of them zeros, survey-like weights
+    rng = np.random.default_rng(seed)
+    frames = []
+    for g in range(groups):
+        x = rng.gamma(2.0, 30.0, size).round()
+        x[rng.random(size) < 0.3] = 0
+        frames.append(pd.DataFrame({'g': g, 'W': rng.uniform(500, 5000, size), 'n': 1, 'mean': x, 'low': x, 'high': x}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def exact(sketch, q, nonzero=False):
+    rows = sketch[sketch['high'] > 0] if nonzero else sketch
+    return rows.groupby('g').apply(
+        lambda part: float(np.quantile(part['mean'], q, weights=part['W'], method='inverted_cdf')))
+
+
+@pytest.mark.parametrize('nonzero', [False, True])
+def test_quantiles_are_exact_below_the_compression_limit(nonzero):
+    # fewer respondents per group than centroids, so nothing is merged and every quantile is a value
+    sketch = centroids(6, 30)
+    out = quantiles(sketch, ['g'], QS, nonzero=nonzero).set_index('g')
+    for q in QS:
+        assert np.allclose(out['p%g' % (100 * q)], exact(sketch, q, nonzero)), q
+
+
+def test_quantiles_of_a_compressed_sketch_stay_close():
+    sketch = merge(centroids(3, 5000, seed=1), by=['g'])
+    assert sketch.groupby('g').size().max() <= 102
+    full = centroids(3, 5000, seed=1)
+    out = quantiles(sketch, ['g'], QS).set_index('g')
+    assert np.allclose(out['p0'], exact(full, 0.0))
+    assert np.allclose(out['p100'], exact(full, 1.0))
+    for q in (0.5, 0.9, 0.99):
+        assert np.allclose(out['p%g' % (100 * q)], exact(full, q), rtol=0.05), q
+
+
+def test_zero_share_is_exact():
+    sketch = centroids(4, 200)
+    share = quantiles(merge(sketch, by=['g']), ['g'], [0.5]).set_index('g')['nonzero_share']
+    expected = sketch.groupby('g').apply(lambda part: part['W'][part['high'] > 0].sum() / part['W'].sum())
+    assert np.allclose(share, expected)
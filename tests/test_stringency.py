@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from atus.stringency import Stringency
+
+
+def observations(seed=0):
+    # a few states with gappy daily stringency, one of them starting late
+    rng = np.random.default_rng(seed)
+    frames = []
+    for state, start in ((0, '2020-01-01'), (6, '2020-01-20'), (36, '2020-03-01')):
+        dates = pd.date_range(start, '2020-06-30', freq='D')
+        dates = dates[rng.random(len(dates)) < 0.6]
+        frames.append(pd.DataFrame({'state': state, 'date': dates, 'value': rng.uniform(0, 100, len(dates))}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def queries(seed=1):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'state': rng.choice([0, 6, 36, 48], 500),
+                         'date': pd.Timestamp('2019-12-15') + pd.to_timedelta(rng.integers(0, 220, 500), 'D')})
+
+
+def as_of(obs, rows, lag=0, tolerance=None):
+    # pd.merge_asof by state, the reference for every lookup
+    left = rows.assign(when=rows['date'] - pd.Timedelta(days=lag), row=np.arange(len(rows))).sort_values('when')
+    right = obs.rename(columns={'date': 'when'}).sort_values('when')
+    merged = pd.merge_asof(left, right, on='when', by='state', direction='backward',
+                           tolerance=None if tolerance is None else pd.Timedelta(days=tolerance))
+    return merged.sort_values('row')['value'].to_numpy()
+
+
+@pytest.mark.parametrize('lag, tolerance', [(0, None), (14, None), (0, 3), (7, 1)])
+def test_lookup_matches_merge_asof(lag, tolerance):
+    obs, rows = observations(), queries()
+    stringency = Stringency.from_arrays(obs['state'], obs['date'], obs['value'])
+    got = stringency.lookup(rows['state'].to_numpy(), rows['date'], lag, tolerance)
+    assert np.allclose(got, as_of(obs, rows, lag, tolerance), equal_nan=True)
+
+
+def test_rolling_is_the_mean_of_the_trailing_days():
+    obs = observations()
+    rolled = Stringency.from_arrays(obs['state'], obs['date'], obs['value']).rolling(7)
+    for state, part in obs.groupby('state'):
+        expected = part.set_index('date')['value'].rolling('7D').mean().to_numpy()
+        assert np.allclose(rolled.lookup(state, part['date']), expected)